@@ -0,0 +1,125 @@
+"""balance reservations
+
+Revision ID: 3f9a1c7b5d2e
+Revises: e1ade206e332
+Create Date: 2026-10-18 09:00:00.000000
+
+"""
+import logging
+from typing import Sequence, Union
+
+from alembic import context, op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '3f9a1c7b5d2e'
+down_revision: Union[str, None] = 'e1ade206e332'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+logger = logging.getLogger("alembic.runtime.migration")
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1) Рублёвый баланс — отдельный тикер, им оплачиваются покупки
+    op.execute("""
+        INSERT INTO instruments (ticker, name, currency, current_price)
+        VALUES ('RUB', 'Российский рубль', 'RUB', 1)
+        ON CONFLICT (ticker) DO NOTHING
+    """)
+
+    # 2) Склеиваем дубли (user_id, ticker) перед уникальным ограничением
+    op.execute("""
+        WITH merged AS (
+            SELECT user_id, ticker, min(id::text)::uuid AS keep_id, sum(amount) AS total
+            FROM balances
+            GROUP BY user_id, ticker
+            HAVING count(*) > 1
+        )
+        UPDATE balances b SET amount = m.total
+        FROM merged m
+        WHERE b.id = m.keep_id
+    """)
+    op.execute("""
+        DELETE FROM balances b
+        USING (
+            SELECT user_id, ticker, min(id::text)::uuid AS keep_id
+            FROM balances
+            GROUP BY user_id, ticker
+            HAVING count(*) > 1
+        ) m
+        WHERE b.user_id = m.user_id AND b.ticker = m.ticker AND b.id <> m.keep_id
+    """)
+    op.create_unique_constraint('uq_balances_user_id_ticker', 'balances', ['user_id', 'ticker'])
+
+    # 3) Заблокированная под активные заявки часть баланса
+    op.add_column(
+        'balances',
+        sa.Column(
+            'locked',
+            sa.Integer(),
+            nullable=False,
+            server_default='0',
+            comment='Заблокировано под активные заявки',
+        ),
+    )
+
+    # 4) Резервируем средства под уже стоящие лимитные заявки. Раньше ничего
+    #    не блокировалось, а рублёвых балансов не было вовсе, поэтому заявки
+    #    не отменяются: резерв каждой восстанавливается целиком. Покрытая
+    #    свободным остатком часть переносится в locked, непокрытая зачисляется
+    #    в locked (свободный остаток не уходит в минус)
+    op.execute("""
+        CREATE TEMPORARY TABLE order_holds AS
+        SELECT user_id, hold_ticker, count(*) AS orders, sum(hold_amount) AS total
+        FROM (
+            SELECT user_id,
+                   CASE WHEN side = 'BUY' THEN 'RUB' ELSE ticker END AS hold_ticker,
+                   CASE WHEN side = 'BUY' THEN (quantity - filled_qty) * price
+                        ELSE quantity - filled_qty END AS hold_amount
+            FROM orders
+            WHERE status IN ('NEW', 'PARTIALLY_EXECUTED') AND price IS NOT NULL
+        ) h
+        GROUP BY user_id, hold_ticker
+    """)
+
+    if not context.is_offline_mode():
+        uncovered = op.get_bind().execute(sa.text("""
+            SELECT h.user_id, h.hold_ticker, h.orders, h.total - coalesce(b.amount, 0) AS amount
+            FROM order_holds h
+            LEFT JOIN balances b ON b.user_id = h.user_id AND b.ticker = h.hold_ticker
+            WHERE h.total > coalesce(b.amount, 0)
+            ORDER BY h.user_id, h.hold_ticker
+        """)).all()
+        for row in uncovered:
+            logger.warning(
+                "Резерв без покрытия зачислен: user_id=%s, %s, заявок %d, зачислено %d",
+                row.user_id, row.hold_ticker, row.orders, row.amount,
+            )
+
+    op.execute("""
+        INSERT INTO balances (id, user_id, ticker, amount)
+        SELECT gen_random_uuid(), user_id, hold_ticker, 0
+        FROM order_holds
+        ON CONFLICT (user_id, ticker) DO NOTHING
+    """)
+    op.execute("""
+        UPDATE balances b
+        SET amount = b.amount - least(b.amount, h.total),
+            locked = b.locked + h.total
+        FROM order_holds h
+        WHERE b.user_id = h.user_id AND b.ticker = h.hold_ticker
+    """)
+    op.execute("DROP TABLE order_holds")
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    # Возвращаем заблокированное в свободный остаток
+    op.execute("UPDATE balances SET amount = amount + locked WHERE locked <> 0")
+    op.drop_column('balances', 'locked')
+    op.drop_constraint('uq_balances_user_id_ticker', 'balances', type_='unique')
+    op.execute("DELETE FROM balances WHERE ticker = 'RUB'")
+    op.execute("DELETE FROM instruments WHERE ticker = 'RUB'")
@@ -0,0 +1,81 @@
+"""hot path indexes
+
+Revision ID: 7c2e4b9a1f30
+Revises: 3f9a1c7b5d2e
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = '7c2e4b9a1f30'
+down_revision: Union[str, None] = '3f9a1c7b5d2e'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Уникальный (user_id, ticker) на balances уже добавлен в 3f9a1c7b5d2e
+
+INDEXES = [
+    # Стакан: только живые заявки — индекс остаётся маленьким при любой истории
+    dict(
+        index_name='ix_orders_live_book',
+        table_name='orders',
+        columns=['ticker', 'side', 'price', 'created_at'],
+        postgresql_where=sa.text("status IN ('NEW', 'PARTIALLY_EXECUTED')"),
+    ),
+    # История заявок пользователя
+    dict(
+        index_name='ix_orders_user_id_created_at',
+        table_name='orders',
+        columns=['user_id', 'created_at'],
+    ),
+    # Лента сделок по тикеру, свежие первыми
+    dict(
+        index_name='ix_transactions_ticker_timestamp',
+        table_name='transactions',
+        columns=['ticker', sa.text('timestamp DESC')],
+    ),
+    # FK на заявки (удаление заявок, сделки по заявке)
+    dict(
+        index_name='ix_transactions_buy_order_id',
+        table_name='transactions',
+        columns=['buy_order_id'],
+    ),
+    dict(
+        index_name='ix_transactions_sell_order_id',
+        table_name='transactions',
+        columns=['sell_order_id'],
+    ),
+]
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # CONCURRENTLY не блокирует запись в горячие таблицы, но не работает в транзакции
+    with op.get_context().autocommit_block():
+        for spec in INDEXES:
+            op.create_index(
+                spec['index_name'],
+                spec['table_name'],
+                spec['columns'],
+                unique=False,
+                postgresql_where=spec.get('postgresql_where'),
+                postgresql_concurrently=True,
+                if_not_exists=True,
+            )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    with op.get_context().autocommit_block():
+        for spec in reversed(INDEXES):
+            op.drop_index(
+                spec['index_name'],
+                table_name=spec['table_name'],
+                postgresql_concurrently=True,
+                if_exists=True,
+            )
@@ -0,0 +1,48 @@
+"""order book events
+
+Revision ID: b41d7e2c9a58
+Revises: 7c2e4b9a1f30
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'b41d7e2c9a58'
+down_revision: Union[str, None] = '7c2e4b9a1f30'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Журнал стаканов: проигрывается поверх снимка при старте, чистится после снимка
+    op.create_table(
+        'order_book_events',
+        sa.Column('id', sa.BigInteger(), autoincrement=True, nullable=False),
+        sa.Column('ticker', sa.String(), nullable=False),
+        sa.Column('order_id', sa.UUID(), nullable=False),
+        sa.Column('user_id', sa.UUID(), nullable=False),
+        sa.Column(
+            'side',
+            postgresql.ENUM('BUY', 'SELL', name='ordersideenum', create_type=False),
+            nullable=False,
+        ),
+        sa.Column('price', sa.Integer(), nullable=False),
+        sa.Column('quantity', sa.Integer(), nullable=False),
+        sa.Column('filled', sa.Integer(), nullable=False),
+        sa.Column('live', sa.Boolean(), nullable=False, comment='False — заявка ушла из стакана'),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_order_book_events_ticker_id', 'order_book_events', ['ticker', 'id'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_order_book_events_ticker_id', table_name='order_book_events')
+    op.drop_table('order_book_events')
@@ -0,0 +1,64 @@
+"""candles
+
+Revision ID: d2a8f61c4e07
+Revises: b41d7e2c9a58
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'd2a8f61c4e07'
+down_revision: Union[str, None] = 'b41d7e2c9a58'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+# Как app.candles.INTERVALS на момент миграции
+INTERVALS = {'1s': 1, '1m': 60, '5m': 300, '1h': 3600, '1d': 86400}
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # 1) Таблица баров; PK (ticker, interval, open_time) обслуживает выборки графиков
+    op.create_table(
+        'candles',
+        sa.Column('ticker', sa.String(), nullable=False),
+        sa.Column('interval', sa.String(), nullable=False),
+        sa.Column('open_time', sa.DateTime(timezone=True), nullable=False),
+        sa.Column('open', sa.Integer(), nullable=False),
+        sa.Column('high', sa.Integer(), nullable=False),
+        sa.Column('low', sa.Integer(), nullable=False),
+        sa.Column('close', sa.Integer(), nullable=False),
+        sa.Column('volume', sa.BigInteger(), nullable=False),
+        sa.PrimaryKeyConstraint('ticker', 'interval', 'open_time'),
+    )
+
+    # 2) Бары по уже накопленным сделкам; границы — как у app.candles.bucket()
+    for name, seconds in INTERVALS.items():
+        op.execute(f"""
+            INSERT INTO candles (ticker, interval, open_time, open, high, low, close, volume)
+            SELECT ticker,
+                   '{name}',
+                   open_time,
+                   (array_agg(price ORDER BY timestamp, id))[1],
+                   max(price),
+                   min(price),
+                   (array_agg(price ORDER BY timestamp DESC, id DESC))[1],
+                   sum(quantity)
+            FROM (
+                SELECT ticker, price, quantity, timestamp, id,
+                       date_bin(interval '{seconds} seconds', timestamp,
+                                timestamptz '1970-01-01 00:00:00+00') AS open_time
+                FROM transactions
+            ) t
+            GROUP BY ticker, open_time
+        """)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_table('candles')
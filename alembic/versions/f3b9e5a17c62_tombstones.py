@@ -0,0 +1,44 @@
+"""tombstones for users and instruments
+
+Revision ID: f3b9e5a17c62
+Revises: d2a8f61c4e07
+Create Date: 2026-10-18 14:00:00.000000
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'f3b9e5a17c62'
+down_revision: Union[str, None] = 'd2a8f61c4e07'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+COMMENT = 'Удалён (tombstone); данные дочищает фоновый reaper'
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    # Nullable-колонка без default: ALTER без перезаписи таблицы
+    op.add_column('users', sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True, comment=COMMENT))
+    op.add_column('instruments', sa.Column('deleted_at', sa.DateTime(timezone=True), nullable=True, comment=COMMENT))
+    # Reaper ищет только удалённые — partial index остаётся крошечным
+    op.create_index(
+        'ix_users_deleted', 'users', ['deleted_at'],
+        postgresql_where=sa.text('deleted_at IS NOT NULL'),
+    )
+    op.create_index(
+        'ix_instruments_deleted', 'instruments', ['deleted_at'],
+        postgresql_where=sa.text('deleted_at IS NOT NULL'),
+    )
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_instruments_deleted', table_name='instruments')
+    op.drop_index('ix_users_deleted', table_name='users')
+    op.drop_column('instruments', 'deleted_at')
+    op.drop_column('users', 'deleted_at')
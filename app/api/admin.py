@@ -1,82 +1,107 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from uuid import UUID
+import csv
+import io
+import json
+from datetime import datetime, timezone
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from typing import Any, Dict, List, Optional, Set, Tuple, Type, TypeVar
+from uuid import UUID, uuid4
 
-from sqlalchemy import select, update, delete
+from pydantic import BaseModel, ValidationError
+from sqlalchemy import select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.deps import get_current_user, get_db
-from app.models import User, Instrument, Balance, Order, Transaction
+from app import ledger
+from app.db import pool_stats
+from app.deps import AuthUser, get_current_principal, get_current_user, get_db
+from app.instruments import InstrumentInfo, instrument_registry
+from app.matching import matching_engine
+from app.models import User, Instrument, Balance, Order, Transaction, RoleEnum, InstrumentStatusEnum
 from app.schemas import (
     Instrument as InstrumentSchema,
-    UserOut,WithdrawBody,DepositBody,Ok,
+    UserOut,WithdrawBody,DepositBody,Ok,PoolStats,NewUser,
+    BulkRowResult,BulkUserResult,BulkUsersResponse,BulkDepositResponse,
 )
 
 router = APIRouter(prefix="/api/v1/admin", tags=["Admin"])
 
 
 async def get_current_admin(
-    user_id: UUID = Depends(get_current_user),  # Получаем user_id из get_current_user
-    db: AsyncSession = Depends(get_db),
-) -> User:
-    # Берём пользователя из БД и проверяем роль
-    stmt = select(User).where(User.id == user_id)
-    res = await db.execute(stmt)
-    user = res.scalar_one_or_none()
-    if not user or user.role != "ADMIN":
+    principal: AuthUser = Depends(get_current_principal),  # id и роль из кэша аутентификации
+) -> AuthUser:
+    # Роль уже известна после проверки API-ключа — второй SELECT не нужен
+    if principal.role != RoleEnum.ADMIN:
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Only admins may call this endpoint"
         )
-    return user
-
-
-
-    @router.post("/instrument", response_model=Ok, status_code=status.HTTP_201_CREATED)
-    async def add_instrument(
-        instr: Instrument,
-        _admin: User = Depends(get_current_admin),
-        db: AsyncSession = Depends(get_db),
-    ):
-        # Проверка уникальности
-        stmt = select(Instrument).where(Instrument.ticker == instr.ticker)
-        
-        # Дожидаемся выполнения запроса
-        result = await db.execute(stmt)
-        instrument = result.scalar_one_or_none()
-
-        if instrument:
-            raise HTTPException(status_code=409,
-                                detail=f"Instrument {instr.ticker} already exists")
-        
-        # Создаём новый инструмент
-        new = Instrument(ticker=instr.ticker, name=instr.name)
-        db.add(new)
+    return principal
+
+
+@router.post("/instrument", response_model=Ok, status_code=status.HTTP_201_CREATED)
+async def add_instrument(
+    instr: InstrumentSchema,
+    _admin: AuthUser = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    # Уникальность проверяет первичный ключ; справочник других воркеров
+    # обновится по NOTIFY после коммита
+    db.add(Instrument(ticker=instr.ticker, name=instr.name, currency=instr.currency))
+    await instrument_registry.notify(db, instr.ticker)
+    try:
         await db.commit()
-        return Ok()
+    except IntegrityError:
+        await db.rollback()
+        raise HTTPException(status_code=409,
+                            detail=f"Instrument {instr.ticker} already exists")
+
+    instrument_registry.put(InstrumentInfo(
+        ticker=instr.ticker, name=instr.name,
+        status=InstrumentStatusEnum.ACTIVE, currency=instr.currency,
+    ))
+    return Ok()
 
 
 @router.delete("/instrument/{ticker}", response_model=Ok)
 async def delete_instrument(
     ticker: str,
-    admin: User = Depends(get_current_admin),
+    admin: AuthUser = Depends(get_current_admin),
     db: AsyncSession = Depends(get_db),
 ):
-    # Удаляем инструмент (cascade удалит связанные балансы/ордеры/транзакции)
-    stmt = delete(Instrument).where(Instrument.ticker == ticker)
+    # 1) Tombstone: инструмент пропадает из справочников всех воркеров,
+    #    балансы, заявки и историю пачками дочищает фоновый reaper
+    stmt = (
+        update(Instrument)
+        .where(Instrument.ticker == ticker, Instrument.deleted_at.is_(None))
+        .values(deleted_at=datetime.now(timezone.utc))
+    )
     res = await db.execute(stmt)
     if res.rowcount == 0:
         raise HTTPException(status_code=404, detail="Instrument not found")
+    await instrument_registry.notify(db, ticker)
     await db.commit()
+    instrument_registry.discard(ticker)
+
+    # 2) Снимаем с торгов, если стакан в этом процессе (иначе — reaper владельца)
+    await matching_engine.delist(ticker)
     return Ok()
 
 
+@router.get("/db/pool", response_model=PoolStats)
+async def get_pool_stats(
+    _admin: AuthUser = Depends(get_current_admin),
+):
+    """Загрузка пула соединений с БД в этом воркере."""
+    return PoolStats(**pool_stats())
+
+
 @router.get("/users", response_model=List[UserOut])
 async def list_users(
-    _admin: User = Depends(get_current_admin),
+    _admin: AuthUser = Depends(get_current_admin),
     db: AsyncSession = Depends(get_db),
 ):
-    stmt = select(User)
+    stmt = select(User).where(User.deleted_at.is_(None))
     res = await db.execute(stmt)
     users = res.scalars().all()
     return [UserOut.model_validate(u) for u in users]
@@ -86,19 +111,11 @@ async def list_users(
 @router.post("/balance/deposit", response_model=Ok)
 async def deposit(
     body: DepositBody,
-    _admin: User = Depends(get_current_admin),
+    _admin: AuthUser = Depends(get_current_admin),
     db: AsyncSession = Depends(get_db),
 ):
-    # 1) Проверяем, что пользователь есть
-    stmt_u = select(User).where(User.id == body.user_id)
-    result_u = await db.execute(stmt_u)
-    if not result_u.scalar_one_or_none():
-        raise HTTPException(status_code=404, detail="User not found")
-
-    # 2) Проверяем, что инструмент существует и в рублях
-    stmt_i = select(Instrument).where(Instrument.ticker == body.ticker)
-    result_i = await db.execute(stmt_i)
-    inst = result_i.scalar_one_or_none()
+    # 1) Проверяем, что инструмент существует и в рублях (справочник в памяти)
+    inst = instrument_registry.get(body.ticker)
     if not inst:
         raise HTTPException(status_code=404, detail="Instrument not found")
     if inst.currency != "RUB":
@@ -107,28 +124,16 @@ async def deposit(
             detail=f"Instrument {body.ticker} is not traded in RUB"
         )
 
-    # 3) Обновляем или создаём запись баланса
-    stmt_b = select(Balance).where(
-        Balance.user_id == body.user_id,
-        Balance.ticker == body.ticker
-    )
-    result_b = await db.execute(stmt_b)
-    balance = result_b.scalar_one_or_none()
-
-    if balance:
-        new_amount = balance.amount + body.amount
-        await db.execute(
-            update(Balance)
-            .where(Balance.id == balance.id)
-            .values(amount=new_amount)
-        )
-    else:
-        db.add(Balance(
-            user_id=body.user_id,
-            ticker=body.ticker,
-            amount=body.amount
-        ))
-
+    # 2) Создаём или пополняем баланс одним INSERT ... SELECT ... ON CONFLICT DO UPDATE;
+    # нет строки — пользователя нет или он удалён; нарушение внешнего ключа —
+    # reaper удалил его между SELECT и вставкой
+    try:
+        credited = await ledger.deposit(db, body.user_id, body.ticker, body.amount)
+    except IntegrityError:
+        credited = None
+    if credited is None:
+        await db.rollback()
+        raise HTTPException(status_code=404, detail="User not found")
     await db.commit()
     return Ok()
 
@@ -136,26 +141,192 @@ async def deposit(
 @router.post("/balance/withdraw", response_model=Ok)
 async def withdraw(
     body: WithdrawBody,
-    _admin: User = Depends(get_current_admin),
+    _admin: AuthUser = Depends(get_current_admin),
     db: AsyncSession = Depends(get_db),
 ):
-    # 1) Проверяем баланс
-    stmt_b = select(Balance).where(
-        Balance.user_id == body.user_id,
-        Balance.ticker == body.ticker
-    )
-    result_b = await db.execute(stmt_b)
-    balance = result_b.scalar_one_or_none()
-    if not balance:
-        raise HTTPException(status_code=404, detail="Balance not found")
-    if balance.amount < body.amount:
-        raise HTTPException(status_code=400, detail="Insufficient funds")
+    # 1) Инструмент — по справочнику в памяти
+    if body.ticker not in instrument_registry:
+        raise HTTPException(status_code=404, detail="Instrument not found")
 
-    # 2) Списываем
-    await db.execute(
-        update(Balance)
-        .where(Balance.id == balance.id)
-        .values(amount=balance.amount - body.amount)
-    )
+    # 2) Проверка и списание одним условным UPDATE ... RETURNING
+    if await ledger.withdraw(db, body.user_id, body.ticker, body.amount) is None:
+        # Отказ — уточняем причину отдельным запросом
+        found = await ledger.has_balance(db, body.user_id, body.ticker)
+        await db.rollback()
+        if not found:
+            raise HTTPException(status_code=404, detail="Balance not found")
+        raise HTTPException(status_code=400, detail="Insufficient funds")
     await db.commit()
-    return Ok()
\ No newline at end of file
+    return Ok()
+
+
+# ---------- массовое заведение пользователей и зачислений ----------
+# Максимум строк в одном массовом запросе
+BULK_MAX_ROWS = 10000
+
+M = TypeVar("M", bound=BaseModel)
+
+
+async def _read_rows(request: Request) -> List[Any]:
+    """
+    Строки тела по Content-Type: JSON-массив объектов, CSV с заголовком
+    (text/csv) или NDJSON — объект на строку (application/x-ndjson).
+    Нечитаемая строка NDJSON становится ValueError на своём месте.
+    """
+    content_type = request.headers.get("content-type", "application/json").split(";")[0].strip()
+    raw = await request.body()
+    try:
+        text = raw.decode("utf-8-sig")
+    except UnicodeDecodeError:
+        raise HTTPException(status_code=400, detail="Body must be UTF-8")
+
+    if content_type == "text/csv":
+        rows: List[Any] = list(csv.DictReader(io.StringIO(text)))
+    elif content_type in ("application/x-ndjson", "application/ndjson"):
+        rows = []
+        for line in text.splitlines():
+            if not line.strip():
+                continue
+            try:
+                rows.append(json.loads(line))
+            except ValueError as e:
+                rows.append(ValueError(f"Invalid JSON: {e}"))
+    elif content_type == "application/json":
+        try:
+            rows = json.loads(text)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid JSON")
+        if not isinstance(rows, list):
+            raise HTTPException(status_code=422, detail="Expected a JSON array")
+    else:
+        raise HTTPException(status_code=415, detail=f"Unsupported content type {content_type}")
+
+    if not rows:
+        raise HTTPException(status_code=422, detail="No rows")
+    if len(rows) > BULK_MAX_ROWS:
+        raise HTTPException(status_code=422, detail=f"Row count exceeds {BULK_MAX_ROWS}")
+    return rows
+
+
+def _validate(model: Type[M], raw: Any) -> Tuple[Optional[M], Optional[str]]:
+    """Строка -> (модель, None) или (None, текст ошибки)."""
+    if isinstance(raw, Exception):
+        return None, str(raw)
+    try:
+        return model.model_validate(raw), None
+    except ValidationError as e:
+        return None, "; ".join(
+            f"{'.'.join(str(p) for p in err['loc']) or 'row'}: {err['msg']}" for err in e.errors()
+        )
+
+
+@router.post("/users/bulk", response_model=BulkUsersResponse)
+async def create_users_bulk(
+    request: Request,
+    _admin: AuthUser = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Массовая регистрация: строки вида {"name": ..., "role": "USER"}
+    (JSON-массив, CSV name,role или NDJSON). Все пользователи создаются
+    одним многострочным INSERT ... ON CONFLICT DO NOTHING в одной транзакции;
+    занятые имена и невалидные строки получают ошибку, остальные — id и api_key.
+    """
+    rows = await _read_rows(request)
+
+    # 1) Валидация и дубликаты внутри запроса
+    results: List[BulkUserResult] = []
+    accepted: List[Tuple[BulkUserResult, str]] = []
+    pending: Dict[str, Dict[str, Any]] = {}
+    for i, raw in enumerate(rows):
+        user, error = _validate(NewUser, raw)
+        if user is not None and user.name in pending:
+            error = "Duplicate name in request"
+        if error is not None:
+            results.append(BulkUserResult(row=i, success=False, error=error))
+            continue
+        pending[user.name] = {
+            "id": uuid4(),
+            "username": user.name,
+            "password_hash": "",
+            "api_key": str(uuid4()),
+            "role": RoleEnum(user.role),
+        }
+        res = BulkUserResult(row=i, success=True)
+        results.append(res)
+        accepted.append((res, user.name))
+
+    # 2) Одна вставка; RETURNING отдаёт только реально созданных
+    created: Set[str] = set()
+    if pending:
+        stmt = (
+            pg_insert(User)
+            .on_conflict_do_nothing(index_elements=[User.username])
+            .returning(User.username)
+        )
+        created = set((await db.execute(stmt, list(pending.values()))).scalars())
+        await db.commit()
+
+    # 3) Результаты в порядке строк
+    for res, name in accepted:
+        if name in created:
+            res.id, res.api_key = pending[name]["id"], pending[name]["api_key"]
+        else:
+            res.success, res.error = False, "Username already exists"
+    return BulkUsersResponse(created=len(created), results=results)
+
+
+@router.post("/balance/deposit/bulk", response_model=BulkDepositResponse)
+async def deposit_bulk(
+    request: Request,
+    _admin: AuthUser = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Массовое зачисление: строки как у /balance/deposit (JSON-массив, CSV
+    user_id,ticker,amount или NDJSON). Инструменты проверяются по справочнику,
+    пользователи — одним запросом; корректные строки зачисляются одним
+    многострочным INSERT ... ON CONFLICT DO UPDATE в одной транзакции.
+    """
+    rows = await _read_rows(request)
+
+    # 1) Валидация и проверка инструментов по справочнику в памяти
+    results: List[BulkRowResult] = []
+    valid: List[Tuple[BulkRowResult, DepositBody]] = []
+    for i, raw in enumerate(rows):
+        body, error = _validate(DepositBody, raw)
+        if body is not None:
+            inst = instrument_registry.get(body.ticker)
+            if inst is None:
+                error = "Instrument not found"
+            elif inst.currency != "RUB":
+                error = f"Instrument {body.ticker} is not traded in RUB"
+        res = BulkRowResult(row=i, success=error is None, error=error)
+        results.append(res)
+        if error is None:
+            valid.append((res, body))
+
+    # 2) Пользователи — одним запросом
+    user_ids = {body.user_id for _, body in valid}
+    known = set((await db.execute(
+        select(User.id).where(User.id.in_(user_ids), User.deleted_at.is_(None))
+    )).scalars()) if user_ids else set()
+
+    # 3) Зачисления: повторы одного (user_id, ticker) складываются, запись одна
+    deltas = ledger.BalanceDeltas()
+    applied = 0
+    for res, body in valid:
+        if body.user_id not in known:
+            res.success, res.error = False, "User not found"
+            continue
+        deltas.add(body.user_id, body.ticker, amount=body.amount)
+        applied += 1
+    if deltas:
+        try:
+            await deltas.apply(db)
+            await db.commit()
+        except IntegrityError:
+            # Пользователя удалили между проверкой и записью — ничего не зачислено
+            await db.rollback()
+            raise HTTPException(status_code=409, detail="Users changed concurrently, nothing applied")
+    return BulkDepositResponse(applied=applied, results=results)
\ No newline at end of file
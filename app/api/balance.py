@@ -2,11 +2,14 @@ from fastapi import APIRouter, Depends, status, HTTPException
 from typing import List
 from uuid import UUID
 
-from sqlalchemy import select, update
+from sqlalchemy import select
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app import ledger
 from app.deps import get_db, get_current_user
-from app.models import Balance, Instrument
+from app.instruments import instrument_registry
+from app.models import Balance
 from app.schemas import BalanceOut, DepositBody, WithdrawBody, Ok
 
 router = APIRouter(
@@ -39,32 +42,20 @@ async def deposit(
     current_user: UUID     = Depends(get_current_user),
     db: AsyncSession       = Depends(get_db),
 ):
-    stmt_i = select(Instrument).where(Instrument.ticker == body.ticker)
-    inst   = (await db.execute(stmt_i)).scalar_one_or_none()
+    inst = instrument_registry.get(body.ticker)
     if not inst:
         raise HTTPException(404, "Instrument not found")
     if inst.currency != "RUB":
         raise HTTPException(400, "Instrument is not traded in RUB")
 
-    stmt_b = select(Balance).where(
-        Balance.user_id == current_user,
-        Balance.ticker  == body.ticker
-    )
-    bal = (await db.execute(stmt_b)).scalar_one_or_none()
-
-    if bal:
-        await db.execute(
-            update(Balance)
-            .where(Balance.id == bal.id)
-            .values(amount=bal.amount + body.amount)
-        )
-    else:
-        db.add(Balance(
-            user_id=current_user,
-            ticker=body.ticker,
-            amount=body.amount
-        ))
-
+    # Создание или пополнение баланса — один INSERT ... SELECT ... ON CONFLICT DO UPDATE
+    try:
+        credited = await ledger.deposit(db, current_user, body.ticker, body.amount)
+    except IntegrityError:
+        credited = None
+    if credited is None:
+        await db.rollback()
+        raise HTTPException(404, "User not found")
     await db.commit()
     return Ok()
 
@@ -79,20 +70,16 @@ async def withdraw(
     current_user: UUID     = Depends(get_current_user),
     db: AsyncSession       = Depends(get_db),
 ):
-    stmt_b = select(Balance).where(
-        Balance.user_id == current_user,
-        Balance.ticker  == body.ticker
-    )
-    bal = (await db.execute(stmt_b)).scalar_one_or_none()
-    if not bal:
-        raise HTTPException(404, "Balance not found")
-    if bal.amount < body.amount:
-        raise HTTPException(400, "Insufficient funds")
+    if body.ticker not in instrument_registry:
+        raise HTTPException(404, "Instrument not found")
 
-    await db.execute(
-        update(Balance)
-        .where(Balance.id == bal.id)
-        .values(amount=bal.amount - body.amount)
-    )
+    # Проверка и списание одним условным UPDATE ... RETURNING: параллельные списания не теряются
+    if await ledger.withdraw(db, current_user, body.ticker, body.amount) is None:
+        # Отказ — редкий путь: уточняем причину отдельным запросом
+        found = await ledger.has_balance(db, current_user, body.ticker)
+        await db.rollback()
+        if not found:
+            raise HTTPException(404, "Balance not found")
+        raise HTTPException(400, "Insufficient funds")
     await db.commit()
     return Ok()
\ No newline at end of file
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.metrics import render
+
+router = APIRouter(tags=["Metrics"])
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """
+    Метрики процесса в формате Prometheus: задержки и статусы по ручкам,
+    запросы к БД, ожидание пула, аутентификация, матчинг.
+    При нескольких воркерах у каждого свои значения.
+    """
+    return PlainTextResponse(render(), media_type="text/plain; version=0.0.4")
@@ -1,19 +1,33 @@
+import base64
+import binascii
 from uuid import uuid4, UUID
 from datetime import datetime, timezone
-from typing import Union, List
+from typing import Any, AsyncIterator, Dict, Union, List, Optional, Tuple
 
-from fastapi import APIRouter, Depends, HTTPException, status, Request
-from sqlalchemy import select, update
+from fastapi import APIRouter, Depends, HTTPException, Query, status, Request
+from fastapi.responses import StreamingResponse
+from sqlalchemy import select, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.engine import Row
+from sqlalchemy.sql import Select
 
-from app.deps import get_current_user, get_db
-from app.models import Order, Instrument
+from app.deps import AsyncSessionLocal, get_current_user, get_db
+from app.instruments import instrument_registry
+from app.ledger import QUOTE_TICKER, InsufficientFunds
+from app.matching import TickerNotOwned, matching_engine
+from app.models import Order, OrderSideEnum, OrderStatusEnum
+from app.responses import ORJSONResponse, dumps
 from app.schemas import (
     LimitOrderBody,
     MarketOrderBody,
     LimitOrder,
     MarketOrder,
     CreateOrderResponse,
+    BatchOrderResult,
+    BatchOrderResponse,
+    CancelOrdersResponse,
+    Direction,
+    ReplaceOrderBody,
     OrderStatus,
     Ok,
 )
@@ -21,6 +35,15 @@ from app.schemas import (
 router = APIRouter(prefix="/api/v1/order", tags=["Order"])
 
 
+def _not_owned(e: TickerNotOwned) -> HTTPException:
+    # Тикер обслуживает другой воркер/реплика: прокси должен маршрутизировать по тикеру
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail=str(e),
+        headers={"Retry-After": "1"},
+    )
+
+
 @router.post(
     "",
     response_model=CreateOrderResponse,
@@ -29,13 +52,14 @@ router = APIRouter(prefix="/api/v1/order", tags=["Order"])
 async def create_order(
     body: Union[LimitOrderBody, MarketOrderBody],
     current_user: UUID = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
 ):
-    # Проверяем, что инструмент существует
-    stmt_inst = select(Instrument).where(Instrument.ticker == body.ticker)
-    res_inst = await db.execute(stmt_inst)
-    inst = res_inst.scalar_one_or_none()
-    if not inst:
+    if body.ticker == QUOTE_TICKER:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Instrument '{body.ticker}' cannot be traded"
+        )
+    # Проверяем, что инструмент существует (справочник в памяти)
+    if body.ticker not in instrument_registry:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail=f"Instrument '{body.ticker}' not found"
@@ -45,9 +69,10 @@ async def create_order(
     order_id = uuid4()
     now = datetime.now(timezone.utc)
 
-    # Для рыночного ордера цена будет подтягиваться из базы данных
+    # Рыночная заявка цены не имеет: она исполняется по лучшим ценам стакана,
+    # а неисполненный остаток снимается
     if isinstance(body, MarketOrderBody):
-        price = inst.current_price  # Цена для рыночного ордера
+        price = None
     else:
         price = body.price  # Для лимитного ордера цена передается в запросе
 
@@ -55,7 +80,7 @@ async def create_order(
         id=order_id,
         user_id=current_user,
         ticker=body.ticker,
-        side=body.direction,
+        side=OrderSideEnum(body.direction.value),
         quantity=body.qty,
         filled_qty=0,
         status=OrderStatus.NEW,
@@ -63,54 +88,228 @@ async def create_order(
         price=price,
     )
 
-    db.add(o)
-    await db.commit()
-    await db.refresh(o)
+    # Резерв средств, матчинг и запись заявки, сделок и статусов встречных заявок
+    try:
+        await matching_engine.submit(o)
+    except InsufficientFunds as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient {e.ticker} balance"
+        )
+    except TickerNotOwned as e:
+        raise _not_owned(e)
 
     return CreateOrderResponse(order_id=order_id)
 
 
+# Максимум заявок в одном пакетном запросе
+MAX_BATCH_SIZE = 500
+
+
+@router.post(
+    "/batch",
+    response_model=BatchOrderResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def create_orders_batch(
+    body: List[Union[LimitOrderBody, MarketOrderBody]],
+    current_user: UUID = Depends(get_current_user),
+):
+    """
+    Пакетная постановка заявок: тикеры по справочнику в памяти, один снимок балансов
+    и одна транзакция на весь пакет. Результат — по каждой заявке в порядке запроса.
+    """
+    if not body:
+        raise HTTPException(status_code=422, detail="Empty batch")
+    if len(body) > MAX_BATCH_SIZE:
+        raise HTTPException(status_code=422, detail=f"Batch size exceeds {MAX_BATCH_SIZE}")
+
+    # 1) Строим заявки; невалидные сразу получают ошибку
+    now = datetime.now(timezone.utc)
+    results: List[Optional[BatchOrderResult]] = []
+    orders: List[Order] = []
+    for item in body:
+        if item.ticker == QUOTE_TICKER:
+            results.append(BatchOrderResult(success=False, error=f"Instrument '{item.ticker}' cannot be traded"))
+            continue
+        if item.ticker not in instrument_registry:
+            results.append(BatchOrderResult(success=False, error=f"Instrument '{item.ticker}' not found"))
+            continue
+        orders.append(Order(
+            id=uuid4(),
+            user_id=current_user,
+            ticker=item.ticker,
+            side=OrderSideEnum(item.direction.value),
+            quantity=item.qty,
+            filled_qty=0,
+            status=OrderStatus.NEW,
+            created_at=now,
+            price=item.price if isinstance(item, LimitOrderBody) else None,
+        ))
+        results.append(None)
+
+    # 2) Резерв, матчинг и запись всего пакета
+    try:
+        errors = await matching_engine.submit_batch(current_user, orders) if orders else []
+    except TickerNotOwned as e:
+        raise _not_owned(e)
+
+    accepted = iter(zip(orders, errors))
+    for i, res in enumerate(results):
+        if res is None:
+            o, error = next(accepted)
+            results[i] = (
+                BatchOrderResult(success=True, order_id=o.id) if error is None
+                else BatchOrderResult(success=False, error=error)
+            )
+
+    return BatchOrderResponse(results=results)
+
+
+# История заявок: размер страницы по умолчанию/максимум и размер порции выгрузки
+ORDERS_PAGE_SIZE = 100
+ORDERS_PAGE_MAX = 1000
+EXPORT_FETCH_SIZE = 1000
+
+
+def _encode_cursor(created_at: datetime, order_id: UUID) -> str:
+    raw = f"{created_at.isoformat()}|{order_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def _decode_cursor(cursor: str) -> Tuple[datetime, UUID]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        created_at, order_id = raw.split("|")
+        return datetime.fromisoformat(created_at), UUID(order_id)
+    except (binascii.Error, UnicodeDecodeError, ValueError):
+        raise HTTPException(status_code=422, detail="Invalid cursor")
+
+
+# Только нужные ответу колонки: без ORM-объектов и identity map
+ORDER_COLUMNS = (
+    Order.id,
+    Order.status,
+    Order.user_id,
+    Order.created_at,
+    Order.side,
+    Order.ticker,
+    Order.quantity,
+    Order.price,
+    Order.filled_qty,
+)
+
+
+def _orders_query(
+    user_id: UUID, status_filter: Optional[OrderStatus], ticker: Optional[str]
+) -> Select:
+    """Заявки пользователя, новые первыми; (created_at, id) — ключ курсора."""
+    stmt = (
+        select(*ORDER_COLUMNS)
+        .where(Order.user_id == user_id)
+        .order_by(Order.created_at.desc(), Order.id.desc())
+    )
+    if status_filter is not None:
+        stmt = stmt.where(Order.status == OrderStatusEnum(status_filter.value))
+    if ticker is not None:
+        stmt = stmt.where(Order.ticker == ticker)
+    return stmt
+
+
+def _order_json(o: Row) -> Dict[str, Any]:
+    """Строка ORDER_COLUMNS сразу в форме LimitOrder/MarketOrder, без моделей Pydantic."""
+    if o.price is not None:
+        return {
+            "id": o.id,
+            "status": o.status,
+            "user_id": o.user_id,
+            "timestamp": o.created_at,
+            "body": {
+                "direction": o.side,
+                "ticker": o.ticker,
+                "qty": o.quantity,
+                "price": o.price,
+            },
+            "filled": o.filled_qty,
+        }
+    return {
+        "id": o.id,
+        "status": o.status,
+        "user_id": o.user_id,
+        "timestamp": o.created_at,
+        "body": {
+            "direction": o.side,
+            "ticker": o.ticker,
+            "qty": o.quantity,
+        },
+    }
+
+
 @router.get(
     "",
     response_model=List[Union[LimitOrder, MarketOrder]],
     status_code=status.HTTP_200_OK,
 )
 async def list_orders(
+    limit: int = Query(ORDERS_PAGE_SIZE, ge=1, le=ORDERS_PAGE_MAX, description="Размер страницы"),
+    cursor: Optional[str] = Query(None, description="Значение X-Next-Cursor предыдущей страницы"),
+    status_filter: Optional[OrderStatus] = Query(None, alias="status", description="Только заявки в этом статусе"),
+    ticker: Optional[str] = Query(None, description="Только заявки по этому тикеру"),
     current_user: UUID = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    stmt = select(Order).where(Order.user_id == current_user)
-    res = await db.execute(stmt)
-    rows = res.scalars().all()
+    """
+    Страница истории заявок, новые первыми (keyset по (created_at, id)).
+    Если есть следующая страница, её курсор приходит в заголовке X-Next-Cursor.
+    """
+    stmt = _orders_query(current_user, status_filter, ticker)
+    if cursor is not None:
+        created_at, order_id = _decode_cursor(cursor)
+        stmt = stmt.where(tuple_(Order.created_at, Order.id) < tuple_(created_at, order_id))
 
-    result: List[Union[LimitOrder, MarketOrder]] = []
-    for o in rows:
-        if o.price is not None:
-            body = LimitOrderBody(
-                direction=o.side, ticker=o.ticker, qty=int(o.quantity), price=int(o.price)
-            )
-            dto = LimitOrder(
-                id=o.id,
-                status=o.status,
-                user_id=o.user_id,
-                timestamp=o.created_at,
-                body=body,
-                filled=int(o.filled_qty),
-            )
-        else:
-            body = MarketOrderBody(
-                direction=o.side, ticker=o.ticker, qty=int(o.quantity)
-            )
-            dto = MarketOrder(
-                id=o.id,
-                status=o.status,
-                user_id=o.user_id,
-                timestamp=o.created_at,
-                body=body,
-            )
-        result.append(dto)
+    # Лишняя строка — признак того, что есть следующая страница
+    rows = (await db.execute(stmt.limit(limit + 1))).all()
+    headers = {}
+    if len(rows) > limit:
+        rows = rows[:limit]
+        last = rows[-1]
+        headers["X-Next-Cursor"] = _encode_cursor(last.created_at, last.id)
 
-    return result
+    return ORJSONResponse([_order_json(o) for o in rows], headers=headers)
+
+
+@router.get(
+    "/export",
+    response_class=StreamingResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def export_orders(
+    status_filter: Optional[OrderStatus] = Query(None, alias="status", description="Только заявки в этом статусе"),
+    ticker: Optional[str] = Query(None, description="Только заявки по этому тикеру"),
+    current_user: UUID = Depends(get_current_user),
+):
+    """
+    Полная выгрузка истории заявок одним JSON-массивом. Строки читаются
+    серверным курсором порциями по EXPORT_FETCH_SIZE и сразу отдаются
+    клиенту — память не растёт с размером истории.
+    """
+    stmt = _orders_query(current_user, status_filter, ticker).execution_options(
+        yield_per=EXPORT_FETCH_SIZE
+    )
+
+    async def rows() -> AsyncIterator[bytes]:
+        # Своя сессия: сессия из get_db закрывается до начала отправки тела
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(stmt)
+            yield b"["
+            first = True
+            async for o in result:
+                chunk = dumps(_order_json(o))
+                yield chunk if first else b"," + chunk
+                first = False
+            yield b"]"
+
+    return StreamingResponse(rows(), media_type="application/json")
 
 
 @router.get(
@@ -123,38 +322,76 @@ async def get_order(
     current_user: UUID = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    stmt = select(Order).where(
+    stmt = select(*ORDER_COLUMNS).where(
         Order.id == order_id,
         Order.user_id == current_user,
     )
     res = await db.execute(stmt)
-    o = res.scalar_one_or_none()
+    o = res.first()
     if not o:
         raise HTTPException(status_code=404, detail="Order not found")
 
-    if o.price is not None:
-        body = LimitOrderBody(
-            direction=o.side, ticker=o.ticker, qty=int(o.quantity), price=int(o.price)
-        )
-        return LimitOrder(
-            id=o.id,
-            status=o.status,
-            user_id=o.user_id,
-            timestamp=o.created_at,
-            body=body,
-            filled=int(o.filled_qty),
-        )
-    else:
-        body = MarketOrderBody(
-            direction=o.side, ticker=o.ticker, qty=int(o.quantity)
+    return ORJSONResponse(_order_json(o))
+
+
+@router.delete(
+    "",
+    response_model=CancelOrdersResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def cancel_orders(
+    ticker: Optional[str] = Query(None, description="Только заявки по этому тикеру"),
+    direction: Optional[Direction] = Query(None, description="Только заявки этой стороны"),
+    current_user: UUID = Depends(get_current_user),
+):
+    """
+    Массовая отмена открытых заявок пользователя: все, по тикеру и/или стороне.
+    Выполняется одним UPDATE и одним пересчётом резервов.
+    """
+    side = OrderSideEnum(direction.value) if direction is not None else None
+    if ticker is not None and ticker not in instrument_registry:
+        # Неизвестный тикер: открытых заявок по нему нет
+        return CancelOrdersResponse(cancelled=[])
+    try:
+        cancelled = await matching_engine.cancel_all(current_user, ticker=ticker, side=side)
+    except TickerNotOwned as e:
+        raise _not_owned(e)
+    return CancelOrdersResponse(cancelled=cancelled)
+
+
+@router.put(
+    "/{order_id}",
+    response_model=CreateOrderResponse,
+    status_code=status.HTTP_200_OK,
+)
+async def replace_order(
+    order_id: UUID,
+    body: ReplaceOrderBody,
+    current_user: UUID = Depends(get_current_user),
+):
+    """
+    Cancel-replace: отменяет открытую заявку и атомарно ставит новую с новой
+    ценой и/или количеством. Возвращает id новой заявки; приоритет по времени
+    у неё новый.
+    """
+    if body.price is None and body.qty is None:
+        raise HTTPException(status_code=422, detail="Nothing to replace: set price and/or qty")
+
+    try:
+        new = await matching_engine.replace(
+            current_user, order_id, price=body.price, qty=body.qty
         )
-        return MarketOrder(
-            id=o.id,
-            status=o.status,
-            user_id=o.user_id,
-            timestamp=o.created_at,
-            body=body,
+    except InsufficientFunds as e:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient {e.ticker} balance"
         )
+    except TickerNotOwned as e:
+        raise _not_owned(e)
+    if new is None:
+        raise HTTPException(status_code=404, detail="Order not found or cannot cancel")
+
+    return CreateOrderResponse(order_id=new.id)
 
 
 @router.delete(
@@ -165,21 +402,13 @@ async def get_order(
 async def cancel_order(
     order_id: UUID,
     current_user: UUID = Depends(get_current_user),
-    db: AsyncSession = Depends(get_db),
 ):
-    stmt = select(Order).where(
-        Order.id == order_id,
-        Order.user_id == current_user,
-        Order.status == OrderStatus.NEW,
-    )
-    res = await db.execute(stmt)
-    o = res.scalar_one_or_none()
-    if not o:
+    # Открытые заявки живут в стакане: ищем там, в БД — только если не нашли
+    try:
+        cancelled = await matching_engine.cancel(current_user, order_id)
+    except TickerNotOwned as e:
+        raise _not_owned(e)
+    if not cancelled:
         raise HTTPException(status_code=404, detail="Order not found or cannot cancel")
 
-    await db.execute(
-        update(Order).where(Order.id == order_id).values(status=OrderStatus.CANCELLED)
-    )
-    await db.commit()
-
     return Ok()
\ No newline at end of file
@@ -1,24 +1,30 @@
-from typing import List
+from datetime import datetime, timezone
+from typing import List, Optional
 
 from fastapi import APIRouter, Depends, HTTPException, Path, Query, status
 from sqlalchemy import select
 from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 from uuid import uuid4
-from sqlalchemy import select, func, desc, asc, or_
 
 # SQLAlchemy-модель
-from app.models import Instrument as InstrumentModel, Transaction as TransactionModel
+from app.models import Candle as CandleModel, Transaction as TransactionModel
 # Pydantic-схема
-from app.schemas import Instrument as InstrumentSchema, Transaction as TransactionSchema
+from app.schemas import (
+    Candle as CandleSchema, CandleInterval, Instrument as InstrumentSchema,
+    Ticker as TickerSchema, Transaction as TransactionSchema,
+)
 
 from app.deps import get_db
-from app.models import User, Order
+from app.instruments import instrument_registry
+from app.ledger import QUOTE_TICKER
+from app.matching import OrderBook, TickerNotOwned, TickerStats, matching_engine, ticker_cache
+from app.responses import ORJSONResponse
+from app.models import User, OrderSideEnum
 from app.schemas import (
     NewUser,
     UserOut,
     L2OrderBook,
-    Level
 )
 
 
@@ -112,17 +118,11 @@ async def register(
     response_model=List[InstrumentSchema],
     status_code=status.HTTP_200_OK,
 )
-async def list_instruments(
-    db: AsyncSession = Depends(get_db),
-):
+async def list_instruments():
     """
-    Список доступных инструментов (статус ACTIVE).
+    Список доступных инструментов (статус ACTIVE) из справочника в памяти.
     """
-    stmt = select(InstrumentModel).where(
-        InstrumentModel.status == InstrumentModel.status.default.arg
-    )
-    result = await db.execute(stmt)
-    instruments = result.scalars().all()
+    instruments = instrument_registry.active()
 
     return [
         InstrumentSchema(
@@ -136,6 +136,15 @@ async def list_instruments(
 
 
 
+async def _owned_book(ticker: str) -> Optional[OrderBook]:
+    """Стакан тикера из памяти; чужой или потерянный тикер — 503, а не пустой стакан."""
+    try:
+        await matching_engine.sequencer.ensure_owned(ticker)
+    except TickerNotOwned as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+    return matching_engine.find(ticker)
+
+
 @router.get(
     "/orderbook/{ticker}",
     response_model=L2OrderBook,
@@ -144,63 +153,31 @@ async def list_instruments(
 async def get_orderbook(
     ticker: str = Path(..., description="Тикер инструмента"),
     limit: int = Query(10, ge=1, le=100, description="Сколько топ-уровней вернуть"),
-    db: AsyncSession = Depends(get_db),
 ):
     """
-    Строит стакан из незакрытых заявок в БД:
-      - bid_levels: все BUY-заявки
-      - ask_levels: все SELL-заявки
-    Группировка по цене, суммирование qty, сортировка.
+    Стакан из памяти матчинга (остаток quantity - filled_qty по уровням):
+      - bid_levels: BUY-заявки по убыванию цены
+      - ask_levels: SELL-заявки по возрастанию цены
+    Уровни поддерживаются дельтами при постановке, исполнении и отмене заявок.
     """
-    # какие статусы считаем «живыми»
-    alive = [Order.status == "NEW", Order.status == "PARTIALLY_EXECUTED"]
+    book = await _owned_book(ticker)
+    if book is None:
+        raise HTTPException(status_code=404, detail=f"No active orders for {ticker}")
 
-    # 1) BIDS: группируем BUY, по убыванию цены
-    stmt_bids = (
-        select(
-            Order.price.label("price"),
-            func.sum(Order.quantity).label("qty")
-        )
-        .where(
-            Order.ticker == ticker,
-            Order.side == "BUY",
-            or_(*alive)
-        )
-        .group_by(Order.price)
-        .order_by(desc(Order.price))
-        .limit(limit)
-    )
-    bids = await db.execute(stmt_bids)
+    # Уровни сразу в форме Level, без моделей Pydantic на каждый уровень
     bid_levels = [
-        Level(price=int(row.price), qty=int(row.qty))
-        for row in bids.fetchall()
+        {"price": price, "qty": qty}
+        for price, qty in book.depth(OrderSideEnum.BUY, limit)
     ]
-
-    # 2) ASKS: группируем SELL, по возрастанию цены
-    stmt_asks = (
-        select(
-            Order.price.label("price"),
-            func.sum(Order.quantity).label("qty")
-        )
-        .where(
-            Order.ticker == ticker,
-            Order.side == "SELL",
-            or_(*alive)
-        )
-        .group_by(Order.price)
-        .order_by(asc(Order.price))
-        .limit(limit)
-    )
-    asks = await db.execute(stmt_asks)
     ask_levels = [
-        Level(price=int(row.price), qty=int(row.qty))
-        for row in asks.fetchall()
+        {"price": price, "qty": qty}
+        for price, qty in book.depth(OrderSideEnum.SELL, limit)
     ]
 
     if not bid_levels and not ask_levels:
         raise HTTPException(status_code=404, detail=f"No active orders for {ticker}")
 
-    return L2OrderBook(bid_levels=bid_levels, ask_levels=ask_levels)
+    return ORJSONResponse({"bid_levels": bid_levels, "ask_levels": ask_levels})
 
 @router.get(
     "/transactions/{ticker}",
@@ -215,22 +192,126 @@ async def get_transaction_history(
     """
     История последних сделок по инструменту.
     """
+    # Только нужные колонки, без ORM-объектов
     stmt = (
-        select(TransactionModel)  # Используем SQLAlchemy модель
+        select(
+            TransactionModel.ticker,
+            TransactionModel.quantity,
+            TransactionModel.price,
+            TransactionModel.timestamp,
+        )
         .where(TransactionModel.ticker == ticker)
         .order_by(TransactionModel.timestamp.desc())
         .limit(limit)
     )
     result = await db.execute(stmt)
-    trades = result.scalars().all()
 
-    # Преобразуем данные в Pydantic схемы для ответа
-    return [
-        TransactionSchema(
-            ticker=t.ticker,
-            amount=int(t.quantity),
-            price=int(t.price),
-            timestamp=t.timestamp,
+    # Строки сразу в форме TransactionSchema
+    return ORJSONResponse([
+        {
+            "ticker": t.ticker,
+            "amount": t.quantity,
+            "price": t.price,
+            "timestamp": t.timestamp,
+        }
+        for t in result
+    ])
+
+
+@router.get(
+    "/candles/{ticker}",
+    response_model=List[CandleSchema],
+    status_code=status.HTTP_200_OK,
+)
+async def get_candles(
+    ticker: str = Path(..., description="Тикер инструмента"),
+    interval: CandleInterval = Query(CandleInterval.M1, description="Длительность бара"),
+    limit: int = Query(100, ge=1, le=1000, description="Максимум баров"),
+    start: Optional[datetime] = Query(None, description="Бары, открытые не раньше"),
+    end: Optional[datetime] = Query(None, description="Бары, открытые раньше"),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    OHLCV-бары по инструменту, от старых к новым; последний бар может быть
+    ещё открыт. Читается только таблица candles, сделки не сканируются.
+    """
+    stmt = (
+        select(
+            CandleModel.open_time,
+            CandleModel.open,
+            CandleModel.high,
+            CandleModel.low,
+            CandleModel.close,
+            CandleModel.volume,
         )
-        for t in trades
-    ]
\ No newline at end of file
+        .where(CandleModel.ticker == ticker, CandleModel.interval == interval.value)
+        .order_by(CandleModel.open_time.desc())
+        .limit(limit)
+    )
+    if start is not None:
+        stmt = stmt.where(CandleModel.open_time >= start)
+    if end is not None:
+        stmt = stmt.where(CandleModel.open_time < end)
+    rows = (await db.execute(stmt)).all()
+
+    return ORJSONResponse([
+        {
+            "time": c.open_time,
+            "open": c.open,
+            "high": c.high,
+            "low": c.low,
+            "close": c.close,
+            "volume": c.volume,
+        }
+        for c in reversed(rows)
+    ])
+
+
+async def _ticker_json(ticker: str, now: datetime) -> dict:
+    # Лучшие цены — из стакана в памяти, остальное — из кэша тикеров
+    book = await _owned_book(ticker)
+    stats = ticker_cache.get(ticker) or TickerStats(ticker)
+    return {
+        "ticker": ticker,
+        "last_price": stats.last_price,
+        "last_qty": stats.last_qty,
+        "last_trade_time": stats.last_time,
+        "best_bid": book.best_price(OrderSideEnum.BUY) if book else None,
+        "best_ask": book.best_price(OrderSideEnum.SELL) if book else None,
+        "volume_24h": stats.volume_24h(now),
+    }
+
+
+@router.get(
+    "/ticker",
+    response_model=List[TickerSchema],
+    status_code=status.HTTP_200_OK,
+)
+async def list_tickers():
+    """
+    Сводка по инструментам доли этого процесса (SEQUENCER_SHARD; при
+    нескольких долях прокси объединяет ответы): последняя сделка, лучшие
+    bid/ask и объём за 24 часа. Отдаётся из памяти, без запросов к БД.
+    """
+    now = datetime.now(timezone.utc)
+    return ORJSONResponse([
+        await _ticker_json(inst.ticker, now)
+        for inst in instrument_registry.active()
+        if inst.ticker != QUOTE_TICKER and matching_engine.sequencer.in_shard(inst.ticker)
+    ])
+
+
+@router.get(
+    "/ticker/{ticker}",
+    response_model=TickerSchema,
+    status_code=status.HTTP_200_OK,
+)
+async def get_ticker(
+    ticker: str = Path(..., description="Тикер инструмента"),
+):
+    """
+    Сводка по одному инструменту, см. GET /ticker.
+    """
+    if ticker == QUOTE_TICKER or ticker not in instrument_registry:
+        raise HTTPException(status_code=404, detail=f"Instrument '{ticker}' not found")
+    return ORJSONResponse(await _ticker_json(ticker, datetime.now(timezone.utc)))
\ No newline at end of file
@@ -0,0 +1,87 @@
+from fastapi import APIRouter, HTTPException, Path, WebSocket, WebSocketDisconnect
+from fastapi.responses import StreamingResponse
+
+from app.instruments import instrument_registry
+from app.matching import TickerNotOwned, matching_engine, market_feed
+
+router = APIRouter(
+    prefix="/api/v1/public/stream",
+    tags=["Public"],
+)
+
+# Раз в сколько секунд тишины шлём keep-alive
+HEARTBEAT_INTERVAL = 15.0
+
+
+@router.get("/{ticker}")
+async def stream_sse(
+    ticker: str = Path(..., description="Тикер инструмента"),
+):
+    """
+    Server-Sent Events: первым приходит snapshot стакана, затем события update
+    с изменившимися уровнями (qty=0 — уровень удалён) и новыми сделками.
+    Поле id равно seq; при пропуске seq клиент должен переподключиться.
+    """
+    # Справочник инструментов в памяти: без запроса к БД на каждое подключение
+    if ticker not in instrument_registry:
+        raise HTTPException(status_code=404, detail="Instrument not found")
+    try:
+        await matching_engine.sequencer.ensure_owned(ticker)
+    except TickerNotOwned as e:
+        raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "1"})
+
+    async def events():
+        sub = await matching_engine.subscribe(ticker)
+        try:
+            while True:
+                event = await sub.get(HEARTBEAT_INTERVAL)
+                # Отстал или тикер ушёл к другому процессу: клиент переподключится
+                if not sub.active:
+                    break
+                if event is None:
+                    yield ": ping\n\n"
+                    continue
+                yield f"id: {event.seq}\nevent: {event.type}\ndata: {event.model_dump_json()}\n\n"
+        finally:
+            market_feed.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.websocket("/{ticker}/ws")
+async def stream_ws(websocket: WebSocket, ticker: str):
+    """WebSocket-версия того же потока: JSON-сообщения snapshot/update с seq."""
+    if ticker not in instrument_registry:
+        await websocket.close(code=4404, reason="Instrument not found")
+        return
+
+    try:
+        await matching_engine.sequencer.ensure_owned(ticker)
+    except TickerNotOwned:
+        await websocket.close(code=4503, reason="Ticker is served by another instance")
+        return
+
+    await websocket.accept()
+    sub = await matching_engine.subscribe(ticker)
+    try:
+        while True:
+            event = await sub.get(HEARTBEAT_INTERVAL)
+            if not sub.active:
+                break
+            if event is None:
+                await websocket.send_json({"type": "ping"})
+                continue
+            await websocket.send_text(event.model_dump_json())
+        if sub.closed:
+            await websocket.close(code=4503, reason="Ticker is served by another instance")
+        else:
+            # Клиент отстал: пусть переподключится и получит свежий снимок
+            await websocket.close(code=4408, reason="Subscriber too slow")
+    except WebSocketDisconnect:
+        pass
+    finally:
+        market_feed.unsubscribe(sub)
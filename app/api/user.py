@@ -1,9 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException, status, Request
+from datetime import datetime, timezone
 from uuid import UUID
-from sqlalchemy import delete
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
-from app.deps import get_current_user, get_db
-from app.models import User, Balance, Order, Transaction
+from app.deps import AuthUser, get_current_principal, get_current_user, get_db, invalidate_api_key
+from app.matching import matching_engine
+from app.models import User, RoleEnum
 from app.schemas import Ok, UserOut
 
 router = APIRouter(prefix="/api/v1/admin/user", tags=["User"], dependencies=[Depends(get_current_user)])
@@ -14,7 +16,7 @@ router = APIRouter(prefix="/api/v1/admin/user", tags=["User"], dependencies=[Dep
 async def delete_user(
     request: Request,
     user_id: UUID,
-    current_user: User = Depends(get_current_user),  # Получаем объект пользователя
+    current_user: AuthUser = Depends(get_current_principal),  # id и роль текущего пользователя
     db: AsyncSession = Depends(get_db),
 ):
     """
@@ -29,35 +31,30 @@ async def delete_user(
         )
 
     # Проверка прав
-    if not (getattr(current_user, "role", None) == "ADMIN" or getattr(current_user, "id", None) == user_id):
+    if not (current_user.role == RoleEnum.ADMIN or current_user.id == user_id):
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="You can only delete your own account"
         )
 
-    # 1) Удаляем все ордера этого пользователя
-    stmt_orders = delete(Order).where(Order.user_id == user_id)
-    await db.execute(stmt_orders)
-
-    # 2) Удаляем все балансы этого пользователя
-    stmt_balances = delete(Balance).where(Balance.user_id == user_id)
-    await db.execute(stmt_balances)
-
-    # 3) Удаляем все транзакции, связанные с этим пользователем
-    stmt_transactions = delete(Transaction).where(
-        (Transaction.buy_order_id == user_id) | (Transaction.sell_order_id == user_id)
+    # 1) Tombstone: пользователь сразу перестаёт проходить аутентификацию,
+    #    заявки, балансы и сделки дочищает фоновый reaper (app/reaper.py)
+    stmt_user = (
+        update(User)
+        .where(User.id == user_id, User.deleted_at.is_(None))
+        .values(deleted_at=datetime.now(timezone.utc))
+        .returning(User.api_key)
     )
-    await db.execute(stmt_transactions)
-
-    # 4) Можно добавить очистку других связанных таблиц (например, жалоб, сообщений, историй и т.д.)
-    # stmt_complaints = delete(Complaint).where(Complaint.user_id == user_id)
-    # await db.execute(stmt_complaints)
-
-    # 5) Теперь удаляем самого пользователя
-    stmt_user = delete(User).where(User.id == user_id)
-    res = await db.execute(stmt_user)
-    if res.rowcount == 0:
+    api_key = (await db.execute(stmt_user)).scalar_one_or_none()
+    if api_key is None:
         raise HTTPException(status_code=404, detail="User not found")
 
     await db.commit()
+
+    # Удалённый ключ не должен продолжать работать из кэша
+    invalidate_api_key(api_key)
+
+    # 2) Снимаем открытые заявки из стаканов этого процесса и возвращаем резервы
+    #    (после коммита: новых заявок от пользователя уже не будет)
+    await matching_engine.cancel_all(user_id)
     return Ok()
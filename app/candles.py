@@ -0,0 +1,79 @@
+from datetime import datetime, timezone
+from typing import Dict, List, Tuple
+
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Candle
+
+# Интервалы баров: название -> длительность в секундах
+INTERVALS: Dict[str, int] = {
+    "1s": 1,
+    "1m": 60,
+    "5m": 5 * 60,
+    "1h": 60 * 60,
+    "1d": 24 * 60 * 60,
+}
+
+
+def bucket(ts: datetime, seconds: int) -> datetime:
+    """Начало бара, в который попадает ts: границы отсчитываются от эпохи в UTC."""
+    epoch = int(ts.timestamp())
+    return datetime.fromtimestamp(epoch - epoch % seconds, tz=timezone.utc)
+
+
+class CandleUpdates:
+    """
+    Накопитель баров по сделкам: (ticker, interval, open_time) -> [open, high, low, close, volume].
+    Применяется в той же транзакции, что и сделки, поэтому бары не расходятся с transactions.
+    """
+
+    def __init__(self):
+        self._bars: Dict[Tuple[str, str, datetime], List[int]] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self._bars)
+
+    def add(self, ticker: str, price: int, qty: int, timestamp: datetime) -> None:
+        for interval, seconds in INTERVALS.items():
+            key = (ticker, interval, bucket(timestamp, seconds))
+            bar = self._bars.get(key)
+            if bar is None:
+                self._bars[key] = [price, price, price, price, qty]
+                continue
+            bar[1] = max(bar[1], price)
+            bar[2] = min(bar[2], price)
+            bar[3] = price
+            bar[4] += qty
+
+    async def apply(self, db: AsyncSession) -> None:
+        """Сливает бары с уже записанными одним многострочным upsert'ом (open не меняется)."""
+        rows = [
+            {
+                "ticker": ticker,
+                "interval": interval,
+                "open_time": open_time,
+                "open": o,
+                "high": h,
+                "low": l,
+                "close": c,
+                "volume": v,
+            }
+            for (ticker, interval, open_time), (o, h, l, c, v) in sorted(self._bars.items())
+        ]
+        self._bars.clear()
+        if not rows:
+            return
+
+        stmt = pg_insert(Candle)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Candle.ticker, Candle.interval, Candle.open_time],
+            set_={
+                "high": func.greatest(Candle.high, stmt.excluded.high),
+                "low": func.least(Candle.low, stmt.excluded.low),
+                "close": stmt.excluded.close,
+                "volume": Candle.volume + stmt.excluded.volume,
+            },
+        )
+        await db.execute(stmt, rows)
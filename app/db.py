@@ -0,0 +1,80 @@
+import os
+from typing import Any, Dict
+
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+
+
+def _env_bool(name: str, default: bool) -> bool:
+    value = os.getenv(name)
+    if value is None:
+        return default
+    return value.strip().lower() in ("1", "true", "yes", "on")
+
+
+# Взято из переменных окружения (или .env через python-dotenv)
+DATABASE_URL = os.getenv("DATABASE_URL")
+
+# Параметры пула; подбираются под число воркеров uvicorn:
+# на каждый воркер держится до DB_POOL_SIZE + DB_MAX_OVERFLOW соединений
+DB_ECHO = _env_bool("DB_ECHO", False)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = _env_bool("DB_POOL_PRE_PING", True)
+# Кэш подготовленных выражений asyncpg на соединение (0 — выключить, нужно за pgbouncer)
+DB_STATEMENT_CACHE_SIZE = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "1024"))
+
+
+def _engine_options() -> Dict[str, Any]:
+    options: Dict[str, Any] = {
+        "echo": DB_ECHO,
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+    if DATABASE_URL and make_url(DATABASE_URL).get_driver_name() == "asyncpg":
+        # Кэш подготовленных выражений самого asyncpg
+        options["connect_args"] = {"statement_cache_size": DB_STATEMENT_CACHE_SIZE}
+    return options
+
+
+def _database_url() -> str:
+    url = make_url(DATABASE_URL)
+    if url.get_driver_name() == "asyncpg":
+        # ...и кэш подготовленных выражений на стороне диалекта SQLAlchemy
+        url = url.update_query_dict(
+            {"prepared_statement_cache_size": str(DB_STATEMENT_CACHE_SIZE)}
+        )
+    return url.render_as_string(hide_password=False)
+
+
+# 1) Асинхронный движок с настраиваемым пулом
+engine = create_async_engine(_database_url(), **_engine_options())
+
+# 2) Фабрика сессий
+AsyncSessionLocal = sessionmaker(
+    bind=engine,
+    class_=AsyncSession,
+    expire_on_commit=False,
+)
+
+
+def pool_stats() -> Dict[str, Any]:
+    """Текущее состояние пула соединений (для подбора размера под воркеры)."""
+    pool = engine.sync_engine.pool
+    capacity = DB_POOL_SIZE + DB_MAX_OVERFLOW
+    checked_out = pool.checkedout()
+    return {
+        "pool_size": pool.size(),
+        "max_overflow": DB_MAX_OVERFLOW,
+        "checked_in": pool.checkedin(),
+        "checked_out": checked_out,
+        "overflow": pool.overflow(),
+        "capacity": capacity,
+        "utilization": checked_out / capacity if capacity else 0.0,
+    }
@@ -1,29 +1,17 @@
 import os
-from typing import AsyncGenerator
+from typing import AsyncGenerator, NamedTuple
 from uuid import UUID
 from fastapi import HTTPException, status, Depends, Header
-from app.models import User
-from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
-from sqlalchemy.orm import sessionmaker
+from app.cache import TTLCache
+from app.metrics import auth_lookups
+from app.models import RoleEnum, User
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from app.api.jwt_token import decode_access_token 
+from app.db import DATABASE_URL, engine, AsyncSessionLocal
 # from jose import JWTError
 
-# Взято из переменных окружения (или .env через python-dotenv)
-DATABASE_URL = os.getenv("DATABASE_URL")
-
-# 1) Создаём асинхронный движок
-engine = create_async_engine(
-    DATABASE_URL,
-    echo=True,  # для логирования SQL-запросов
-)
-
-# 2) Конфигурируем фабрику сессий
-AsyncSessionLocal = sessionmaker(
-    bind=engine,
-    class_=AsyncSession,
-    expire_on_commit=False,
-)
+# 1-2) Движок и фабрика сессий настраиваются из окружения в app/db.py
 
 # 3) Депенденси, отдающий сессию в каждый запрос и корректно её закрывающий
 async def get_db() -> AsyncGenerator[AsyncSession, None]:
@@ -33,26 +21,57 @@ async def get_db() -> AsyncGenerator[AsyncSession, None]:
         finally:
             await session.close()
 
-# 4) Депенденси для получения текущего пользователя по API-ключу
-async def get_current_user(
+# 4) Кэш аутентификации: api_key -> (user_id, role), чтобы не ходить в БД на каждый запрос
+class AuthUser(NamedTuple):
+    id: UUID
+    role: RoleEnum
+
+
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "10000"))
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+
+auth_cache: TTLCache[AuthUser] = TTLCache(maxsize=AUTH_CACHE_SIZE, ttl=AUTH_CACHE_TTL)
+
+
+def invalidate_api_key(api_key: str) -> None:
+    """Сбрасывает закэшированного пользователя (например, после удаления)."""
+    auth_cache.pop(api_key)
+
+
+# 5) Депенденси для получения текущего пользователя по API-ключу
+async def get_current_principal(
     authorization: str = Header(..., alias="Authorization",
                                 description="Введите `TOKEN <ваш_api_key>`"),
     db: AsyncSession = Depends(get_db),
-) -> UUID:
+) -> AuthUser:
     prefix = "TOKEN "
     if not authorization.startswith(prefix):
         raise HTTPException(status.HTTP_401_UNAUTHORIZED,
                             detail="Missing or wrong token prefix")
     api_key = authorization[len(prefix):].strip()
 
-    user = await db.scalar(
-        select(User).where(User.api_key == api_key)
-    )
-    if not user:
+    principal = auth_cache.get(api_key)
+    if principal is not None:
+        auth_lookups.inc(labels=("hit",))
+        return principal
+    auth_lookups.inc(labels=("miss",))
+
+    row = (await db.execute(
+        select(User.id, User.role).where(User.api_key == api_key, User.deleted_at.is_(None))
+    )).first()
+    if not row:
         raise HTTPException(status.HTTP_401_UNAUTHORIZED,
                             detail="Invalid API key")
 
-    return user.id
+    principal = AuthUser(id=row.id, role=row.role)
+    auth_cache.set(api_key, principal)
+    return principal
+
+
+async def get_current_user(
+    principal: AuthUser = Depends(get_current_principal),
+) -> UUID:
+    return principal.id
 # async def get_current_user(
 #     authorization: str = Header(
 #         ...,
@@ -0,0 +1,135 @@
+import asyncio
+import logging
+from typing import Dict, List, NamedTuple, Optional, Set
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine, AsyncSession
+
+from app.models import Instrument, InstrumentStatusEnum
+
+logger = logging.getLogger(__name__)
+
+# Канал LISTEN/NOTIFY: payload — тикер изменённого инструмента
+INSTRUMENTS_CHANNEL = "instruments_changed"
+# Пауза перед переподключением слушателя после обрыва соединения
+RECONNECT_DELAY = 1.0
+
+
+class InstrumentInfo(NamedTuple):
+    ticker: str
+    name: str
+    status: InstrumentStatusEnum
+    currency: str
+
+
+_COLUMNS = (Instrument.ticker, Instrument.name, Instrument.status, Instrument.currency)
+
+
+class InstrumentRegistry:
+    """
+    Справочник инструментов в памяти процесса.
+
+    Таблица instruments меняется только через админские ручки: они вызывают
+    notify() в той же транзакции, что и изменение, и после коммита Postgres
+    рассылает тикер всем слушателям. Каждый воркер держит выделенное
+    соединение с LISTEN и перечитывает одну строку по пришедшему тикеру;
+    после обрыва соединения справочник перечитывается целиком.
+    """
+
+    def __init__(self):
+        self._items: Dict[str, InstrumentInfo] = {}
+        self._bind: Optional[AsyncEngine] = None
+        self._conn: Optional[AsyncConnection] = None
+        self._tasks: Set[asyncio.Task] = set()
+
+    def get(self, ticker: str) -> Optional[InstrumentInfo]:
+        return self._items.get(ticker)
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker in self._items
+
+    def active(self) -> List[InstrumentInfo]:
+        return [
+            i for t, i in sorted(self._items.items())
+            if i.status == InstrumentStatusEnum.ACTIVE
+        ]
+
+    def put(self, info: InstrumentInfo) -> None:
+        self._items[info.ticker] = info
+
+    def discard(self, ticker: str) -> None:
+        self._items.pop(ticker, None)
+
+    async def load(self, db: AsyncSession) -> None:
+        rows = await db.execute(select(*_COLUMNS).where(Instrument.deleted_at.is_(None)))
+        self._items = {r.ticker: InstrumentInfo(*r) for r in rows}
+
+    async def refresh(self, db: AsyncSession, ticker: str) -> None:
+        """Перечитывает один инструмент; удалённый убирается из справочника."""
+        row = (await db.execute(
+            select(*_COLUMNS).where(Instrument.ticker == ticker, Instrument.deleted_at.is_(None))
+        )).first()
+        if row is None:
+            self.discard(ticker)
+        else:
+            self.put(InstrumentInfo(*row))
+
+    @staticmethod
+    async def notify(db: AsyncSession, ticker: str) -> None:
+        """Оповещение остальных воркеров; уходит при коммите транзакции db."""
+        await db.execute(select(func.pg_notify(INSTRUMENTS_CHANNEL, ticker)))
+
+    # ---------- LISTEN ----------
+    async def listen(self, bind: AsyncEngine) -> None:
+        """Подписывается на изменения и загружает справочник (после подписки — без окна потерь)."""
+        self._bind = bind
+        self._conn = await bind.connect()
+        raw = (await self._conn.get_raw_connection()).driver_connection
+        await raw.add_listener(INSTRUMENTS_CHANNEL, self._on_notify)
+        raw.add_termination_listener(self._on_terminate)
+        await self._reload()
+
+    async def stop(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            # invalidate, а не close: соединение с LISTEN не должно вернуться в пул
+            await conn.invalidate()
+
+    def _on_notify(self, connection, pid, channel, payload) -> None:
+        self._spawn(self._refresh(payload))
+
+    def _on_terminate(self, connection) -> None:
+        if self._conn is not None:
+            logger.warning("Соединение LISTEN %s оборвалось, переподключаемся", INSTRUMENTS_CHANNEL)
+            self._conn = None
+            self._spawn(self._reconnect())
+
+    def _spawn(self, coro) -> None:
+        task = asyncio.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _refresh(self, ticker: str) -> None:
+        async with AsyncSession(self._bind) as db:
+            await self.refresh(db, ticker)
+
+    async def _reload(self) -> None:
+        async with AsyncSession(self._bind) as db:
+            await self.load(db)
+
+    async def _reconnect(self) -> None:
+        while self._conn is None:
+            await asyncio.sleep(RECONNECT_DELAY)
+            try:
+                await self.listen(self._bind)
+            except Exception:
+                logger.exception("Не удалось подписаться на %s", INSTRUMENTS_CHANNEL)
+                if self._conn is not None:
+                    conn, self._conn = self._conn, None
+                    await conn.invalidate()
+
+
+instrument_registry = InstrumentRegistry()
@@ -0,0 +1,183 @@
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+from uuid import UUID, uuid4
+
+from sqlalchemy import Integer, String, literal, select, update
+from sqlalchemy.dialects.postgresql import UUID as PG_UUID, insert as pg_insert
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Balance, OrderSideEnum, User
+
+if TYPE_CHECKING:
+    from app.matching.book import Fill
+
+# Тикер денежного баланса: им платят за покупки и получают за продажи
+QUOTE_TICKER = "RUB"
+
+
+class InsufficientFunds(Exception):
+    """Недостаточно свободных средств для резервирования."""
+
+    def __init__(self, ticker: str):
+        super().__init__(f"Insufficient {ticker} funds")
+        self.ticker = ticker
+
+
+def order_hold(ticker: str, side: OrderSideEnum, qty: int, price: int) -> Tuple[str, int]:
+    """Что блокирует заявка: (тикер баланса, сумма). Для BUY — рубли, для SELL — сам инструмент."""
+    if side == OrderSideEnum.BUY:
+        return QUOTE_TICKER, qty * price
+    return ticker, qty
+
+
+async def hold(db: AsyncSession, user_id: UUID, ticker: str, amount: int) -> None:
+    """
+    Переносит amount из свободного остатка в заблокированный одним
+    условным UPDATE; если свободных средств не хватает — InsufficientFunds.
+    """
+    if amount <= 0:
+        return
+    res = await db.execute(
+        update(Balance)
+        .where(
+            Balance.user_id == user_id,
+            Balance.ticker == ticker,
+            Balance.amount >= amount,
+        )
+        .values(amount=Balance.amount - amount, locked=Balance.locked + amount)
+        .returning(Balance.id)
+    )
+    if res.scalar_one_or_none() is None:
+        raise InsufficientFunds(ticker)
+
+
+def _live_user(user_id: UUID):
+    """Пользователь, если он есть и не удалён (удалённых дочищает reaper)."""
+    return select(User.id).where(User.id == user_id, User.deleted_at.is_(None))
+
+
+async def deposit(db: AsyncSession, user_id: UUID, ticker: str, amount: int) -> Optional[int]:
+    """
+    Зачисление одним INSERT ... SELECT ... ON CONFLICT DO UPDATE: баланс
+    создаётся или пополняется атомарно. Возвращает новый свободный остаток
+    или None, если пользователя нет или он удалён.
+    """
+    rows = select(
+        literal(uuid4(), PG_UUID(as_uuid=True)),
+        User.id,
+        literal(ticker, String),
+        literal(amount, Integer),
+    ).where(User.id == user_id, User.deleted_at.is_(None))
+    stmt = pg_insert(Balance).from_select(
+        [Balance.id, Balance.user_id, Balance.ticker, Balance.amount], rows
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Balance.user_id, Balance.ticker],
+        set_={"amount": Balance.amount + stmt.excluded.amount},
+    ).returning(Balance.amount)
+    return (await db.execute(stmt)).scalar_one_or_none()
+
+
+async def withdraw(db: AsyncSession, user_id: UUID, ticker: str, amount: int) -> Optional[int]:
+    """
+    Списание одним условным UPDATE ... RETURNING. Возвращает новый
+    свободный остаток или None, если баланса нет (или пользователь удалён)
+    или средств не хватает.
+    """
+    res = await db.execute(
+        update(Balance)
+        .where(
+            Balance.user_id.in_(_live_user(user_id)),
+            Balance.ticker == ticker,
+            Balance.amount >= amount,
+        )
+        .values(amount=Balance.amount - amount)
+        .returning(Balance.amount)
+    )
+    return res.scalar_one_or_none()
+
+
+async def has_balance(db: AsyncSession, user_id: UUID, ticker: str) -> bool:
+    res = await db.execute(
+        select(Balance.id).where(Balance.user_id.in_(_live_user(user_id)), Balance.ticker == ticker)
+    )
+    return res.first() is not None
+
+
+async def available_for_update(db: AsyncSession, user_id: UUID) -> Dict[str, int]:
+    """Свободные остатки пользователя по тикерам; строки блокируются до конца транзакции."""
+    # Строки блокируются в порядке тикеров, как и в BalanceDeltas.apply
+    rows = await db.execute(
+        select(Balance.ticker, Balance.amount)
+        .where(Balance.user_id == user_id)
+        .order_by(Balance.ticker)
+        .with_for_update()
+    )
+    return {ticker: int(amount) for ticker, amount in rows}
+
+
+class BalanceDeltas:
+    """Накопитель изменений балансов: (user_id, ticker) -> [d_amount, d_locked]."""
+
+    def __init__(self):
+        self._deltas: Dict[Tuple[UUID, str], List[int]] = {}
+
+    def __bool__(self) -> bool:
+        return bool(self._deltas)
+
+    def add(self, user_id: UUID, ticker: str, amount: int = 0, locked: int = 0) -> None:
+        delta = self._deltas.setdefault((user_id, ticker), [0, 0])
+        delta[0] += amount
+        delta[1] += locked
+
+    def release(self, user_id: UUID, ticker: str, amount: int) -> None:
+        """Возвращает заблокированное в свободный остаток."""
+        self.add(user_id, ticker, amount=amount, locked=-amount)
+
+    def settle(self, ticker: str, fills: Iterable["Fill"], taker_price: Optional[int]) -> None:
+        """
+        Расчёты по сделкам: продавец отдаёт заблокированный инструмент и
+        получает рубли, покупатель платит из заблокированных рублей и получает
+        инструмент. Покупателю-taker'у с лимитной ценой выше цены сделки
+        разница возвращается в свободный остаток.
+        """
+        for f in fills:
+            if f.taker_side == OrderSideEnum.BUY:
+                buyer, seller = f.taker_user_id, f.maker.user_id
+                # Рыночная заявка блокировала ровно стоимость сделок
+                reserved_price = taker_price if taker_price is not None else f.price
+            else:
+                buyer, seller = f.maker.user_id, f.taker_user_id
+                reserved_price = f.maker.price
+            cost = f.qty * f.price
+
+            self.add(seller, ticker, locked=-f.qty)
+            self.add(seller, QUOTE_TICKER, amount=cost)
+            self.add(buyer, ticker, amount=f.qty)
+            self.add(buyer, QUOTE_TICKER,
+                     amount=f.qty * reserved_price - cost,
+                     locked=-f.qty * reserved_price)
+
+    async def apply(self, db: AsyncSession) -> None:
+        """Применяет все изменения одним многострочным INSERT ... ON CONFLICT DO UPDATE."""
+        rows = [
+            {"id": uuid4(), "user_id": user_id, "ticker": ticker, "amount": d_amount, "locked": d_locked}
+            for (user_id, ticker), (d_amount, d_locked) in sorted(
+                self._deltas.items(), key=lambda item: (str(item[0][0]), item[0][1])
+            )
+            if d_amount or d_locked
+        ]
+        self._deltas.clear()
+        if not rows:
+            return
+
+        stmt = pg_insert(Balance)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[Balance.user_id, Balance.ticker],
+            set_={
+                "amount": Balance.amount + stmt.excluded.amount,
+                "locked": Balance.locked + stmt.excluded.locked,
+            },
+        )
+        # Строки упорядочены по ключу, чтобы параллельные транзакции брали
+        # блокировки в одном порядке
+        await db.execute(stmt, rows)
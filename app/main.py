@@ -1,62 +1,86 @@
+import asyncio
 import logging
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-from starlette.middleware.base import BaseHTTPMiddleware
+from contextlib import asynccontextmanager, suppress
+from fastapi import FastAPI
 from app.api.public import router as public_router
 from app.api.balance import router as balance_router
 from app.api.orders import router as orders_router
 from app.api.admin import router as admins_router
 from app.api.user import router as user_router
+from app.api.stream import router as stream_router
+from app.api.metrics import router as metrics_router
+from app.logging_config import setup_logging, shutdown_logging
+from app.middleware import DeleteBodyValidatorMiddleware, RequestLoggingMiddleware
+from app.metrics import MetricsMiddleware, instrument_engine
+from app import querybudget
+from app.db import engine as db_engine
+from app.deps import AsyncSessionLocal
+from app.instruments import instrument_registry
+from app.matching import matching_engine, ticker_cache
+from app.reaper import reaper
 
-# Настройка логирования ДО создания app
-logging.basicConfig(
-    format='%(asctime)s %(levelname)-8s [%(filename)s:%(lineno)d] %(message)s',
-    level=logging.DEBUG,    
-    handlers=[
-        logging.StreamHandler(),  # Вывод в консоль
-        logging.FileHandler('app.log', mode='a')  # Запись в файл
-    ]
-)
+# Настройка логирования ДО создания app: запись идёт через очередь в отдельном потоке
+setup_logging()
 logger = logging.getLogger(__name__)
 
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Справочник инструментов: загрузка и подписка на изменения (LISTEN)
+    await instrument_registry.listen(db_engine)
+    # Захватываем тикеры своей доли и восстанавливаем их стаканы:
+    # снимок на диске + хвост журнала (или живые заявки из БД)
+    await matching_engine.start()
+    # Последние сделки и суточный объём — для /public/ticker
+    async with AsyncSessionLocal() as db:
+        await ticker_cache.load(db)
+    snapshots = asyncio.create_task(matching_engine.run_snapshots())
+    # Владение тикерами: соединение с advisory lock'ами могло оборваться
+    ownership = asyncio.create_task(matching_engine.run_ownership_checks())
+    # Пачечная дочистка удалённых пользователей и инструментов
+    reaping = asyncio.create_task(reaper.run())
+    yield
+    for task in (reaping, ownership, snapshots):
+        task.cancel()
+        with suppress(asyncio.CancelledError):
+            await task
+    await matching_engine.stop()
+    await instrument_registry.stop()
+    if querybudget.QUERY_REPORT:
+        querybudget.query_report.write(querybudget.QUERY_REPORT)
+    shutdown_logging()
+
+
 app = FastAPI(
     title="Test",
     version="0.1.0",
-    description="Мини-биржа"
+    description="Мини-биржа",
+    lifespan=lifespan,
 )
 
-# Middleware для проверки тела в DELETE-запросах
-class DeleteBodyValidatorMiddleware(BaseHTTPMiddleware):
-    async def dispatch(self, request: Request, call_next):
-        if request.method == "DELETE":
-            body = await request.body()
-            if body not in (b"", b"{}"):
-                return JSONResponse(
-                    status_code=422,
-                    content={"detail": "DELETE-запрос не должен содержать тело"}
-                )
-        return await call_next(request)
-
+# Middleware (чистый ASGI, без BaseHTTPMiddleware):
+# проверка тела в DELETE-запросах, логирование запросов и метрики (внешний слой)
 app.add_middleware(DeleteBodyValidatorMiddleware)
+app.add_middleware(RequestLoggingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+# Счётчики и длительности запросов к БД, ожидание пула — для /metrics
+instrument_engine(db_engine)
+
+# Разработка: бюджет запросов к БД на запрос и поиск N+1 (QUERY_BUDGET / QUERY_REPORT)
+if querybudget.enabled():
+    querybudget.install(db_engine)
+    app.add_middleware(querybudget.QueryBudgetMiddleware)
 
 # Логируем старт приложения
 logger.info("Приложение запущено")
 
-# Middleware для логирования запросов
-@app.middleware("http")
-async def log_requests(request, call_next):
-    logger.debug(f"Входящий запрос: {request.method} {request.url}")
-    try:
-        response = await call_next(request)
-        logger.debug(f"Ответ: {response.status_code}")
-        return response
-    except Exception as e:
-        logger.error(f"Ошибка при обработке запроса: {str(e)}", exc_info=True)
-        raise
-
 # Подключаем роутеры
 app.include_router(public_router)
+# Админский раньше балансового: оба объявляют POST /api/v1/admin/balance/deposit
+# и /withdraw, и зачисление по user_id должно доставаться админской ручке
+app.include_router(admins_router)
 app.include_router(balance_router)
 app.include_router(orders_router)
-app.include_router(admins_router)
 app.include_router(user_router)
+app.include_router(stream_router)
+app.include_router(metrics_router)
@@ -0,0 +1,5 @@
+from .book import Fill, OrderBook, RestingOrder
+from .feed import MarketFeed, Subscription, market_feed
+from .sequencer import Sequencer, ShardTaken, TickerNotOwned
+from .ticker import TickerCache, TickerStats, ticker_cache
+from .engine import LIVE_STATUSES, MatchingEngine, matching_engine, order_status
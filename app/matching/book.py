@@ -0,0 +1,263 @@
+from bisect import bisect_left, insort
+from collections import deque
+from dataclasses import dataclass
+from typing import Deque, Dict, Iterator, List, Optional, Set, Tuple
+from uuid import UUID
+
+from app.models import OrderSideEnum
+
+
+@dataclass(slots=True)
+class RestingOrder:
+    """Лимитная заявка, стоящая в стакане."""
+    id: UUID
+    user_id: UUID
+    side: OrderSideEnum
+    price: int
+    quantity: int
+    filled: int = 0
+
+    @property
+    def remaining(self) -> int:
+        return self.quantity - self.filled
+
+
+@dataclass(slots=True)
+class Fill:
+    """Одна сделка между входящей (taker) и стоящей (maker) заявкой."""
+    maker: RestingOrder
+    taker_id: UUID
+    taker_user_id: UUID
+    taker_side: OrderSideEnum
+    price: int
+    qty: int
+
+    @property
+    def buy_order_id(self) -> UUID:
+        return self.taker_id if self.taker_side == OrderSideEnum.BUY else self.maker.id
+
+    @property
+    def sell_order_id(self) -> UUID:
+        return self.maker.id if self.taker_side == OrderSideEnum.BUY else self.taker_id
+
+
+class OrderBook:
+    """
+    Стакан одного инструмента с приоритетом цена-время.
+
+    На каждый ценовой уровень — FIFO-очередь заявок, отсортированные списки
+    цен позволяют за O(1) найти лучший bid/ask, а индекс по id — снять заявку.
+    Суммарный остаток по уровням (L2) поддерживается дельтами при каждом
+    изменении, поэтому чтение топа стакана не требует пересчёта.
+    """
+
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        self._levels: Dict[OrderSideEnum, Dict[int, Deque[RestingOrder]]] = {
+            OrderSideEnum.BUY: {},
+            OrderSideEnum.SELL: {},
+        }
+        # Цены по возрастанию; лучший bid — последний, лучший ask — первый
+        self._prices: Dict[OrderSideEnum, List[int]] = {
+            OrderSideEnum.BUY: [],
+            OrderSideEnum.SELL: [],
+        }
+        # Остаток (quantity - filled) по каждому ценовому уровню
+        self._depth: Dict[OrderSideEnum, Dict[int, int]] = {
+            OrderSideEnum.BUY: {},
+            OrderSideEnum.SELL: {},
+        }
+        self._orders: Dict[UUID, RestingOrder] = {}
+        # id заявок каждого пользователя — для массовой отмены без поиска по БД
+        self._by_user: Dict[UUID, Set[UUID]] = {}
+        # Уровни, изменившиеся с последнего pop_changes() (для рассылки дельт)
+        self._changed: Dict[OrderSideEnum, Set[int]] = {
+            OrderSideEnum.BUY: set(),
+            OrderSideEnum.SELL: set(),
+        }
+
+    def __len__(self) -> int:
+        return len(self._orders)
+
+    def __contains__(self, order_id: UUID) -> bool:
+        return order_id in self._orders
+
+    def get(self, order_id: UUID) -> Optional[RestingOrder]:
+        return self._orders.get(order_id)
+
+    def __iter__(self) -> Iterator[RestingOrder]:
+        """Все стоящие заявки: по сторонам и ценам, внутри уровня — в порядке очереди."""
+        for side in (OrderSideEnum.BUY, OrderSideEnum.SELL):
+            levels = self._levels[side]
+            for price in self._prices[side]:
+                yield from levels[price]
+
+    def user_orders(
+        self, user_id: UUID, side: Optional[OrderSideEnum] = None
+    ) -> List[RestingOrder]:
+        """Стоящие заявки пользователя (опционально одной стороны)."""
+        ids = self._by_user.get(user_id, ())
+        orders = [self._orders[i] for i in ids]
+        if side is not None:
+            orders = [o for o in orders if o.side == side]
+        return orders
+
+    def best_price(self, side: OrderSideEnum) -> Optional[int]:
+        prices = self._prices[side]
+        if not prices:
+            return None
+        return prices[-1] if side == OrderSideEnum.BUY else prices[0]
+
+    def depth(self, side: OrderSideEnum, limit: int) -> List[Tuple[int, int]]:
+        """Топ-limit уровней стороны: [(price, qty)] от лучшей цены, O(limit)."""
+        prices = self._prices[side]
+        depth = self._depth[side]
+        if side == OrderSideEnum.BUY:
+            top = prices[:-limit - 1:-1]
+        else:
+            top = prices[:limit]
+        return [(p, depth[p]) for p in top]
+
+    def market_cost(self, side: OrderSideEnum, qty: int) -> int:
+        """Стоимость рыночной заявки side на qty лотов по текущему стакану (без изменений)."""
+        opposite = OrderSideEnum.SELL if side == OrderSideEnum.BUY else OrderSideEnum.BUY
+        prices = self._prices[opposite]
+        depth = self._depth[opposite]
+        ordered = prices if opposite == OrderSideEnum.SELL else reversed(prices)
+        cost = 0
+        for price in ordered:
+            if qty <= 0:
+                break
+            traded = min(qty, depth[price])
+            cost += traded * price
+            qty -= traded
+        return cost
+
+    def level_qty(self, side: OrderSideEnum, price: int) -> int:
+        return self._depth[side].get(price, 0)
+
+    def pop_changes(self) -> Dict[OrderSideEnum, List[Tuple[int, int]]]:
+        """Изменившиеся уровни [(price, qty)] по сторонам; qty=0 — уровень исчез."""
+        changes = {}
+        for side, prices in self._changed.items():
+            changes[side] = [(p, self.level_qty(side, p)) for p in sorted(prices)]
+            prices.clear()
+        return changes
+
+    def add(self, order: RestingOrder) -> None:
+        """Ставит заявку в конец очереди её ценового уровня."""
+        levels = self._levels[order.side]
+        queue = levels.get(order.price)
+        if queue is None:
+            queue = levels[order.price] = deque()
+            insort(self._prices[order.side], order.price)
+            self._depth[order.side][order.price] = 0
+        queue.append(order)
+        self._depth[order.side][order.price] += order.remaining
+        self._changed[order.side].add(order.price)
+        self._orders[order.id] = order
+        self._by_user.setdefault(order.user_id, set()).add(order.id)
+
+    def remove(self, order_id: UUID) -> Optional[RestingOrder]:
+        """Снимает заявку из стакана (отмена). Возвращает её или None."""
+        order = self._orders.pop(order_id, None)
+        if order is None:
+            return None
+        self._forget_user_order(order)
+        queue = self._levels[order.side][order.price]
+        queue.remove(order)
+        self._depth[order.side][order.price] -= order.remaining
+        self._changed[order.side].add(order.price)
+        if not queue:
+            self._drop_level(order.side, order.price)
+        return order
+
+    def set_filled(self, order_id: UUID, filled: int) -> None:
+        """Выставляет исполненный объём стоящей заявки (восстановление из журнала)."""
+        order = self._orders.get(order_id)
+        if order is None:
+            return
+        self._depth[order.side][order.price] -= filled - order.filled
+        self._changed[order.side].add(order.price)
+        order.filled = filled
+        if order.remaining <= 0:
+            self.remove(order_id)
+
+    def _forget_user_order(self, order: RestingOrder) -> None:
+        ids = self._by_user[order.user_id]
+        ids.discard(order.id)
+        if not ids:
+            del self._by_user[order.user_id]
+
+    def _drop_level(self, side: OrderSideEnum, price: int) -> None:
+        del self._levels[side][price]
+        del self._depth[side][price]
+        prices = self._prices[side]
+        del prices[bisect_left(prices, price)]
+
+    def _crosses(self, side: OrderSideEnum, limit: Optional[int], level_price: int) -> bool:
+        if limit is None:  # рыночная заявка берёт любую цену
+            return True
+        if side == OrderSideEnum.BUY:
+            return level_price <= limit
+        return level_price >= limit
+
+    def match(
+        self,
+        order_id: UUID,
+        user_id: UUID,
+        side: OrderSideEnum,
+        qty: int,
+        price: Optional[int] = None,
+    ) -> List[Fill]:
+        """
+        Исполняет входящую заявку против противоположной стороны стакана.
+
+        price=None — рыночная заявка: исполняется по лучшим ценам, остаток
+        в стакан не ставится. Лимитный остаток становится в очередь.
+        Сделки проходят по цене стоящей заявки.
+        """
+        side = OrderSideEnum(side)
+        opposite = OrderSideEnum.SELL if side == OrderSideEnum.BUY else OrderSideEnum.BUY
+        levels = self._levels[opposite]
+        depth = self._depth[opposite]
+        fills: List[Fill] = []
+        left = qty
+
+        while left > 0:
+            best = self.best_price(opposite)
+            if best is None or not self._crosses(side, price, best):
+                break
+            queue = levels[best]
+            while left > 0 and queue:
+                maker = queue[0]
+                traded = min(left, maker.remaining)
+                maker.filled += traded
+                depth[best] -= traded
+                self._changed[opposite].add(best)
+                left -= traded
+                fills.append(Fill(
+                    maker=maker,
+                    taker_id=order_id,
+                    taker_user_id=user_id,
+                    taker_side=side,
+                    price=best,
+                    qty=traded,
+                ))
+                if maker.remaining == 0:
+                    queue.popleft()
+                    del self._orders[maker.id]
+                    self._forget_user_order(maker)
+            if not queue:
+                self._drop_level(opposite, best)
+
+        if left > 0 and price is not None:
+            self.add(RestingOrder(
+                id=order_id,
+                user_id=user_id,
+                side=side,
+                price=price,
+                quantity=qty,
+                filled=qty - left,
+            ))
+        return fills
@@ -0,0 +1,681 @@
+import asyncio
+import logging
+import os
+import time
+from contextlib import asynccontextmanager, suppress
+from datetime import datetime, timezone
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple, TypeVar
+from uuid import UUID, uuid4
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import ledger
+from app.candles import CandleUpdates
+from app.db import AsyncSessionLocal, engine as db_engine
+from app.ledger import QUOTE_TICKER, BalanceDeltas, InsufficientFunds, order_hold
+from app.matching import snapshot
+from app.matching.book import Fill, OrderBook, RestingOrder
+from app.matching.feed import Subscription, market_feed
+from app.matching.sequencer import OWNERSHIP_CHECK_INTERVAL, Sequencer, TickerNotOwned
+from app.matching.ticker import ticker_cache
+from app.metrics import Counter, Histogram
+from app.models import Instrument, Order, OrderSideEnum, OrderStatusEnum, Transaction
+
+logger = logging.getLogger(__name__)
+
+# Считаются после коммита группы: откаченное не учитывается
+orders_committed = Counter("matching_orders_total", "Принятые заявки")
+trades_committed = Counter("matching_trades_total", "Сделки")
+cancels_committed = Counter("matching_cancels_total", "Отменённые заявки")
+flush_duration = Histogram("matching_flush_duration_seconds", "Запись группы команд и коммит")
+
+T = TypeVar("T")
+
+# Статусы заявок, которые ещё стоят в стакане
+LIVE_STATUSES = (OrderStatusEnum.NEW, OrderStatusEnum.PARTIALLY_EXECUTED)
+
+
+def order_status(quantity: int, filled: int, resting: bool = True) -> OrderStatusEnum:
+    """Статус заявки по исполненному объёму. resting=False — остаток не стоит в стакане."""
+    if filled >= quantity:
+        return OrderStatusEnum.EXECUTED
+    if not resting:
+        return OrderStatusEnum.CANCELLED
+    if filled > 0:
+        return OrderStatusEnum.PARTIALLY_EXECUTED
+    return OrderStatusEnum.NEW
+
+
+class WriteBatch:
+    """
+    Отложенная запись (write-behind) результатов группы команд одного тикера.
+
+    Новые заявки, состояния встречных заявок, сделки, отмены, журнал стакана,
+    бары OHLCV, цена последней сделки и изменения балансов копятся в памяти и в flush() пишутся по одному
+    executemany на таблицу в одной транзакции. Резервы (ledger.hold) идут
+    в db сразу: им нужен актуальный остаток.
+    """
+
+    def __init__(self, db: AsyncSession):
+        self.db = db
+        self.deltas = BalanceDeltas()
+        self.candles = CandleUpdates()
+        self._orders: List[Order] = []
+        self._makers: Dict[UUID, RestingOrder] = {}
+        self._trades: List[Dict[str, Any]] = []
+        self._cancelled: List[UUID] = []
+        self._events: List[Dict[str, Any]] = []
+        self._last_prices: Dict[str, int] = {}
+        self._published: List[Tuple[OrderBook, List[Fill], Optional[datetime]]] = []
+
+    def add_order(self, order: Order) -> None:
+        self._orders.append(order)
+
+    def add_fills(self, ticker: str, fills: List[Fill], now: datetime) -> None:
+        for f in fills:
+            # Встречная заявка пишется один раз, в итоговом состоянии
+            self._makers[f.maker.id] = f.maker
+            self._trades.append({
+                "id": uuid4(),
+                "buy_order_id": f.buy_order_id,
+                "sell_order_id": f.sell_order_id,
+                "ticker": ticker,
+                "quantity": f.qty,
+                "price": f.price,
+                "timestamp": now,
+            })
+            self.candles.add(ticker, f.price, f.qty, now)
+            self._last_prices[ticker] = f.price
+
+    def cancel(self, ticker: str, resting: RestingOrder) -> None:
+        self._cancelled.append(resting.id)
+        self._events.append(snapshot.event_row(ticker, resting, live=False))
+
+    def journal(
+        self,
+        book: OrderBook,
+        makers: Iterable[RestingOrder],
+        new_ids: Iterable[UUID],
+        gone: Optional[Dict[UUID, RestingOrder]] = None,
+    ) -> None:
+        """
+        События журнала после команды: сначала новые стоящие заявки (в порядке
+        постановки — так сохраняется очередь на уровне), затем встречные.
+        gone — заявки, которые успели встать и уже исполнились (пакет).
+        """
+        resting: Dict[UUID, RestingOrder] = {}
+        for order_id in new_ids:
+            r = book.get(order_id) or (gone or {}).get(order_id)
+            if r is not None:
+                resting[order_id] = r
+        for m in makers:
+            resting.setdefault(m.id, m)
+        self._events.extend(
+            snapshot.event_row(book.ticker, r, r.id in book) for r in resting.values()
+        )
+
+    def publish(self, book: OrderBook, fills: List[Fill], timestamp: Optional[datetime]) -> None:
+        """Рассылка подписчикам — только после коммита, см. published()."""
+        self._published.append((book, fills, timestamp))
+
+    async def flush(self) -> None:
+        """
+        Пишет накопленное одной транзакцией. Порядок важен: заявки раньше
+        сделок (FK), обновления встречных раньше отмен (итог — CANCELLED).
+        """
+        db = self.db
+        start = time.perf_counter()
+        if self._orders:
+            await db.execute(insert(Order), [
+                {
+                    "id": o.id,
+                    "user_id": o.user_id,
+                    "ticker": o.ticker,
+                    "side": o.side,
+                    "quantity": o.quantity,
+                    "price": o.price,
+                    "status": o.status,
+                    "filled_qty": o.filled_qty,
+                    "created_at": o.created_at,
+                }
+                for o in self._orders
+            ])
+        if self._makers:
+            await db.execute(update(Order), [
+                {
+                    "id": m.id,
+                    "filled_qty": m.filled,
+                    "status": order_status(m.quantity, m.filled),
+                }
+                for m in self._makers.values()
+            ])
+        if self._cancelled:
+            await db.execute(
+                update(Order)
+                .where(Order.id.in_(self._cancelled), Order.status.in_(LIVE_STATUSES))
+                .values(status=OrderStatusEnum.CANCELLED)
+            )
+        if self._trades:
+            await db.execute(insert(Transaction), self._trades)
+        if self._last_prices:
+            # instruments.current_price — цена последней сделки, с ней же стартует кэш тикеров
+            await db.execute(update(Instrument), [
+                {"ticker": ticker, "current_price": price}
+                for ticker, price in self._last_prices.items()
+            ])
+        await self.candles.apply(db)
+        await snapshot.journal(db, self._events)
+        await self.deltas.apply(db)
+        await db.commit()
+        flush_duration.observe(time.perf_counter() - start)
+
+    def published(self) -> None:
+        """После коммита: изменения стаканов и сделки уходят в кэш тикеров и подписчикам в порядке команд."""
+        orders_committed.inc(len(self._orders))
+        trades_committed.inc(len(self._trades))
+        cancels_committed.inc(len(self._cancelled))
+        for book, fills, timestamp in self._published:
+            if fills:
+                ticker_cache.on_fills(book.ticker, fills, timestamp)
+            market_feed.publish(book, fills, timestamp)
+
+
+class MatchingEngine:
+    """
+    Внутрипроцессный матчинг: свой стакан и свой писатель на каждый тикер.
+
+    Команды по тикеру выполняются по одной в задаче-владельце (Sequencer),
+    заявки исполняются в памяти, а результат (статусы, filled_qty, сделки)
+    копится в WriteBatch группы команд и коммитится одной транзакцией;
+    клиент получает ответ только после коммита своей группы.
+    Между воркерами/репликами тикеры делятся через pg_advisory_lock:
+    команды по чужому тикеру получают TickerNotOwned.
+
+    Каждая команда дописывает в журнал (order_book_events) новые состояния
+    затронутых стоящих заявок; при старте стакан поднимается из снимка на
+    диске и хвоста журнала, а не полным перечитыванием orders.
+    """
+
+    def __init__(self):
+        self._books: Dict[str, OrderBook] = {}
+        # InsufficientFunds — отказ одной команды, а не ошибка всей группы
+        self.sequencer = Sequencer(group=self._write_batch, rejections=(InsufficientFunds,))
+
+    def book(self, ticker: str) -> OrderBook:
+        book = self._books.get(ticker)
+        if book is None:
+            book = self._books[ticker] = OrderBook(ticker)
+        return book
+
+    def find(self, ticker: str) -> Optional[OrderBook]:
+        """Стакан тикера без создания пустого (для чтения из публичных ручек)."""
+        return self._books.get(ticker)
+
+    def _sequenced(
+        self, tickers: List[str], command: Callable[[WriteBatch], Awaitable[T]]
+    ) -> Awaitable[T]:
+        """Команда над одним тикером — в его очередь, над несколькими — с барьером."""
+        if len(tickers) == 1:
+            return self.sequencer.run(tickers[0], command)
+        return self.sequencer.run_exclusive(tickers, command)
+
+    # ---------- жизненный цикл ----------
+    async def start(self) -> None:
+        """Захватывает тикеры своей доли и восстанавливает их стаканы."""
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(
+                select(Instrument.ticker, Instrument.deleted_at)
+                .where(Instrument.ticker != QUOTE_TICKER)
+            )).all()
+            owned = await self.sequencer.claim(
+                db_engine, [t for t, _ in rows if self.sequencer.in_shard(t)]
+            )
+            deleted = {t for t, deleted_at in rows if deleted_at is not None}
+            self._books.clear()
+            await self.recover(db, sorted(owned - deleted))
+            # Удалённые, но ещё не дочищенные: стакан из живых заявок,
+            # чтобы reaper снял их через delist() и вернул резервы
+            for ticker in sorted(owned & deleted):
+                await self.load(db, ticker)
+
+    async def stop(self) -> None:
+        await self.sequencer.stop()
+
+    # ---------- восстановление из БД ----------
+    async def load(self, db: AsyncSession, ticker: Optional[str] = None) -> None:
+        """Строит стаканы из живых лимитных заявок (все тикеры или один)."""
+        stmt = (
+            select(Order)
+            .where(Order.status.in_(LIVE_STATUSES), Order.price.is_not(None))
+            .order_by(Order.created_at, Order.id)
+        )
+        if ticker is not None:
+            stmt = stmt.where(Order.ticker == ticker)
+            self._books[ticker] = OrderBook(ticker)
+        else:
+            self._books.clear()
+
+        rows = (await db.execute(stmt)).scalars().all()
+        for o in rows:
+            self.book(o.ticker).add(RestingOrder(
+                id=o.id,
+                user_id=o.user_id,
+                side=o.side,
+                price=int(o.price),
+                quantity=int(o.quantity),
+                filled=int(o.filled_qty),
+            ))
+        for book in self._books.values():
+            book.pop_changes()
+        logger.info("Стаканы загружены: %d заявок", len(rows))
+
+    async def recover(self, db: AsyncSession, tickers: Iterable[str]) -> None:
+        """
+        Быстрый старт: снимок стакана + события журнала после него.
+        Для тикеров без снимка (или с повреждённым) — полная загрузка из orders.
+        """
+        for ticker in tickers:
+            data = await asyncio.to_thread(snapshot.read_file, snapshot.snapshot_path(ticker))
+            book = None
+            if data is not None:
+                try:
+                    book, position = snapshot.decode(ticker, data)
+                except snapshot.SnapshotError as e:
+                    logger.warning("Снимок %s не читается (%s), загрузка из БД", ticker, e)
+            if book is None:
+                await self.load(db, ticker)
+                continue
+
+            events = await snapshot.journal_tail(db, ticker, position)
+            snapshot.replay(book, events)
+            self._books[ticker] = book
+            logger.info(
+                "Стакан %s из снимка: %d заявок, %d событий журнала",
+                ticker, len(book), len(events),
+            )
+
+    async def take_snapshot(self, ticker: str) -> None:
+        """
+        Пишет снимок стакана и чистит вошедшую в него часть журнала.
+        В очереди тикера только сериализация и позиция журнала; файл и DELETE — после.
+        """
+        async with AsyncSessionLocal() as db:
+            async def capture(batch: WriteBatch) -> Tuple[int, bytes]:
+                position = await snapshot.journal_position(db, ticker)
+                return position, snapshot.encode(self.book(ticker), position)
+
+            # Барьер, а не обычная команда: снимок берётся между группами,
+            # когда в стакане нет незакоммиченных изменений
+            position, data = await self.sequencer.run_exclusive([ticker], capture)
+            if self.find(ticker) is None:
+                # Инструмент сняли с торгов, пока снимок ждал очереди
+                return
+            await asyncio.to_thread(snapshot.write_file, snapshot.snapshot_path(ticker), data)
+            await snapshot.prune(db, ticker, position)
+            await db.commit()
+
+    async def run_snapshots(self, interval: float = snapshot.SNAPSHOT_INTERVAL) -> None:
+        """Фоновая задача: периодические снимки всех стаканов."""
+        while True:
+            await asyncio.sleep(interval)
+            for ticker in list(self._books):
+                try:
+                    await self.take_snapshot(ticker)
+                except Exception:
+                    logger.exception("Не удалось снять снимок стакана %s", ticker)
+
+    async def check_ownership(self) -> None:
+        """
+        Сверяет владение тикерами с advisory lock'ами. Стаканы потерянных
+        тикеров сбрасываются (их мог подхватить и изменить другой процесс),
+        потоки их подписчиков закрываются.
+        Если тикер удаётся захватить снова, стакан поднимается из снимка
+        и журнала, куда писал и тот процесс.
+        """
+        for ticker in await self.sequencer.verify():
+            self._books.pop(ticker, None)
+            # Подписчики переподключатся к новому владельцу
+            market_feed.close(ticker)
+        # И только что потерянные, и не захваченные в прошлые проверки
+        lost = self.sequencer.lost()
+        if not lost:
+            return
+        regained = await self.sequencer.claim(db_engine, sorted(lost)) & lost
+        if regained:
+            async with AsyncSessionLocal() as db:
+                await self.recover(db, sorted(regained))
+            for ticker in regained:
+                market_feed.reset(self.book(ticker))
+            self.sequencer.restored(regained)
+
+    async def run_ownership_checks(self, interval: float = OWNERSHIP_CHECK_INTERVAL) -> None:
+        """Фоновая задача: периодическая проверка владения тикерами."""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.check_ownership()
+            except Exception:
+                logger.exception("Проверка владения тикерами не удалась")
+
+    # ---------- команды ----------
+    def _hold_for(self, book: OrderBook, order: Order) -> Tuple[str, int]:
+        """Какой баланс и сколько блокирует заявка при текущем стакане."""
+        if order.price is None and order.side == OrderSideEnum.BUY:
+            # Рыночная покупка блокирует ровно стоимость исполнения по стакану
+            return QUOTE_TICKER, book.market_cost(order.side, order.quantity)
+        return order_hold(order.ticker, order.side, order.quantity, order.price or 0)
+
+    def _execute(self, book: OrderBook, order: Order, deltas: BalanceDeltas) -> List[Fill]:
+        """Матчит заявку в памяти и добавляет расчёты по сделкам в deltas."""
+        fills = book.match(
+            order.id, order.user_id, order.side, order.quantity, order.price
+        )
+        filled = sum(f.qty for f in fills)
+        order.filled_qty = filled
+        order.status = order_status(order.quantity, filled, resting=order.price is not None)
+
+        deltas.settle(order.ticker, fills, order.price)
+        if order.price is None and order.side == OrderSideEnum.SELL:
+            # Неисполненный остаток рыночной продажи снимается
+            deltas.release(order.user_id, order.ticker, order.quantity - filled)
+        return fills
+
+    async def submit(self, order: Order) -> List[Fill]:
+        """
+        Резервирует средства и исполняет новую заявку; заявка, сделки и
+        расчёты по балансам записываются вместе с группой команд тикера.
+        При нехватке средств — InsufficientFunds, стакан не меняется.
+        Возвращается только после коммита группы.
+        """
+        return await self.sequencer.run(order.ticker, lambda batch: self._submit(batch, order))
+
+    async def _submit(self, batch: WriteBatch, order: Order) -> List[Fill]:
+        book = self.book(order.ticker)
+        now = datetime.now(timezone.utc)
+
+        # Резерв — сразу и до матчинга: при отказе ни стакан, ни пакет записи не меняются
+        await ledger.hold(batch.db, order.user_id, *self._hold_for(book, order))
+
+        fills = self._execute(book, order, batch.deltas)
+        batch.add_order(order)
+        batch.add_fills(order.ticker, fills, now)
+        batch.journal(book, [f.maker for f in fills], [order.id])
+        batch.publish(book, fills, now)
+        return fills
+
+    async def submit_batch(self, user_id: UUID, orders: List[Order]) -> List[Optional[str]]:
+        """
+        Пакетная постановка заявок одного пользователя в одной транзакции.
+
+        Свободные остатки читаются один раз (SELECT ... FOR UPDATE) и
+        расходуются по порядку заявок; не прошедшие проверку заявки
+        пропускаются. Резервы пишутся в БД сразу, одним UPDATE на тикер
+        баланса: группа общая с другими командами, и они должны видеть
+        уже уменьшенный остаток. Принятые вставляются одним многострочным
+        INSERT. Возвращает по каждой заявке None (принята) или текст ошибки.
+        """
+        tickers = sorted({o.ticker for o in orders})
+        return await self._sequenced(
+            tickers, lambda batch: self._submit_batch(batch, user_id, orders, tickers)
+        )
+
+    async def _submit_batch(
+        self, batch: WriteBatch, user_id: UUID, orders: List[Order], tickers: List[str]
+    ) -> List[Optional[str]]:
+        now = datetime.now(timezone.utc)
+        available = await ledger.available_for_update(batch.db, user_id)
+        errors: List[Optional[str]] = []
+        accepted: List[Order] = []
+        holds: Dict[str, int] = {}
+        fills_by_ticker: Dict[str, List[Fill]] = {t: [] for t in tickers}
+
+        for order in orders:
+            book = self.book(order.ticker)
+            hold_ticker, hold_amount = self._hold_for(book, order)
+            if hold_amount > available.get(hold_ticker, 0):
+                errors.append(f"Insufficient {hold_ticker} balance")
+                continue
+            available[hold_ticker] -= hold_amount
+            holds[hold_ticker] = holds.get(hold_ticker, 0) + hold_amount
+            fills_by_ticker[order.ticker].extend(self._execute(book, order, batch.deltas))
+            batch.add_order(order)
+            accepted.append(order)
+            errors.append(None)
+
+        # Строки балансов заблокированы FOR UPDATE, а отложенные изменения
+        # группы остаток только увеличивают — UPDATE обязан пройти. Если нет,
+        # это ошибка всей группы (стаканы уже изменены, их перечитают), а не отказ
+        for hold_ticker, amount in sorted(holds.items()):
+            try:
+                await ledger.hold(batch.db, user_id, hold_ticker, amount)
+            except InsufficientFunds as e:
+                raise RuntimeError(f"Batch hold on {hold_ticker} failed after FOR UPDATE") from e
+
+        # Заявки пакета могли исполниться друг о друга уже после постановки:
+        # их итоговое состояние допишет обновление встречных заявок
+        makers = {
+            f.maker.id: f.maker
+            for fills in fills_by_ticker.values() for f in fills
+        }
+        for ticker in tickers:
+            book = self.book(ticker)
+            fills = fills_by_ticker[ticker]
+            batch.add_fills(ticker, fills, now)
+            batch.journal(
+                book,
+                [f.maker for f in fills],
+                [o.id for o in accepted if o.ticker == ticker],
+                makers,
+            )
+            batch.publish(book, fills, now)
+        return errors
+
+    def locate(self, order_id: UUID) -> Optional[str]:
+        """Тикер стакана, в котором стоит заявка, или None."""
+        for ticker, book in self._books.items():
+            if order_id in book:
+                return ticker
+        return None
+
+    async def _resolve(self, user_id: UUID, order_id: UUID) -> Optional[str]:
+        """
+        Тикер стоящей заявки пользователя. Мимо своих стаканов — по orders:
+        в пути ручки тикера нет, и прокси мог прислать запрос не владельцу,
+        тогда TickerNotOwned (клиент повторит через владельца).
+        """
+        ticker = self.locate(order_id)
+        if ticker is not None:
+            return ticker
+        async with AsyncSessionLocal() as db:
+            ticker = await db.scalar(
+                select(Order.ticker).where(
+                    Order.id == order_id,
+                    Order.user_id == user_id,
+                    Order.status.in_(LIVE_STATUSES),
+                )
+            )
+        if ticker is not None and not self.sequencer.owns(ticker):
+            raise TickerNotOwned(ticker)
+        return None
+
+    async def cancel(self, user_id: UUID, order_id: UUID) -> bool:
+        """Отменяет стоящую заявку пользователя. False — такой заявки в стакане нет."""
+        ticker = await self._resolve(user_id, order_id)
+        if ticker is None:
+            return False
+
+        def select_order(book: OrderBook) -> List[RestingOrder]:
+            resting = book.get(order_id)
+            return [resting] if resting is not None and resting.user_id == user_id else []
+
+        return bool(await self._cancel([ticker], select_order))
+
+    async def cancel_all(
+        self,
+        user_id: UUID,
+        ticker: Optional[str] = None,
+        side: Optional[OrderSideEnum] = None,
+    ) -> List[UUID]:
+        """Массовая отмена стоящих заявок пользователя (по тикеру и/или стороне)."""
+        if ticker is not None:
+            # Чужой тикер — TickerNotOwned, а не пустой ответ
+            await self.sequencer.ensure_owned(ticker)
+            tickers = [ticker] if ticker in self._books else []
+        else:
+            tickers = [t for t, book in self._books.items() if book.user_orders(user_id)]
+        return await self._cancel(tickers, lambda book: book.user_orders(user_id, side))
+
+    async def delist(self, ticker: str) -> List[UUID]:
+        """
+        Снимает удалённый инструмент с торгов в этом процессе: отменяет все
+        стоящие заявки (с возвратом резервов), убирает стакан и его снимок.
+        """
+        if self.find(ticker) is None or not self.sequencer.owns(ticker):
+            return []
+
+        async def close(batch: WriteBatch) -> List[UUID]:
+            cancelled = await self._cancel_in(batch, [ticker], lambda book: list(book))
+            self._books.pop(ticker, None)
+            return cancelled
+
+        cancelled = await self.sequencer.run_exclusive([ticker], close)
+        ticker_cache.discard(ticker)
+        with suppress(FileNotFoundError):
+            await asyncio.to_thread(os.remove, snapshot.snapshot_path(ticker))
+        logger.info("Инструмент %s снят с торгов: отменено %d заявок", ticker, len(cancelled))
+        return cancelled
+
+    async def _cancel(
+        self,
+        tickers: List[str],
+        select_orders: Callable[[OrderBook], List[RestingOrder]],
+    ) -> List[UUID]:
+        """
+        Снимает выбранные заявки из стаканов, помечает их CANCELLED одним
+        UPDATE и возвращает заблокированные остатки одним upsert'ом балансов.
+        """
+        if not tickers:
+            return []
+        tickers = sorted(tickers)
+        return await self._sequenced(
+            tickers, lambda batch: self._cancel_in(batch, tickers, select_orders)
+        )
+
+    async def _cancel_in(
+        self,
+        batch: WriteBatch,
+        tickers: List[str],
+        select_orders: Callable[[OrderBook], List[RestingOrder]],
+    ) -> List[UUID]:
+        cancelled: List[UUID] = []
+        for ticker in tickers:
+            book = self.book(ticker)
+            for resting in select_orders(book):
+                book.remove(resting.id)
+                batch.deltas.release(resting.user_id, *order_hold(
+                    ticker, resting.side, resting.remaining, resting.price
+                ))
+                batch.cancel(ticker, resting)
+                cancelled.append(resting.id)
+            batch.publish(book, [], None)
+        return cancelled
+
+    async def replace(
+        self,
+        user_id: UUID,
+        order_id: UUID,
+        price: Optional[int] = None,
+        qty: Optional[int] = None,
+    ) -> Optional[Order]:
+        """
+        Cancel-replace: атомарно отменяет стоящую заявку и ставит новую с той же
+        стороной и тикером, но новой ценой/количеством (по умолчанию — остаток).
+        Резерв пересчитывается на разницу. None — заявки в стакане нет.
+        """
+        ticker = await self._resolve(user_id, order_id)
+        if ticker is None:
+            return None
+        return await self.sequencer.run(
+            ticker, lambda batch: self._replace(batch, ticker, user_id, order_id, price, qty)
+        )
+
+    async def _replace(
+        self,
+        batch: WriteBatch,
+        ticker: str,
+        user_id: UUID,
+        order_id: UUID,
+        price: Optional[int],
+        qty: Optional[int],
+    ) -> Optional[Order]:
+        book = self.book(ticker)
+        old = book.get(order_id)
+        if old is None or old.user_id != user_id:
+            return None
+
+        now = datetime.now(timezone.utc)
+        new = Order(
+            id=uuid4(),
+            user_id=user_id,
+            ticker=ticker,
+            side=old.side,
+            quantity=qty or old.remaining,
+            price=price or old.price,
+            filled_qty=0,
+            status=OrderStatusEnum.NEW,
+            created_at=now,
+        )
+        hold_ticker, old_hold = order_hold(ticker, old.side, old.remaining, old.price)
+        _, new_hold = order_hold(ticker, new.side, new.quantity, new.price)
+
+        # Доблокировка — до изменения стакана: при отказе старая заявка остаётся как была
+        if new_hold > old_hold:
+            await ledger.hold(batch.db, user_id, hold_ticker, new_hold - old_hold)
+        else:
+            batch.deltas.release(user_id, hold_ticker, old_hold - new_hold)
+
+        book.remove(order_id)
+        batch.cancel(ticker, old)
+        fills = self._execute(book, new, batch.deltas)
+        batch.add_order(new)
+        batch.add_fills(ticker, fills, now)
+        batch.journal(book, [f.maker for f in fills], [new.id])
+        batch.publish(book, fills, now)
+        return new
+
+    async def subscribe(self, ticker: str) -> Subscription:
+        """Подписка на поток тикера: снимок стакана, затем дельты и сделки."""
+        async def subscribe(batch: WriteBatch) -> Subscription:
+            return market_feed.subscribe(self.book(ticker))
+
+        return await self.sequencer.run(ticker, subscribe)
+
+    @asynccontextmanager
+    async def _write_batch(self, tickers: List[str]) -> AsyncIterator[WriteBatch]:
+        """
+        Группа команд: общая сессия и одна транзакция. При ошибке записи
+        откатывается вся группа, а стаканы её тикеров перечитываются из БД
+        (после deadlock Sequencer повторяет команды на перечитанных стаканах).
+        """
+        async with AsyncSessionLocal() as db:
+            batch = WriteBatch(db)
+            try:
+                yield batch
+                await batch.flush()
+            except Exception:
+                await db.rollback()
+                for ticker in tickers:
+                    await self._reload(db, ticker)
+                raise
+        batch.published()
+
+    async def _reload(self, db: AsyncSession, ticker: str) -> None:
+        try:
+            await self.load(db, ticker)
+            market_feed.reset(self.book(ticker))
+        except Exception:
+            logger.exception("Не удалось перечитать стакан %s", ticker)
+
+
+matching_engine = MatchingEngine()
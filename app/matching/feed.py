@@ -0,0 +1,129 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Set
+
+from pydantic import BaseModel
+
+from app.matching.book import Fill, OrderBook
+from app.models import OrderSideEnum
+from app.schemas import Level, OrderBookSnapshot, OrderBookUpdate, Transaction
+
+logger = logging.getLogger(__name__)
+
+# Сколько неотправленных событий держим на подписчика; дальше — отключаем
+SUBSCRIBER_QUEUE_SIZE = 1000
+
+
+class Subscription:
+    """Очередь событий одного клиента, подписанного на тикер."""
+
+    def __init__(self, ticker: str):
+        self.ticker = ticker
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        # Клиент не успевал читать и пропустил события: нужна переподписка
+        self.overflowed = False
+        # Тикер больше не обслуживается этим процессом: поток завершён
+        self.closed = False
+
+    async def get(self, timeout: Optional[float] = None) -> Optional[BaseModel]:
+        """Следующее событие или None по таймауту."""
+        try:
+            return await asyncio.wait_for(self.queue.get(), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    @property
+    def active(self) -> bool:
+        return not (self.overflowed or self.closed)
+
+    def close(self) -> None:
+        self.closed = True
+        # Будим читателя: неотправленные события ему уже не нужны
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.queue.put_nowait(None)
+
+
+class MarketFeed:
+    """
+    Рассылка изменений стакана и сделок подписчикам по тикерам.
+
+    Каждое событие тикера получает следующий seq. Новый подписчик сначала
+    получает снимок стакана с текущим seq, затем дельты с seq + 1, seq + 2, ...
+    Публикация и подписка выполняются под lock'ом тикера в MatchingEngine,
+    поэтому снимок и поток дельт согласованы.
+    """
+
+    def __init__(self):
+        self._seq: Dict[str, int] = {}
+        self._subscribers: Dict[str, Set[Subscription]] = {}
+
+    def subscribe(self, book: OrderBook) -> Subscription:
+        sub = Subscription(book.ticker)
+        sub.queue.put_nowait(self.snapshot(book))
+        self._subscribers.setdefault(book.ticker, set()).add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        subs = self._subscribers.get(sub.ticker)
+        if subs is not None:
+            subs.discard(sub)
+            if not subs:
+                del self._subscribers[sub.ticker]
+
+    def close(self, ticker: str) -> None:
+        """Завершает потоки всех подписчиков тикера (владение тикером потеряно)."""
+        for sub in self._subscribers.pop(ticker, ()):
+            sub.close()
+
+    def snapshot(self, book: OrderBook) -> OrderBookSnapshot:
+        return OrderBookSnapshot(
+            ticker=book.ticker,
+            seq=self._seq.get(book.ticker, 0),
+            bid_levels=[Level(price=p, qty=q) for p, q in book.depth(OrderSideEnum.BUY, len(book))],
+            ask_levels=[Level(price=p, qty=q) for p, q in book.depth(OrderSideEnum.SELL, len(book))],
+        )
+
+    def publish(self, book: OrderBook, fills: List[Fill], timestamp) -> None:
+        """Рассылает изменившиеся уровни стакана и новые сделки одним событием."""
+        changes = book.pop_changes()
+        if not fills and not any(changes.values()):
+            return
+        seq = self._seq[book.ticker] = self._seq.get(book.ticker, 0) + 1
+        subs = self._subscribers.get(book.ticker)
+        if not subs:
+            return
+
+        event = OrderBookUpdate(
+            ticker=book.ticker,
+            seq=seq,
+            bid_levels=[Level(price=p, qty=q) for p, q in changes[OrderSideEnum.BUY]],
+            ask_levels=[Level(price=p, qty=q) for p, q in changes[OrderSideEnum.SELL]],
+            trades=[
+                Transaction(ticker=book.ticker, amount=f.qty, price=f.price, timestamp=timestamp)
+                for f in fills
+            ],
+        )
+        self._broadcast(subs, event)
+
+    def reset(self, book: OrderBook) -> None:
+        """После перечитывания стакана из БД отправляет всем новый снимок."""
+        book.pop_changes()
+        seq = self._seq[book.ticker] = self._seq.get(book.ticker, 0) + 1
+        subs = self._subscribers.get(book.ticker)
+        if subs:
+            snapshot = self.snapshot(book)
+            snapshot.seq = seq
+            self._broadcast(subs, snapshot)
+
+    def _broadcast(self, subs: Set[Subscription], event: BaseModel) -> None:
+        for sub in list(subs):
+            try:
+                sub.queue.put_nowait(event)
+            except asyncio.QueueFull:
+                logger.warning("Подписчик %s не успевает читать поток, отключаем", sub.ticker)
+                sub.overflowed = True
+                subs.discard(sub)
+
+
+market_feed = MarketFeed()
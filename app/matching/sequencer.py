@@ -0,0 +1,481 @@
+import asyncio
+import contextvars
+import logging
+import os
+import zlib
+from contextlib import asynccontextmanager, suppress
+from dataclasses import dataclass, field
+from typing import (
+    Any, AsyncContextManager, AsyncIterator, Awaitable, Callable, Dict, Iterable, List,
+    Optional, Set, Tuple, Type, TypeVar, Union,
+)
+
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from app.metrics import Counter, Histogram
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+# Команда получает объект группы (см. group в Sequencer), общий для группы команд
+Command = Callable[[Any], Awaitable[T]]
+GroupFactory = Callable[[List[str]], AsyncContextManager[Any]]
+
+# Какая доля тикеров принадлежит этому экземпляру: "i/N" — тикеры с crc32 % N == i.
+# Прокси перед репликами должен маршрутизировать ручки тикера по тому же хешу.
+# Одна доля — один процесс: при uvicorn --workers N у каждого воркера была бы
+# доля по умолчанию, поэтому второй процесс с той же долей не стартует.
+# Несколько процессов — это несколько uvicorn с разными SEQUENCER_SHARD.
+SEQUENCER_SHARD = os.getenv("SEQUENCER_SHARD", "0/1")
+
+# Group commit: сколько команд владелец тикера объединяет в одну транзакцию
+# и сколько ждёт следующих. 0 мс — без ожидания: под нагрузкой группа и так
+# набирается из очереди, пока коммитится предыдущая.
+GROUP_COMMIT_MAX = int(os.getenv("GROUP_COMMIT_MAX", "100"))
+GROUP_COMMIT_WINDOW_MS = float(os.getenv("GROUP_COMMIT_WINDOW_MS", "0"))
+# Сколько раз повторять группу, откаченную из-за конфликта блокировок
+GROUP_COMMIT_RETRIES = int(os.getenv("GROUP_COMMIT_RETRIES", "3"))
+
+# Группы разных тикеров блокируют строки балансов общих пользователей в порядке
+# поступления команд, и Postgres может откатить одну из транзакций
+# (deadlock_detected, serialization_failure). Такую группу можно повторить.
+RETRYABLE_SQLSTATES = frozenset({"40P01", "40001"})
+
+# Как часто сверять владение тикерами с advisory lock'ами, секунды: при обрыве
+# соединения Postgres отпускает все его lock'и, и тикеры может забрать другой
+OWNERSHIP_CHECK_INTERVAL = float(os.getenv("OWNERSHIP_CHECK_INTERVAL", "5"))
+
+# Advisory lock'и своей сессии (ключ bigint < 2^32 лежит целиком в objid)
+_HELD_LOCKS = text(
+    "SELECT objid FROM pg_locks"
+    " WHERE locktype = 'advisory' AND granted AND pid = pg_backend_pid()"
+)
+
+
+group_size = Histogram(
+    "sequencer_group_size", "Команд в одной группе (транзакции)",
+    buckets=(1, 2, 5, 10, 20, 50, 100, 200, 500),
+)
+rejected_commands = Counter("sequencer_rejected_commands_total", "Команды, отклонённые внутри группы")
+failed_groups = Counter("sequencer_failed_groups_total", "Группы, откаченные целиком")
+retried_groups = Counter("sequencer_retried_groups_total", "Группы, повторённые после конфликта блокировок")
+lost_tickers = Counter("sequencer_lost_tickers_total", "Тикеры, владение которыми потеряно")
+
+
+def _parse_shard(value: str) -> Tuple[int, int]:
+    index, _, total = value.partition("/")
+    index, total = int(index), int(total or 1)
+    if not 0 <= index < total:
+        raise ValueError(f"SEQUENCER_SHARD={value!r}: ожидается i/N, 0 <= i < N")
+    return index, total
+
+
+def ticker_shard(ticker: str, total: int) -> int:
+    return zlib.crc32(ticker.encode()) % total
+
+
+def lock_conflict(e: BaseException) -> bool:
+    """Ошибка БД, после которой группу можно повторить (см. RETRYABLE_SQLSTATES)."""
+    return getattr(getattr(e, "orig", None), "sqlstate", None) in RETRYABLE_SQLSTATES
+
+
+def advisory_key(ticker: str) -> int:
+    """Ключ pg_advisory_lock для владения тикером."""
+    return zlib.crc32(f"orderbook:{ticker}".encode())
+
+
+def shard_key(index: int, total: int) -> int:
+    """Ключ pg_advisory_lock для доли тикеров i/N."""
+    return zlib.crc32(f"shard:{index}/{total}".encode())
+
+
+class ShardTaken(RuntimeError):
+    """Эту долю тикеров уже обслуживает другой процесс."""
+
+    def __init__(self, index: int, total: int):
+        super().__init__(
+            f"SEQUENCER_SHARD={index}/{total} is served by another process;"
+            " run one process per shard (no uvicorn --workers)"
+        )
+
+
+class TickerNotOwned(Exception):
+    """Тикер обслуживается другим процессом/репликой."""
+
+    def __init__(self, ticker: str):
+        super().__init__(f"Ticker {ticker} is served by another instance")
+        self.ticker = ticker
+
+
+@dataclass
+class _Barrier:
+    """Останавливает владельца тикера на время команды над несколькими тикерами."""
+    arrived: asyncio.Event = field(default_factory=asyncio.Event)
+    released: asyncio.Event = field(default_factory=asyncio.Event)
+    # Владелец остановлен, не дойдя до барьера (тикер больше не наш)
+    lost: bool = False
+
+
+# Команда в очереди: что выполнить, кому ответить и контекст вызывающего
+_Queued = Tuple[Command, asyncio.Future, contextvars.Context]
+_Item = Union[_Barrier, _Queued]
+
+# Контексты вызывающих для выражений, которые выполняет владелец тикера: во время
+# команды — её вызывающий, при записи группы — все вызывающие группы (учёт
+# запросов к БД по HTTP-запросам, см. querybudget)
+group_callers: contextvars.ContextVar[Tuple[contextvars.Context, ...]] = contextvars.ContextVar(
+    "sequencer_group_callers", default=()
+)
+
+
+def _abandon(item: _Item, ticker: str) -> None:
+    """Отвечает ждущему команды, которую остановленный владелец уже не выполнит."""
+    if isinstance(item, _Barrier):
+        item.lost = True
+        item.arrived.set()
+    elif not item[1].done():
+        item[1].set_exception(TickerNotOwned(ticker))
+
+
+@asynccontextmanager
+async def _no_group(tickers: List[str]) -> AsyncIterator[None]:
+    yield None
+
+
+class Sequencer:
+    """
+    Единственный писатель на тикер: у каждого тикера своя очередь команд
+    и своя задача-владелец, которая выполняет их строго по одной.
+
+    Команда выполняется в задаче владельца, поэтому отмена HTTP-запроса
+    не обрывает её на середине. Команды над несколькими тикерами ставят
+    барьер в очередь каждого из них (атомарно, без await между put) —
+    порядок барьеров во всех очередях одинаков, взаимных блокировок нет.
+
+    Group commit: владелец забирает из очереди до max_group команд подряд
+    (и ждёт ещё window_ms), выполняет их внутри одного group(tickers) и
+    отвечает вызывающим только после успешного выхода из него (коммита).
+    Исключения из rejections — отказ одной команды; любое другое проваливает
+    всю группу, и его получают все её команды. Группа, откаченная из-за
+    конфликта блокировок (retryable), повторяется по одной команде.
+
+    Между процессами владение закрепляется сессионным pg_advisory_lock
+    на выделенном соединении: тикер принадлежит тому, кто держит lock.
+    Там же держится lock доли, чтобы два процесса не делили одну долю.
+    Пока claim() не вызван, проверки владения выключены.
+    """
+
+    def __init__(
+        self,
+        group: GroupFactory = _no_group,
+        rejections: Tuple[Type[Exception], ...] = (),
+        shard: str = SEQUENCER_SHARD,
+        max_group: int = GROUP_COMMIT_MAX,
+        window_ms: float = GROUP_COMMIT_WINDOW_MS,
+        retryable: Callable[[BaseException], bool] = lock_conflict,
+        retries: int = GROUP_COMMIT_RETRIES,
+    ):
+        self.shard_index, self.shard_total = _parse_shard(shard)
+        self._group = group
+        self._rejections = rejections
+        self._max_group = max(1, max_group)
+        self._window = window_ms / 1000
+        self._retryable = retryable
+        self._retries = max(0, retries)
+        self._queues: Dict[str, asyncio.Queue] = {}
+        self._workers: Dict[str, asyncio.Task] = {}
+        self._pending: Set[asyncio.Task] = set()
+        self._owned: Set[str] = set()
+        self._conn: Optional[AsyncConnection] = None
+        self._bind: Optional[AsyncEngine] = None
+        self._claimed = False
+        self._shard_held = False
+        # Потерянные тикеры: команды по ним отклоняются, пока владелец заново
+        # не захватит тикер через claim() и не поднимет стакан (restored())
+        self._lost: Set[str] = set()
+        self._claim_lock = asyncio.Lock()
+
+    # ---------- владение ----------
+    def in_shard(self, ticker: str) -> bool:
+        return ticker_shard(ticker, self.shard_total) == self.shard_index
+
+    async def claim(self, bind: AsyncEngine, tickers: Iterable[str]) -> Set[str]:
+        """
+        Захватывает долю и тикеры из неё; возвращает те, что удалось захватить.
+        Недоступная БД или чужая доля (ShardTaken) — ошибка вызывающего.
+        """
+        self._bind = bind
+        self._claimed = True
+        await self._claim_shard()
+        for ticker in tickers:
+            await self._try_claim(ticker)
+        return set(self._owned)
+
+    async def _claim_shard(self) -> None:
+        async with self._claim_lock:
+            if self._shard_held:
+                return
+            conn = await self._connection()
+            try:
+                got = await conn.scalar(
+                    text("SELECT pg_try_advisory_lock(:key)"),
+                    {"key": shard_key(self.shard_index, self.shard_total)},
+                )
+                await conn.commit()
+            except Exception:
+                await self._drop_connection()
+                raise
+            if not got:
+                raise ShardTaken(self.shard_index, self.shard_total)
+            self._shard_held = True
+
+    async def _try_claim(self, ticker: str) -> bool:
+        async with self._claim_lock:
+            if ticker in self._owned:
+                return True
+            if not self.in_shard(ticker):
+                return False
+            try:
+                conn = await self._connection()
+                got = await conn.scalar(
+                    text("SELECT pg_try_advisory_lock(:key)"), {"key": advisory_key(ticker)}
+                )
+                await conn.commit()
+            except Exception:
+                # БД недоступна: тикер не наш, следующая попытка — на новом соединении
+                logger.exception("Не удалось захватить тикер %s", ticker)
+                await self._drop_connection()
+                self._lost.add(ticker)
+                return False
+            if got:
+                self._owned.add(ticker)
+            else:
+                logger.warning("Тикер %s уже обслуживается другим процессом", ticker)
+            return bool(got)
+
+    async def ensure_owned(self, ticker: str) -> None:
+        if ticker in self._lost:
+            raise TickerNotOwned(ticker)
+        if not self._claimed or ticker in self._owned:
+            return
+        # Новый инструмент своей доли захватываем при первой команде
+        if not await self._try_claim(ticker):
+            raise TickerNotOwned(ticker)
+
+    def owns(self, ticker: str) -> bool:
+        return ticker not in self._lost and (not self._claimed or ticker in self._owned)
+
+    def lost(self) -> Set[str]:
+        """Тикеры, владение которыми потеряно и ещё не восстановлено."""
+        return set(self._lost)
+
+    def restored(self, tickers: Iterable[str]) -> None:
+        """Стаканы заново захваченных тикеров подняты — команды снова принимаются."""
+        self._lost.difference_update(t for t in tickers if t in self._owned)
+
+    async def _connection(self) -> AsyncConnection:
+        """Выделенное соединение для advisory lock'ов (после сбоя — новое)."""
+        if self._conn is None:
+            self._conn = await self._bind.connect()
+        return self._conn
+
+    async def _drop_connection(self) -> None:
+        """
+        Выбрасывает соединение после сбоя. Только invalidate() мало: оно
+        оставляет начатую транзакцию, и любой следующий запрос на этом
+        соединении падает с PendingRollbackError.
+        """
+        conn, self._conn = self._conn, None
+        self._shard_held = False
+        if conn is not None:
+            with suppress(Exception):
+                await conn.invalidate()
+            with suppress(Exception):
+                await conn.close()
+
+    async def verify(self, timeout: float = OWNERSHIP_CHECK_INTERVAL) -> Set[str]:
+        """
+        Сверяет захваченные тикеры с advisory lock'ами сессии. Потерянные
+        (оборвалось соединение, lock'и отпущены) убирает из владения
+        и останавливает их владельцев; возвращает эти тикеры.
+        """
+        if not self._claimed:
+            return set()
+        async with self._claim_lock:
+            try:
+                conn = await self._connection()
+                rows = await asyncio.wait_for(conn.execute(_HELD_LOCKS), timeout)
+                held = {int(objid) for objid, in rows}
+                await conn.commit()
+            except Exception:
+                logger.exception("Соединение с advisory lock'ами недоступно")
+                held = set()
+                # Lock'и ушли вместе с соединением; новое откроет следующий захват
+                await self._drop_connection()
+            self._shard_held = shard_key(self.shard_index, self.shard_total) in held
+            lost = {t for t in self._owned if advisory_key(t) not in held}
+            self._owned -= lost
+            self._lost |= lost
+
+        for ticker in sorted(lost):
+            logger.error("Владение тикером %s потеряно", ticker)
+            lost_tickers.inc()
+            await self._stop_owner(ticker)
+        return lost
+
+    async def _stop_owner(self, ticker: str) -> None:
+        task = self._workers.pop(ticker, None)
+        queue = self._queues.pop(ticker, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        while queue is not None and not queue.empty():
+            _abandon(queue.get_nowait(), ticker)
+
+    # ---------- команды ----------
+    async def run(self, ticker: str, command: Command) -> T:
+        """Выполняет команду в задаче-владельце тикера и ждёт результат."""
+        await self.ensure_owned(ticker)
+        future = asyncio.get_running_loop().create_future()
+        self._queue(ticker).put_nowait((command, future, contextvars.copy_context()))
+        return await asyncio.shield(future)
+
+    async def run_exclusive(self, tickers: Iterable[str], command: Command) -> T:
+        """Команда над несколькими тикерами: их владельцы ждут, пока она выполняется."""
+        tickers = sorted(set(tickers))
+        for ticker in tickers:
+            await self.ensure_owned(ticker)
+        task = asyncio.create_task(self._exclusive(tickers, command))
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+        return await asyncio.shield(task)
+
+    async def _exclusive(self, tickers: Iterable[str], command: Command) -> T:
+        barriers = []
+        for ticker in tickers:
+            barrier = _Barrier()
+            self._queue(ticker).put_nowait(barrier)
+            barriers.append(barrier)
+        try:
+            for ticker, barrier in zip(tickers, barriers):
+                await barrier.arrived.wait()
+                if barrier.lost:
+                    raise TickerNotOwned(ticker)
+            attempt = 0
+            while True:
+                try:
+                    async with self._group(list(tickers)) as group:
+                        return await command(group)
+                except Exception as e:
+                    if attempt >= self._retries or not self._retryable(e):
+                        raise
+                    attempt += 1
+                    retried_groups.inc()
+        finally:
+            for barrier in barriers:
+                barrier.released.set()
+
+    def _queue(self, ticker: str) -> asyncio.Queue:
+        queue = self._queues.get(ticker)
+        if queue is None:
+            queue = self._queues[ticker] = asyncio.Queue()
+            # Чистый контекст: иначе владелец унаследует contextvars запроса,
+            # который его создал (учёт запросов к БД по HTTP-запросам)
+            self._workers[ticker] = asyncio.create_task(
+                self._worker(ticker, queue), name=f"sequencer:{ticker}",
+                context=contextvars.Context(),
+            )
+        return queue
+
+    async def _worker(self, ticker: str, queue: asyncio.Queue) -> None:
+        carry: Optional[_Item] = None
+        commands: List[_Item] = []
+        try:
+            while True:
+                item: _Item = carry or await queue.get()
+                carry = None
+                if isinstance(item, _Barrier):
+                    item.arrived.set()
+                    await item.released.wait()
+                    continue
+
+                commands = [item]
+                deadline = asyncio.get_running_loop().time() + self._window
+                while len(commands) < self._max_group:
+                    try:
+                        timeout = deadline - asyncio.get_running_loop().time()
+                        if queue.empty() and timeout > 0:
+                            item = await asyncio.wait_for(queue.get(), timeout)
+                        else:
+                            item = queue.get_nowait()
+                    except (asyncio.QueueEmpty, asyncio.TimeoutError):
+                        break
+                    if isinstance(item, _Barrier):
+                        # Барьер — после коммита текущей группы
+                        carry = item
+                        break
+                    commands.append(item)
+                await self._run_group(ticker, commands)
+        except asyncio.CancelledError:
+            # Владелец остановлен (stop или потеря тикера): уже взятые из очереди
+            # команды и барьер не выполнятся — ждущим отвечаем сразу
+            for item in commands + ([carry] if carry is not None else []):
+                _abandon(item, ticker)
+            raise
+
+    async def _run_group(
+        self, ticker: str, commands: List[_Queued], attempt: int = 0
+    ) -> None:
+        outcomes: List[Tuple[asyncio.Future, Any, Optional[BaseException]]] = []
+        group_size.observe(len(commands))
+        callers = tuple(context for _, _, context in commands)
+        token = group_callers.set(callers)
+        try:
+            async with self._group([ticker]) as group:
+                for command, future, context in commands:
+                    group_callers.set((context,))
+                    try:
+                        outcomes.append((future, await command(group), None))
+                    except self._rejections as e:
+                        rejected_commands.inc()
+                        outcomes.append((future, None, e))
+                group_callers.set(callers)
+        except Exception as e:
+            failed_groups.inc()
+            if attempt < self._retries and self._retryable(e):
+                # Стаканы группы уже перечитаны; по одной команде набор
+                # блокировок короче, и повтор не упрётся в тот же цикл
+                retried_groups.inc()
+                for command in commands:
+                    await self._run_group(ticker, [command], attempt + 1)
+                return
+            for _, future, _ in commands:
+                future.set_exception(e)
+            return
+        finally:
+            group_callers.reset(token)
+
+        for future, result, error in outcomes:
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+
+    async def stop(self) -> None:
+        """Дожидается начатых команд, останавливает владельцев и отпускает advisory lock'и."""
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+        for task in self._workers.values():
+            task.cancel()
+        await asyncio.gather(*self._workers.values(), return_exceptions=True)
+        self._queues.clear()
+        self._workers.clear()
+        if self._conn is not None:
+            # Закрытие сессии освобождает все её advisory lock'и
+            await self._conn.close()
+            self._conn = None
+        self._owned.clear()
+        self._shard_held = False
+        self._lost.clear()
+        self._claimed = False
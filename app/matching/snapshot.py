@@ -0,0 +1,156 @@
+import os
+import struct
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+from uuid import UUID
+
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.matching.book import OrderBook, RestingOrder
+from app.models import OrderBookEvent, OrderSideEnum
+
+# Куда класть снимки стаканов и как часто их снимать
+SNAPSHOT_DIR = os.getenv("SNAPSHOT_DIR", "snapshots")
+SNAPSHOT_INTERVAL = float(os.getenv("SNAPSHOT_INTERVAL", "60"))
+
+# Формат файла: заголовок + записи фиксированной длины (little-endian)
+#   magic, версия, id последнего учтённого события журнала, число записей
+_HEADER = struct.Struct("<4sHqI")
+#   id, user_id, сторона (0 — BUY, 1 — SELL), price, quantity, filled
+_RECORD = struct.Struct("<16s16sBqqq")
+_MAGIC = b"OBSN"
+_VERSION = 1
+_SIDES = (OrderSideEnum.BUY, OrderSideEnum.SELL)
+
+
+class SnapshotError(Exception):
+    """Файл снимка повреждён или в неизвестном формате."""
+
+
+# ---------- снимок ----------
+def encode(book: OrderBook, last_event_id: int) -> bytes:
+    """Упаковывает стакан: заявки в порядке цена-время, чтобы восстановить очереди."""
+    buf = bytearray(_HEADER.size + _RECORD.size * len(book))
+    _HEADER.pack_into(buf, 0, _MAGIC, _VERSION, last_event_id, len(book))
+    offset = _HEADER.size
+    for o in book:
+        _RECORD.pack_into(
+            buf, offset,
+            o.id.bytes, o.user_id.bytes, _SIDES.index(o.side),
+            o.price, o.quantity, o.filled,
+        )
+        offset += _RECORD.size
+    return bytes(buf)
+
+
+def decode(ticker: str, data: bytes) -> Tuple[OrderBook, int]:
+    """Обратное к encode(): (стакан, id последнего учтённого события)."""
+    if len(data) < _HEADER.size:
+        raise SnapshotError("truncated header")
+    magic, version, last_event_id, count = _HEADER.unpack_from(data, 0)
+    if magic != _MAGIC or version != _VERSION:
+        raise SnapshotError(f"unknown format {magic!r} v{version}")
+    if len(data) != _HEADER.size + count * _RECORD.size:
+        raise SnapshotError("size mismatch")
+
+    book = OrderBook(ticker)
+    for order_id, user_id, side, price, quantity, filled in _RECORD.iter_unpack(
+        memoryview(data)[_HEADER.size:]
+    ):
+        book.add(RestingOrder(
+            id=UUID(bytes=order_id),
+            user_id=UUID(bytes=user_id),
+            side=_SIDES[side],
+            price=price,
+            quantity=quantity,
+            filled=filled,
+        ))
+    book.pop_changes()
+    return book, last_event_id
+
+
+def snapshot_path(ticker: str) -> str:
+    return os.path.join(SNAPSHOT_DIR, f"{ticker}.book")
+
+
+def write_file(path: str, data: bytes) -> None:
+    """Атомарная запись: временный файл, fsync, rename."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def read_file(path: str) -> Optional[bytes]:
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+# ---------- журнал ----------
+def event_row(ticker: str, o: RestingOrder, live: bool) -> Dict[str, Any]:
+    """Строка журнала: состояние стоящей заявки на момент команды."""
+    return {
+        "ticker": ticker,
+        "order_id": o.id,
+        "user_id": o.user_id,
+        "side": o.side,
+        "price": o.price,
+        "quantity": o.quantity,
+        "filled": o.filled,
+        "live": live,
+    }
+
+
+async def journal(db: AsyncSession, rows: Sequence[Dict[str, Any]]) -> None:
+    """Дописывает строки event_row() в журнал одним executemany."""
+    if rows:
+        await db.execute(insert(OrderBookEvent), rows)
+
+
+async def journal_position(db: AsyncSession, ticker: str) -> int:
+    """id последнего события тикера (0, если событий нет)."""
+    return await db.scalar(
+        select(func.coalesce(func.max(OrderBookEvent.id), 0))
+        .where(OrderBookEvent.ticker == ticker)
+    )
+
+
+async def journal_tail(db: AsyncSession, ticker: str, after_id: int) -> List[OrderBookEvent]:
+    return list((await db.execute(
+        select(OrderBookEvent)
+        .where(OrderBookEvent.ticker == ticker, OrderBookEvent.id > after_id)
+        .order_by(OrderBookEvent.id)
+    )).scalars())
+
+
+async def prune(db: AsyncSession, ticker: str, upto_id: int) -> None:
+    """Удаляет события, уже вошедшие в снимок."""
+    await db.execute(
+        delete(OrderBookEvent)
+        .where(OrderBookEvent.ticker == ticker, OrderBookEvent.id <= upto_id)
+    )
+
+
+def replay(book: OrderBook, events: Iterable[OrderBookEvent]) -> None:
+    """Проигрывает события журнала поверх стакана из снимка."""
+    for e in events:
+        if not e.live:
+            book.remove(e.order_id)
+        elif e.order_id in book:
+            book.set_filled(e.order_id, e.filled)
+        else:
+            book.add(RestingOrder(
+                id=e.order_id,
+                user_id=e.user_id,
+                side=e.side,
+                price=e.price,
+                quantity=e.quantity,
+                filled=e.filled,
+            ))
+    book.pop_changes()
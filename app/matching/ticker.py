@@ -0,0 +1,111 @@
+from collections import deque
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from typing import Deque, Dict, Iterable, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.candles import bucket
+from app.ledger import QUOTE_TICKER
+from app.matching.book import Fill
+from app.models import Candle, Instrument, Transaction
+
+# Окно объёма торгов и шаг, с которым оно сдвигается
+VOLUME_WINDOW = timedelta(hours=24)
+VOLUME_STEP = 60
+
+
+@dataclass
+class TickerStats:
+    """Сводка по инструменту, обновляемая исполнениями."""
+    ticker: str
+    last_price: Optional[int] = None
+    last_qty: Optional[int] = None
+    last_time: Optional[datetime] = None
+    # Объём по минутам за последние сутки: (начало минуты, объём)
+    _volume: Deque[Tuple[datetime, int]] = field(default_factory=deque, repr=False)
+    _volume_total: int = field(default=0, repr=False)
+
+    def add_volume(self, minute: datetime, qty: int) -> None:
+        if self._volume and self._volume[-1][0] == minute:
+            self._volume[-1] = (minute, self._volume[-1][1] + qty)
+        else:
+            self._volume.append((minute, qty))
+        self._volume_total += qty
+
+    def volume_24h(self, now: datetime) -> int:
+        """Объём за скользящие сутки (с точностью до минуты)."""
+        since = now - VOLUME_WINDOW
+        while self._volume and self._volume[0][0] <= since:
+            self._volume_total -= self._volume.popleft()[1]
+        return self._volume_total
+
+
+class TickerCache:
+    """
+    Последняя сделка и суточный объём по каждому инструменту в памяти.
+
+    Обновляется движком после коммита группы сделок, при старте поднимается
+    из transactions (последняя сделка) и candles (минутные бары за сутки).
+    Лучшие bid/ask берутся из стакана в момент чтения, здесь не хранятся.
+    """
+
+    def __init__(self):
+        self._stats: Dict[str, TickerStats] = {}
+
+    def get(self, ticker: str) -> Optional[TickerStats]:
+        return self._stats.get(ticker)
+
+    def add_ticker(self, ticker: str, price: Optional[int] = None) -> TickerStats:
+        stats = self._stats.get(ticker)
+        if stats is None:
+            stats = self._stats[ticker] = TickerStats(ticker, last_price=price)
+        return stats
+
+    def discard(self, ticker: str) -> None:
+        self._stats.pop(ticker, None)
+
+    def on_fills(self, ticker: str, fills: Iterable[Fill], timestamp: datetime) -> None:
+        stats = self.add_ticker(ticker)
+        minute = bucket(timestamp, VOLUME_STEP)
+        for f in fills:
+            stats.last_price = f.price
+            stats.last_qty = f.qty
+            stats.last_time = timestamp
+            stats.add_volume(minute, f.qty)
+
+    async def load(self, db: AsyncSession) -> None:
+        """Инструменты, их последние сделки и суточный объём — тремя запросами."""
+        self._stats.clear()
+
+        # 1) Все торгуемые инструменты; цена из instruments — до первой сделки
+        rows = await db.execute(
+            select(Instrument.ticker, Instrument.current_price)
+            .where(Instrument.ticker != QUOTE_TICKER, Instrument.deleted_at.is_(None))
+        )
+        for ticker, price in rows:
+            self.add_ticker(ticker, price)
+
+        # 2) Последняя сделка по каждому тикеру (по индексу ticker, timestamp DESC)
+        rows = await db.execute(
+            select(Transaction.ticker, Transaction.price, Transaction.quantity, Transaction.timestamp)
+            .distinct(Transaction.ticker)
+            .order_by(Transaction.ticker, Transaction.timestamp.desc())
+        )
+        for ticker, price, qty, timestamp in rows:
+            stats = self.add_ticker(ticker)
+            stats.last_price, stats.last_qty, stats.last_time = price, qty, timestamp
+
+        # 3) Суточный объём — из минутных баров, без сканирования сделок
+        since = datetime.now(timezone.utc) - VOLUME_WINDOW
+        rows = await db.execute(
+            select(Candle.ticker, Candle.open_time, Candle.volume)
+            .where(Candle.interval == "1m", Candle.open_time > since)
+            .order_by(Candle.ticker, Candle.open_time)
+        )
+        for ticker, open_time, volume in rows:
+            self.add_ticker(ticker).add_volume(open_time, int(volume))
+
+
+ticker_cache = TickerCache()
@@ -0,0 +1,224 @@
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+# Границы корзин гистограмм по умолчанию, секунды
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = "") -> str:
+    pairs = [
+        '{}="{}"'.format(n, v.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for n, v in zip(names, values)
+    ]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Монотонный счётчик; метки — кортеж значений в порядке labelnames."""
+
+    type = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[LabelValues, float] = {}
+        REGISTRY.append(self)
+
+    def inc(self, amount: float = 1, labels: LabelValues = ()) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, labels: LabelValues = ()) -> float:
+        return self._values.get(labels, 0)
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labelnames, labels)} {_format_value(v)}"
+            for labels, v in sorted(self._values.items())
+        ]
+
+
+class Histogram:
+    """
+    Гистограмма с фиксированными корзинами: observe() — один bisect
+    и два сложения, накопленные счётчики считаются только при выгрузке.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # метки -> [счётчики по корзинам (+Inf последней), сумма]
+        self._values: Dict[LabelValues, list] = {}
+        REGISTRY.append(self)
+
+    def observe(self, value: float, labels: LabelValues = ()) -> None:
+        item = self._values.get(labels)
+        if item is None:
+            item = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        item[0][bisect_left(self.buckets, value)] += 1
+        item[1] += value
+
+    def count(self, labels: LabelValues = ()) -> int:
+        item = self._values.get(labels)
+        return sum(item[0]) if item else 0
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float("inf"),), counts):
+                cumulative += n
+                le = 'le="{}"'.format(_format_value(bound))
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, labels, le)} {cumulative}")
+            suffix = _format_labels(self.labelnames, labels)
+            lines.append(f"{self.name}_sum{suffix} {_format_value(total)}")
+            lines.append(f"{self.name}_count{suffix} {cumulative}")
+        return lines
+
+
+REGISTRY: List[object] = []
+
+
+def render() -> str:
+    """Все метрики процесса в текстовом формате Prometheus (0.0.4)."""
+    lines = []
+    for metric in REGISTRY:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.type}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+
+# ---------- HTTP ----------
+http_requests = Counter(
+    "http_requests_total", "HTTP-запросы по ручке и статусу", ("method", "route", "status"),
+)
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Длительность обработки запроса", ("method", "route"),
+)
+http_request_db_queries = Histogram(
+    "http_request_db_queries", "Запросов к БД на один HTTP-запрос", ("method", "route"),
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 50, 100),
+)
+http_request_db_duration = Histogram(
+    "http_request_db_duration_seconds", "Суммарное время запросов к БД на один HTTP-запрос", ("method", "route"),
+)
+
+# ---------- БД ----------
+db_queries = Counter("db_queries_total", "Выполненные запросы к БД")
+db_query_duration = Histogram("db_query_duration_seconds", "Длительность одного запроса к БД")
+db_pool_wait = Histogram("db_pool_wait_seconds", "Ожидание соединения из пула")
+
+# ---------- аутентификация ----------
+auth_lookups = Counter("auth_cache_lookups_total", "Проверки API-ключа по кэшу", ("result",))
+
+
+class RequestStats:
+    """Запросы к БД в рамках одного HTTP-запроса."""
+
+    __slots__ = ("queries", "db_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+
+
+# Контекст задачи переходит и в greenlet'ы SQLAlchemy, где выполняются события движка
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+
+def instrument_engine(engine: AsyncEngine) -> None:
+    """Счётчики и длительности запросов и ожидание пула на движке SQLAlchemy."""
+    sync_engine = engine.sync_engine
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info["query_start"] = time.perf_counter()
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info.pop("query_start", time.perf_counter())
+        db_queries.inc()
+        db_query_duration.observe(elapsed)
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+    # У пула нет события «начал ждать соединение»: оборачиваем получение
+    # соединения у экземпляра пула (выполняется в greenlet'е, ожидание входит)
+    pool = sync_engine.pool
+    do_get = pool._do_get
+
+    def _timed_do_get():
+        start = time.perf_counter()
+        try:
+            return do_get()
+        finally:
+            db_pool_wait.observe(time.perf_counter() - start)
+
+    pool._do_get = _timed_do_get
+
+
+class MetricsMiddleware:
+    """
+    Длительность, статус и число запросов к БД по ручке. Ручка — шаблон
+    пути из FastAPI ("/api/v1/order/{order_id}"), чтобы не плодить метки.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = RequestStats()
+        token = current_request.set(stats)
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            current_request.reset(token)
+            route = scope.get("route")
+            labels = (scope["method"], route.path if route is not None else "unmatched")
+            http_requests.inc(labels=labels + (str(status_code),))
+            http_request_duration.observe(elapsed, labels)
+            http_request_db_queries.observe(stats.queries, labels)
+            http_request_db_duration.observe(stats.db_seconds, labels)
@@ -0,0 +1,106 @@
+import json
+import logging
+import time
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from app.logging_config import REQUEST_LOGGER
+
+request_logger = logging.getLogger(REQUEST_LOGGER)  # сэмплируется, см. LOG_REQUEST_SAMPLE_RATE
+
+
+def _has_body(scope: Scope) -> bool:
+    """Есть ли у запроса тело — по заголовкам, не читая поток."""
+    for name, value in scope["headers"]:
+        if name == b"content-length":
+            return value.strip() not in (b"", b"0")
+        if name == b"transfer-encoding":
+            return True
+    return False
+
+
+class DeleteBodyValidatorMiddleware:
+    """
+    DELETE-запросы не должны нести тело (кроме пустого "{}").
+
+    Чистый ASGI: тело читается, только если оно заявлено в заголовках,
+    и затем отдаётся приложению заново; остальные запросы проходят без обёрток.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or scope["method"] != "DELETE" or not _has_body(scope):
+            await self.app(scope, receive, send)
+            return
+
+        chunks = []
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = b"".join(chunks)
+
+        if body not in (b"", b"{}"):
+            payload = json.dumps(
+                {"detail": "DELETE-запрос не должен содержать тело"}, ensure_ascii=False
+            ).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 422,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(payload)).encode()),
+                ],
+            })
+            await send({"type": "http.response.body", "body": payload})
+            return
+
+        replayed = False
+
+        async def replay() -> Message:
+            nonlocal replayed
+            if not replayed:
+                replayed = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        await self.app(scope, replay, send)
+
+
+class RequestLoggingMiddleware:
+    """Одна (сэмплированная) запись на запрос: метод, путь, статус, длительность."""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        status_code = 500
+
+        async def send_wrapper(message: Message) -> None:
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        except Exception:
+            request_logger.error(
+                "Ошибка при обработке запроса %s %s", scope["method"], scope["path"],
+                exc_info=True,
+            )
+            raise
+        request_logger.info(
+            "%s %s -> %d", scope["method"], scope["path"], status_code,
+            extra={"duration_ms": round((time.perf_counter() - start) * 1000, 3)},
+        )
@@ -8,7 +8,12 @@ from sqlalchemy import (
     String,
     DateTime,
     Integer,
+    BigInteger,
+    Boolean,
     ForeignKey,
+    Index,
+    UniqueConstraint,
+    text,
     Enum as SQLEnum  # aliased to avoid conflict with Python's enum.Enum
 )
 from sqlalchemy.dialects.postgresql import UUID as PG_UUID
@@ -38,6 +43,10 @@ class OrderStatusEnum(str, enum.Enum):
 # ===================== Таблицы =====================
 class User(Base):
     __tablename__ = "users"
+    __table_args__ = (
+        # Очередь фонового удаления (reaper)
+        Index("ix_users_deleted", "deleted_at", postgresql_where=text("deleted_at IS NOT NULL")),
+    )
 
     id = Column(
         PG_UUID(as_uuid=True),
@@ -59,6 +68,11 @@ class User(Base):
         default=lambda: datetime.datetime.now(timezone.utc),
         nullable=False
     )
+    deleted_at    = Column(
+        DateTime(timezone=True),
+        nullable=True,
+        comment="Удалён (tombstone); данные дочищает фоновый reaper"
+    )
 
     balances = relationship("Balance", back_populates="user", cascade="all, delete-orphan")
     orders   = relationship("Order",   back_populates="user", cascade="all, delete-orphan")
@@ -66,6 +80,10 @@ class User(Base):
 
 class Instrument(Base):
     __tablename__ = "instruments"
+    __table_args__ = (
+        # Очередь фонового удаления (reaper)
+        Index("ix_instruments_deleted", "deleted_at", postgresql_where=text("deleted_at IS NOT NULL")),
+    )
 
     ticker  = Column(String, primary_key=True, index=True, nullable=False)
     name    = Column(String, nullable=False)
@@ -88,6 +106,11 @@ class Instrument(Base):
         default=0,
         comment="Текущая цена инструмента (для рыночного ордера)"
     )
+    deleted_at = Column(
+        DateTime(timezone=True),
+        nullable=True,
+        comment="Удалён (tombstone); данные дочищает фоновый reaper"
+    )
     balances     = relationship("Balance",     back_populates="instrument", cascade="all, delete-orphan")
     orders       = relationship("Order",       back_populates="instrument", cascade="all, delete-orphan")
     transactions = relationship("Transaction", back_populates="instrument", cascade="all, delete-orphan")
@@ -95,6 +118,9 @@ class Instrument(Base):
 
 class Balance(Base):
     __tablename__ = "balances"
+    __table_args__ = (
+        UniqueConstraint("user_id", "ticker", name="uq_balances_user_id_ticker"),
+    )
 
     id      = Column(
         PG_UUID(as_uuid=True),
@@ -105,7 +131,14 @@ class Balance(Base):
     )
     user_id = Column(PG_UUID(as_uuid=True), ForeignKey("users.id"), nullable=False)
     ticker  = Column(String, ForeignKey("instruments.ticker"), nullable=False)
-    amount  = Column(Integer, default=0, nullable=False)
+    amount  = Column(Integer, default=0, nullable=False)  # свободный остаток
+    locked  = Column(
+        Integer,
+        default=0,
+        server_default="0",
+        nullable=False,
+        comment="Заблокировано под активные заявки"
+    )
 
     user       = relationship("User",       back_populates="balances")
     instrument = relationship("Instrument", back_populates="balances")
@@ -130,6 +163,17 @@ class Order(Base):
     filled_qty  = Column(Integer, default=0, nullable=False)
     created_at  = Column(DateTime(timezone=True), default=lambda: datetime.datetime.now(timezone.utc), nullable=False)
 
+    __table_args__ = (
+        # Стакан: только живые заявки (partial index), по тикеру/стороне/цене
+        Index(
+            "ix_orders_live_book",
+            "ticker", "side", "price", "created_at",
+            postgresql_where=text("status IN ('NEW', 'PARTIALLY_EXECUTED')"),
+        ),
+        # История заявок пользователя
+        Index("ix_orders_user_id_created_at", "user_id", "created_at"),
+    )
+
     user            = relationship("User",       back_populates="orders")
     instrument      = relationship("Instrument", back_populates="orders")
     buy_transactions  = relationship("Transaction", back_populates="buy_order",  foreign_keys="[Transaction.buy_order_id]")
@@ -153,6 +197,52 @@ class Transaction(Base):
     price         = Column(Integer, nullable=False)
     timestamp     = Column(DateTime(timezone=True), default=lambda: datetime.datetime.now(timezone.utc), nullable=False)
 
+    __table_args__ = (
+        # Лента сделок по тикеру: WHERE ticker = ? ORDER BY timestamp DESC
+        Index("ix_transactions_ticker_timestamp", "ticker", text("timestamp DESC")),
+        # FK на заявки — для удаления заявок и выборки сделок по заявке
+        Index("ix_transactions_buy_order_id", "buy_order_id"),
+        Index("ix_transactions_sell_order_id", "sell_order_id"),
+    )
+
     buy_order  = relationship("Order", back_populates="buy_transactions",  foreign_keys=[buy_order_id])
     sell_order = relationship("Order", back_populates="sell_transactions", foreign_keys=[sell_order_id])
-    instrument = relationship("Instrument", back_populates="transactions")
\ No newline at end of file
+    instrument = relationship("Instrument", back_populates="transactions")
+
+
+class OrderBookEvent(Base):
+    """
+    Журнал изменений стаканов: состояние стоящей заявки после каждой команды.
+    Пишется в одной транзакции с заявками; при старте проигрывается поверх снимка.
+    """
+    __tablename__ = "order_book_events"
+    __table_args__ = (
+        Index("ix_order_book_events_ticker_id", "ticker", "id"),
+    )
+
+    id       = Column(BigInteger, primary_key=True, autoincrement=True)
+    ticker   = Column(String, nullable=False)
+    order_id = Column(PG_UUID(as_uuid=True), nullable=False)
+    user_id  = Column(PG_UUID(as_uuid=True), nullable=False)
+    side     = Column(SQLEnum(OrderSideEnum, name="ordersideenum", native_enum=True, create_type=False), nullable=False)
+    price    = Column(Integer, nullable=False)
+    quantity = Column(Integer, nullable=False)
+    filled   = Column(Integer, nullable=False)
+    live     = Column(Boolean, nullable=False, comment="False — заявка ушла из стакана")
+
+
+class Candle(Base):
+    """
+    OHLCV-бары по сделкам (1s/1m/5m/1h/1d). Обновляются инкрементально
+    в одной транзакции со сделками; графики читают только эту таблицу.
+    """
+    __tablename__ = "candles"
+
+    ticker    = Column(String, primary_key=True)
+    interval  = Column(String, primary_key=True)
+    open_time = Column(DateTime(timezone=True), primary_key=True)
+    open      = Column(Integer, nullable=False)
+    high      = Column(Integer, nullable=False)
+    low       = Column(Integer, nullable=False)
+    close     = Column(Integer, nullable=False)
+    volume    = Column(BigInteger, nullable=False)
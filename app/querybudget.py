@@ -0,0 +1,144 @@
+import json
+import logging
+import os
+from collections import Counter, defaultdict
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncEngine
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from app.matching.sequencer import group_callers
+
+logger = logging.getLogger(__name__)
+
+# Бюджет запросов к БД на один HTTP-запрос (для разработки; 0 — без бюджета)
+QUERY_BUDGET = int(os.getenv("QUERY_BUDGET", "0"))
+# log — предупреждение в лог; fail — запрос сверх бюджета падает с ошибкой
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "log")
+# Сколько раз один и тот же SQL в рамках запроса считается признаком N+1
+QUERY_REPEAT_LIMIT = int(os.getenv("QUERY_REPEAT_LIMIT", "3"))
+# Куда при остановке записать отчёт по ручкам (JSON); пусто — не писать
+QUERY_REPORT = os.getenv("QUERY_REPORT", "")
+
+
+def enabled() -> bool:
+    return QUERY_BUDGET > 0 or bool(QUERY_REPORT)
+
+
+class QueryBudgetExceeded(Exception):
+    """Запрос вышел за бюджет или повторяет один и тот же SQL (режим fail)."""
+
+
+# Выражения текущего HTTP-запроса
+_current: ContextVar[Optional[List[str]]] = ContextVar("query_budget", default=None)
+
+
+class QueryReport:
+    """Сводка по ручкам: сколько запросов к БД они делают и где повторяется SQL."""
+
+    def __init__(self):
+        self._routes: Dict[str, dict] = defaultdict(lambda: {
+            "requests": 0,
+            "queries": 0,
+            "max_queries": 0,
+            "over_budget": 0,
+            "repeated": {},
+        })
+
+    def record(self, route: str, statements: List[str], repeated: Dict[str, int]) -> None:
+        item = self._routes[route]
+        item["requests"] += 1
+        item["queries"] += len(statements)
+        item["max_queries"] = max(item["max_queries"], len(statements))
+        if QUERY_BUDGET and len(statements) > QUERY_BUDGET:
+            item["over_budget"] += 1
+        for sql, n in repeated.items():
+            item["repeated"][sql] = max(item["repeated"].get(sql, 0), n)
+
+    def as_dict(self) -> Dict[str, dict]:
+        return {
+            route: dict(item, avg_queries=round(item["queries"] / item["requests"], 2))
+            for route, item in sorted(
+                self._routes.items(), key=lambda kv: kv[1]["max_queries"], reverse=True
+            )
+        }
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"budget": QUERY_BUDGET, "routes": self.as_dict()}, f, ensure_ascii=False, indent=2)
+
+
+query_report = QueryReport()
+
+
+def _repeated(statements: List[str]) -> Dict[str, int]:
+    return {sql: n for sql, n in Counter(statements).items() if n >= QUERY_REPEAT_LIMIT}
+
+
+def _count(conn, cursor, statement, parameters, context, executemany) -> None:
+    current = _current.get()
+    if current is None:
+        # Владелец тикера: выражение команды — её запросу, запись группы —
+        # всем запросам группы. Без режима fail: ошибка провалила бы всю группу
+        for caller in group_callers.get():
+            statements = caller.get(_current)
+            if statements is not None:
+                statements.append(statement)
+        return
+    current.append(statement)
+    if QUERY_BUDGET_MODE != "fail":
+        return
+    # Падаем до выполнения лишнего выражения, чтобы ошибка указала на место
+    if QUERY_BUDGET and len(current) > QUERY_BUDGET:
+        raise QueryBudgetExceeded(
+            f"{len(current)} queries in one request, budget is {QUERY_BUDGET}"
+        )
+    if current.count(statement) >= QUERY_REPEAT_LIMIT:
+        raise QueryBudgetExceeded(
+            f"Same statement executed {QUERY_REPEAT_LIMIT} times in one request (N+1?): {statement[:200]}"
+        )
+
+
+def install(engine: AsyncEngine) -> None:
+    """Считает выражения текущего HTTP-запроса через before_cursor_execute."""
+    event.listen(engine.sync_engine, "before_cursor_execute", _count)
+
+
+class QueryBudgetMiddleware:
+    """
+    Режим разработки: выражения к БД по каждому запросу. Сверх QUERY_BUDGET
+    или при повторе одного SQL QUERY_REPEAT_LIMIT раз — предупреждение
+    (или ошибка в режиме fail); сводка по ручкам копится в query_report.
+
+    Группы команд матчинга выполняются в задачах-владельцах тикеров:
+    выражения команды учитываются её запросу, а запись группы (один
+    executemany на таблицу и коммит) — каждому запросу группы целиком.
+    Команды над несколькими тикерами (пакет, отмена всех) выполняются
+    в задаче запроса и учитываются как обычно.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        current: List[str] = []
+        token = _current.set(current)
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _current.reset(token)
+            route = scope.get("route")
+            path = f"{scope['method']} {route.path if route is not None else 'unmatched'}"
+            repeated = _repeated(current)
+            query_report.record(path, current, repeated)
+            if (QUERY_BUDGET and len(current) > QUERY_BUDGET) or repeated:
+                logger.warning(
+                    "%s: %d запросов к БД (бюджет %d)", path, len(current), QUERY_BUDGET,
+                    extra={"queries": len(current), "repeated": repeated},
+                )
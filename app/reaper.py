@@ -0,0 +1,155 @@
+import asyncio
+import logging
+import os
+import zlib
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+from uuid import UUID
+
+from sqlalchemy import delete, exists, func, inspect, or_, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.db import AsyncSessionLocal
+from app.matching import matching_engine
+from app.matching.engine import LIVE_STATUSES
+from app.metrics import Counter
+from app.models import Balance, Candle, Instrument, Order, OrderBookEvent, Transaction, User
+
+logger = logging.getLogger(__name__)
+
+# Пауза между проходами, секунды
+REAPER_INTERVAL = float(os.getenv("REAPER_INTERVAL", "5"))
+# Строк в одном DELETE: короткие транзакции, блокировки держатся миллисекунды
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "1000"))
+# Пауза между пачками, чтобы не вытеснять торговые запросы из пула и с диска
+REAPER_PAUSE = float(os.getenv("REAPER_PAUSE", "0.05"))
+# Удалённых пользователей за один проход
+USERS_PER_PASS = 100
+
+# Тяжёлую часть выполняет один процесс за раз (pg_try_advisory_xact_lock)
+REAPER_LOCK_KEY = zlib.crc32(b"reaper")
+
+reaped_rows = Counter("reaper_deleted_rows_total", "Строки, удалённые фоновым reaper", ("table",))
+
+
+class _Busy(Exception):
+    """Пачку дочищает другой процесс — проход откладывается."""
+
+
+@asynccontextmanager
+async def _locked() -> AsyncIterator[AsyncSession]:
+    """Транзакция под общей блокировкой reaper'а; коммит — на выходе."""
+    async with AsyncSessionLocal() as db:
+        got = await db.scalar(select(func.pg_try_advisory_xact_lock(REAPER_LOCK_KEY)))
+        if not got:
+            raise _Busy()
+        yield db
+        await db.commit()
+
+
+async def _delete_batch(db: AsyncSession, model, *where) -> int:
+    """DELETE не больше REAPER_BATCH_SIZE строк по первичному ключу."""
+    pk = inspect(model).primary_key
+    ids = select(*pk).where(*where).limit(REAPER_BATCH_SIZE)
+    res = await db.execute(
+        delete(model).where(tuple_(*pk).in_(ids)),
+        execution_options={"synchronize_session": False},
+    )
+    reaped_rows.inc(res.rowcount, (model.__tablename__,))
+    return res.rowcount
+
+
+async def _drain(model, *where) -> int:
+    """Удаляет строки пачками, каждая — в своей транзакции."""
+    total = 0
+    while True:
+        async with _locked() as db:
+            n = await _delete_batch(db, model, *where)
+        total += n
+        if n < REAPER_BATCH_SIZE:
+            return total
+        await asyncio.sleep(REAPER_PAUSE)
+
+
+class Reaper:
+    """
+    Фоновая дочистка удалённых пользователей и инструментов.
+
+    Ручки удаления только ставят deleted_at (tombstone): такой пользователь
+    не проходит аутентификацию, инструмент пропадает из справочника. Всё
+    остальное делает reaper: снимает живые заявки из стаканов своего процесса,
+    затем пачками по REAPER_BATCH_SIZE удаляет сделки, заявки, журнал, бары
+    и балансы и в конце — саму строку. Каждая пачка — отдельная короткая
+    транзакция, поэтому удаление не держит блокировки на горячих таблицах.
+    """
+
+    async def run(self, interval: float = REAPER_INTERVAL) -> None:
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.run_once()
+            except _Busy:
+                pass
+            except Exception:
+                logger.exception("Проход reaper не удался")
+
+    async def run_once(self) -> None:
+        async with AsyncSessionLocal() as db:
+            tickers = (await db.execute(
+                select(Instrument.ticker).where(Instrument.deleted_at.is_not(None))
+            )).scalars().all()
+            user_ids = (await db.execute(
+                select(User.id).where(User.deleted_at.is_not(None))
+                .order_by(User.deleted_at).limit(USERS_PER_PASS)
+            )).scalars().all()
+
+        for ticker in tickers:
+            await self.reap_instrument(ticker)
+        for user_id in user_ids:
+            await self.reap_user(user_id)
+
+    async def reap_user(self, user_id: UUID) -> bool:
+        """True — пользователь удалён окончательно."""
+        # 1) Живые заявки в стаканах этого процесса; чужие снимет их владелец
+        await matching_engine.cancel_all(user_id)
+
+        # 2) Сделки по завершённым заявкам пользователя, затем сами заявки
+        done = select(Order.id).where(Order.user_id == user_id, Order.status.not_in(LIVE_STATUSES))
+        await _drain(Transaction, or_(Transaction.buy_order_id.in_(done), Transaction.sell_order_id.in_(done)))
+        await _drain(Order, Order.user_id == user_id, Order.status.not_in(LIVE_STATUSES))
+
+        # 3) Балансы и пользователь — когда заявок не осталось (их немного: по одному на тикер)
+        async with _locked() as db:
+            if await db.scalar(select(exists().where(Order.user_id == user_id))):
+                return False
+            res = await db.execute(delete(Balance).where(Balance.user_id == user_id))
+            reaped_rows.inc(res.rowcount, (Balance.__tablename__,))
+            await db.execute(delete(User).where(User.id == user_id))
+        reaped_rows.inc(1, (User.__tablename__,))
+        logger.info("Пользователь %s удалён", user_id)
+        return True
+
+    async def reap_instrument(self, ticker: str) -> bool:
+        """True — инструмент удалён окончательно."""
+        # 1) Стакан этого процесса: отмена заявок с возвратом резервов
+        await matching_engine.delist(ticker)
+
+        # 2) История инструмента, затем завершённые заявки
+        await _drain(Transaction, Transaction.ticker == ticker)
+        await _drain(OrderBookEvent, OrderBookEvent.ticker == ticker)
+        await _drain(Candle, Candle.ticker == ticker)
+        await _drain(Order, Order.ticker == ticker, Order.status.not_in(LIVE_STATUSES))
+
+        # 3) Балансы и инструмент — когда не осталось заявок (стакан у другого процесса)
+        async with AsyncSessionLocal() as db:
+            if await db.scalar(select(exists().where(Order.ticker == ticker))):
+                return False
+        await _drain(Balance, Balance.ticker == ticker)
+        async with _locked() as db:
+            await db.execute(delete(Instrument).where(Instrument.ticker == ticker))
+        reaped_rows.inc(1, (Instrument.__tablename__,))
+        logger.info("Инструмент %s удалён", ticker)
+        return True
+
+
+reaper = Reaper()
@@ -0,0 +1,21 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import JSONResponse
+
+
+def dumps(content: Any) -> bytes:
+    """JSON через orjson; UTC-время с суффиксом Z — как у Pydantic."""
+    return orjson.dumps(content, option=orjson.OPT_UTC_Z)
+
+
+class ORJSONResponse(JSONResponse):
+    """
+    Быстрый ответ для горячих ручек: UUID, datetime и Enum сериализуются
+    orjson нативно. Ручка, вернувшая такой ответ, минует повторную
+    валидацию по response_model (он остаётся для схемы OpenAPI),
+    поэтому содержимое должно уже иметь форму схемы.
+    """
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
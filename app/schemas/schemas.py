@@ -2,7 +2,7 @@ import re
 from enum import Enum
 from uuid import UUID
 from datetime import datetime
-from typing import List, Literal, Optional, constr
+from typing import List, Literal, Optional
 
 from pydantic import BaseModel, Field, field_validator, ConfigDict, constr
 
@@ -55,9 +55,9 @@ class UserOut(BaseModel):
         return v.upper() if isinstance(v, str) else v
 
 # === Instrument & OrderBook schemas ===
-class InstrumentSchema(BaseModel):
+class Instrument(BaseModel):
     name: constr(min_length=2, max_length=50) = Field(..., description="Название инструмента (от 2 до 50 символов)")
-    ticker: constr(regex="^[A-Z]{2,10}$") = Field(..., description="Тикер инструмента (2-10 заглавных латинских букв)")
+    ticker: constr(pattern="^[A-Z]{2,10}$") = Field(..., description="Тикер инструмента (2-10 заглавных латинских букв)")
     currency: Literal["RUB"] = Field("RUB", description="Валюта расчёта — всегда RUB")
 
     model_config = ConfigDict(
@@ -81,6 +81,44 @@ class Transaction(BaseModel):
     price: int
     timestamp: datetime
 
+class CandleInterval(str, Enum):
+    S1 = "1s"
+    M1 = "1m"
+    M5 = "5m"
+    H1 = "1h"
+    D1 = "1d"
+
+class Candle(BaseModel):
+    time: datetime = Field(..., description="Начало бара (UTC)")
+    open: int
+    high: int
+    low: int
+    close: int
+    volume: int
+
+class Ticker(BaseModel):
+    ticker: str
+    last_price: Optional[int] = Field(None, description="Цена последней сделки")
+    last_qty: Optional[int] = Field(None, description="Объём последней сделки")
+    last_trade_time: Optional[datetime] = None
+    best_bid: Optional[int] = Field(None, description="Лучшая цена покупки в стакане")
+    best_ask: Optional[int] = Field(None, description="Лучшая цена продажи в стакане")
+    volume_24h: int = Field(0, description="Объём сделок за последние 24 часа")
+
+# === Market data stream schemas ===
+class OrderBookSnapshot(L2OrderBook):
+    type: Literal["snapshot"] = "snapshot"
+    ticker: str
+    seq: int = Field(..., description="Номер последнего учтённого события")
+
+class OrderBookUpdate(BaseModel):
+    type: Literal["update"] = "update"
+    ticker: str
+    seq: int = Field(..., description="Номер события; пропуск означает потерю данных")
+    bid_levels: List[Level] = Field(default_factory=list, description="Новые остатки уровней, qty=0 — уровень удалён")
+    ask_levels: List[Level] = Field(default_factory=list, description="Новые остатки уровней, qty=0 — уровень удалён")
+    trades: List[Transaction] = Field(default_factory=list)
+
 # === Order schemas ===
 class LimitOrderBody(BaseModel):
     direction: Direction = Field(..., description="Направление ордера")
@@ -120,6 +158,26 @@ class CreateOrderResponse(BaseModel):
     success: bool = True
     order_id: UUID = Field(..., format="uuid4")
 
+class BatchOrderResult(BaseModel):
+    success: bool
+    order_id: Optional[UUID] = Field(default=None, format="uuid4")
+    error: Optional[str] = Field(default=None, description="Причина отказа по этой заявке")
+
+class BatchOrderResponse(BaseModel):
+    results: List[BatchOrderResult] = Field(..., description="Результаты в порядке заявок запроса")
+
+class ReplaceOrderBody(BaseModel):
+    price: Optional[int] = Field(default=None, gt=0, description="Новая цена; по умолчанию — прежняя")
+    qty: Optional[int] = Field(default=None, ge=1, description="Новое количество; по умолчанию — неисполненный остаток")
+
+    model_config = ConfigDict(
+        json_schema_extra={"example": {"price": 510000, "qty": 1}}
+    )
+
+class CancelOrdersResponse(BaseModel):
+    success: bool = True
+    cancelled: List[UUID] = Field(..., description="id отменённых заявок")
+
 class Ok(BaseModel):
     success: bool = True
 
@@ -132,6 +190,16 @@ class BalanceOut(BaseModel):
         json_schema_extra={"example": {"BTCRUB": 1000.0, "ETHRUB": 5.0}}
     )
 
+# === Admin DB pool schemas ===
+class PoolStats(BaseModel):
+    pool_size: int = Field(..., description="Постоянных соединений в пуле")
+    max_overflow: int = Field(..., description="Сколько можно открыть сверх pool_size")
+    checked_in: int = Field(..., description="Свободно в пуле")
+    checked_out: int = Field(..., description="Выдано запросам")
+    overflow: int = Field(..., description="Открыто сверх pool_size (может быть < 0, пока пул не заполнен)")
+    capacity: int = Field(..., description="pool_size + max_overflow")
+    utilization: float = Field(..., description="checked_out / capacity")
+
 # === Admin BalanceChange schemas ===
 class DepositBody(BaseModel):
     user_id: UUID = Field(..., description="UUID пользователя", format="uuid")
@@ -151,3 +219,21 @@ class DepositBody(BaseModel):
 
 class WithdrawBody(DepositBody):
     pass
+
+# === Admin bulk schemas ===
+class BulkRowResult(BaseModel):
+    row: int = Field(..., description="Номер строки во входных данных, с 0")
+    success: bool
+    error: Optional[str] = Field(default=None, description="Причина отказа по этой строке")
+
+class BulkUserResult(BulkRowResult):
+    id: Optional[UUID] = Field(default=None, format="uuid4")
+    api_key: Optional[str] = Field(default=None, description="API-ключ созданного пользователя")
+
+class BulkUsersResponse(BaseModel):
+    created: int = Field(..., description="Сколько пользователей создано")
+    results: List[BulkUserResult] = Field(..., description="Результаты в порядке строк запроса")
+
+class BulkDepositResponse(BaseModel):
+    applied: int = Field(..., description="Сколько зачислений проведено")
+    results: List[BulkRowResult] = Field(..., description="Результаты в порядке строк запроса")
@@ -0,0 +1,98 @@
+"""
+Проверка планов горячих запросов: каждый должен идти по своему индексу.
+
+Запросы строятся теми же выражениями SQLAlchemy, что и в приложении, и
+прогоняются через EXPLAIN (FORMAT JSON) на базе из DATABASE_URL
+(после alembic upgrade head). enable_seqscan выключается, чтобы на
+маленькой базе проверялась применимость индекса, а не выбор планировщика.
+Код возврата 1, если какой-то запрос не использует ожидаемый индекс.
+
+    DATABASE_URL=postgresql+asyncpg://... python -m bench.explain
+"""
+import asyncio
+import json
+import sys
+from datetime import datetime, timezone
+from typing import Iterator, List, Tuple
+from uuid import uuid4
+
+from sqlalchemy import select, text, tuple_
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.sql import Select
+
+from app.db import engine
+from app.matching.engine import LIVE_STATUSES
+from app.models import Balance, Candle, Order, Transaction
+
+USER_ID = uuid4()
+TICKER = "BTCRUB"
+
+# (название, запрос, индекс, который должен быть в плане)
+HOT_QUERIES: List[Tuple[str, Select, str]] = [
+    (
+        "загрузка стакана при старте",
+        select(Order)
+        .where(Order.ticker == TICKER, Order.status.in_(LIVE_STATUSES), Order.price.is_not(None))
+        .order_by(Order.created_at, Order.id),
+        "ix_orders_live_book",
+    ),
+    (
+        "страница истории заявок пользователя",
+        select(Order)
+        .where(
+            Order.user_id == USER_ID,
+            tuple_(Order.created_at, Order.id) < tuple_(datetime.now(timezone.utc), uuid4()),
+        )
+        .order_by(Order.created_at.desc(), Order.id.desc())
+        .limit(101),
+        "ix_orders_user_id_created_at",
+    ),
+    (
+        "баланс пользователя по тикеру",
+        select(Balance).where(Balance.user_id == USER_ID, Balance.ticker == TICKER),
+        "uq_balances_user_id_ticker",
+    ),
+    (
+        "последние сделки по тикеру",
+        select(Transaction)
+        .where(Transaction.ticker == TICKER)
+        .order_by(Transaction.timestamp.desc())
+        .limit(100),
+        "ix_transactions_ticker_timestamp",
+    ),
+    (
+        "бары для графика",
+        select(Candle)
+        .where(Candle.ticker == TICKER, Candle.interval == "1m")
+        .order_by(Candle.open_time.desc())
+        .limit(100),
+        "candles_pkey",
+    ),
+]
+
+
+def _index_names(plan: dict) -> Iterator[str]:
+    if "Index Name" in plan:
+        yield plan["Index Name"]
+    for child in plan.get("Plans", []):
+        yield from _index_names(child)
+
+
+async def main() -> int:
+    failed = 0
+    async with engine.connect() as conn:
+        await conn.execute(text("SET enable_seqscan = off"))
+        for name, stmt, index in HOT_QUERIES:
+            sql = stmt.compile(dialect=postgresql.dialect(), compile_kwargs={"literal_binds": True})
+            raw = (await conn.execute(text(f"EXPLAIN (FORMAT JSON) {sql}"))).scalar_one()
+            plan = (json.loads(raw) if isinstance(raw, str) else raw)[0]["Plan"]
+            used = sorted(set(_index_names(plan)))
+            ok = index in used
+            failed += not ok
+            print(f"{'OK  ' if ok else 'FAIL'} {name}: ожидается {index}, в плане {used or 'нет индексов'}")
+    await engine.dispose()
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main()))
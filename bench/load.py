@@ -0,0 +1,321 @@
+"""
+Нагрузочный прогон API биржи: задержки p50/p99/p999 и пропускная
+способность по ручкам в машиночитаемом виде.
+
+Приложение app.main:app поднимается in-process (с lifespan: справочник
+инструментов, стаканы, кэш тикеров) и нагружается через
+httpx.ASGITransport — без сети и uvicorn, поэтому цифры отражают
+сам код и базу. База — из DATABASE_URL: локальный Postgres
+(docker-compose, после alembic upgrade head) или любой совместимый
+с ним стенд. Пользователи, инструмент и балансы прогон создаёт сам
+через API.
+
+Сценарии:
+    order_entry   — поток лимитных заявок вокруг одной цены (с исполнениями)
+    cancel_storm  — массовая отмена заранее выставленных заявок
+    book_polling  — опрос стакана и тикера, как это делают клиенты
+    registration  — всплеск регистраций новых пользователей
+
+    DATABASE_URL=postgresql+asyncpg://... python -m bench.load \\
+        --requests 2000 --concurrency 32 --output bench.json
+    # сравнение с прошлым прогоном: код возврата 1, если p99 ручки хуже в --threshold раз
+    python -m bench.load --compare bench.json --threshold 1.5
+    # заодно отчёт о числе запросов к БД по ручкам (app/querybudget.py)
+    QUERY_REPORT=queries.json QUERY_BUDGET=4 python -m bench.load
+"""
+import argparse
+import asyncio
+import json
+import random
+import sys
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+from uuid import uuid4
+
+import httpx
+
+from app.main import app
+
+TICKER = "BENCHRUB"
+MID_PRICE = 1000
+# Средств с запасом на весь прогон (balances.amount — integer)
+FUNDS_RUB = 10 ** 9
+FUNDS_ASSET = 10 ** 6
+
+SCENARIOS = ("order_entry", "cancel_storm", "book_polling", "registration")
+
+
+class Recorder:
+    """Задержки по ручкам одного сценария (ключ — метод и шаблон пути)."""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+        self.started = time.perf_counter()
+        self.elapsed = 0.0
+
+    async def call(self, endpoint: str, request: Awaitable[httpx.Response]) -> Optional[httpx.Response]:
+        start = time.perf_counter()
+        response = await request
+        self.latencies[endpoint].append(time.perf_counter() - start)
+        if response.status_code >= 400:
+            self.errors[endpoint] += 1
+            return None
+        return response
+
+    def stop(self) -> None:
+        self.elapsed = time.perf_counter() - self.started
+
+    def report(self) -> Dict[str, dict]:
+        return {
+            endpoint: {
+                "count": len(samples),
+                "errors": self.errors[endpoint],
+                "rps": round(len(samples) / self.elapsed, 1) if self.elapsed else None,
+                "p50_ms": _percentile(samples, 50),
+                "p99_ms": _percentile(samples, 99),
+                "p999_ms": _percentile(samples, 99.9),
+                "max_ms": round(max(samples) * 1000, 3),
+            }
+            for endpoint, samples in sorted(self.latencies.items())
+        }
+
+
+def _percentile(samples: List[float], p: float) -> float:
+    """Перцентиль по ближайшему рангу, в миллисекундах."""
+    ordered = sorted(samples)
+    rank = max(1, -(-len(ordered) * p // 100))
+    return round(ordered[int(rank) - 1] * 1000, 3)
+
+
+def _auth(api_key: str) -> Dict[str, str]:
+    return {"Authorization": f"TOKEN {api_key}"}
+
+
+async def _gather(concurrency: int, total: int, job: Callable[[int], Awaitable[None]]) -> None:
+    """total вызовов job(i), не больше concurrency одновременно."""
+    counter = iter(range(total))
+
+    async def worker() -> None:
+        for i in counter:
+            await job(i)
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+
+
+# ---------- подготовка ----------
+async def _register(client: httpx.AsyncClient, role: str = "USER") -> dict:
+    response = await client.post(
+        "/api/v1/public/register", json={"name": f"bench_{uuid4().hex[:12]}", "role": role}
+    )
+    response.raise_for_status()
+    return response.json()
+
+
+async def _bulk(client: httpx.AsyncClient, admin: dict, path: str, rows: List[dict]) -> List[dict]:
+    response = await client.post(path, json=rows, headers=_auth(admin["api_key"]))
+    response.raise_for_status()
+    results = response.json()["results"]
+    failed = [r for r in results if not r["success"]]
+    if failed:
+        raise RuntimeError(f"{path}: {failed[:3]}")
+    return results
+
+
+async def setup(client: httpx.AsyncClient, traders: int) -> List[dict]:
+    """Инструмент и пополненные трейдеры — массовыми админскими ручками."""
+    admin = await _register(client, role="ADMIN")
+    response = await client.post(
+        "/api/v1/admin/instrument",
+        json={"name": "Bench / RUB", "ticker": TICKER},
+        headers=_auth(admin["api_key"]),
+    )
+    if response.status_code not in (201, 409):
+        response.raise_for_status()
+
+    users = await _bulk(client, admin, "/api/v1/admin/users/bulk", [
+        {"name": f"bench_{uuid4().hex[:12]}"} for _ in range(traders)
+    ])
+    await _bulk(client, admin, "/api/v1/admin/balance/deposit/bulk", [
+        {"user_id": u["id"], "ticker": ticker, "amount": amount}
+        for u in users
+        for ticker, amount in (("RUB", FUNDS_RUB), (TICKER, FUNDS_ASSET))
+    ])
+    return users
+
+
+# ---------- сценарии ----------
+async def order_entry(client: httpx.AsyncClient, users: List[dict], requests: int, concurrency: int) -> Recorder:
+    rec = Recorder()
+    rnd = random.Random(1)
+
+    async def job(i: int) -> None:
+        user = users[i % len(users)]
+        side = "BUY" if i % 2 else "SELL"
+        # Цены пересекаются около середины — часть заявок исполняется
+        price = MID_PRICE + rnd.randint(-5, 5)
+        await rec.call("POST /api/v1/order", client.post(
+            "/api/v1/order",
+            json={"direction": side, "ticker": TICKER, "qty": rnd.randint(1, 10), "price": price},
+            headers=_auth(user["api_key"]),
+        ))
+
+    await _gather(concurrency, requests, job)
+    rec.stop()
+    return rec
+
+
+async def cancel_storm(client: httpx.AsyncClient, users: List[dict], requests: int, concurrency: int) -> Recorder:
+    # Заявки далеко от середины, чтобы ничего не исполнилось до отмены
+    placed: List[tuple] = []
+
+    async def place(i: int) -> None:
+        user = users[i % len(users)]
+        buy = i % 2 == 0
+        response = await client.post(
+            "/api/v1/order",
+            json={
+                "direction": "BUY" if buy else "SELL",
+                "ticker": TICKER,
+                "qty": 1,
+                "price": MID_PRICE // 2 - i % 50 if buy else MID_PRICE * 2 + i % 50,
+            },
+            headers=_auth(user["api_key"]),
+        )
+        response.raise_for_status()
+        placed.append((user, response.json()["order_id"]))
+
+    await _gather(concurrency, requests, place)
+
+    rec = Recorder()
+
+    async def cancel(i: int) -> None:
+        user, order_id = placed[i]
+        await rec.call("DELETE /api/v1/order/{order_id}", client.delete(
+            f"/api/v1/order/{order_id}", headers=_auth(user["api_key"]),
+        ))
+
+    await _gather(concurrency, len(placed), cancel)
+    rec.stop()
+    return rec
+
+
+async def book_polling(client: httpx.AsyncClient, users: List[dict], requests: int, concurrency: int) -> Recorder:
+    # Стакан должен быть непустым: по уровню с каждой стороны
+    user = users[0]
+    for side, price in (("BUY", MID_PRICE // 2), ("SELL", MID_PRICE * 2)):
+        response = await client.post(
+            "/api/v1/order",
+            json={"direction": side, "ticker": TICKER, "qty": 1, "price": price},
+            headers=_auth(user["api_key"]),
+        )
+        response.raise_for_status()
+
+    rec = Recorder()
+
+    async def job(i: int) -> None:
+        if i % 4 == 3:
+            await rec.call("GET /api/v1/public/ticker/{ticker}", client.get(f"/api/v1/public/ticker/{TICKER}"))
+        else:
+            await rec.call("GET /api/v1/public/orderbook/{ticker}", client.get(
+                f"/api/v1/public/orderbook/{TICKER}", params={"limit": 20},
+            ))
+
+    await _gather(concurrency, requests, job)
+    rec.stop()
+    return rec
+
+
+async def registration(client: httpx.AsyncClient, users: List[dict], requests: int, concurrency: int) -> Recorder:
+    rec = Recorder()
+
+    async def job(i: int) -> None:
+        await rec.call("POST /api/v1/public/register", client.post(
+            "/api/v1/public/register", json={"name": f"bench_{uuid4().hex[:12]}"},
+        ))
+
+    await _gather(concurrency, requests, job)
+    rec.stop()
+    return rec
+
+
+RUNNERS = {
+    "order_entry": order_entry,
+    "cancel_storm": cancel_storm,
+    "book_polling": book_polling,
+    "registration": registration,
+}
+
+
+@asynccontextmanager
+async def _client() -> AsyncIterator[httpx.AsyncClient]:
+    # ASGITransport не запускает lifespan — поднимаем его сами
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=60) as client:
+            yield client
+
+
+async def run(scenarios: List[str], requests: int, concurrency: int, traders: int) -> dict:
+    result = {
+        "config": {"requests": requests, "concurrency": concurrency, "traders": traders, "ticker": TICKER},
+        "scenarios": {},
+    }
+    async with _client() as client:
+        users = await setup(client, traders)
+        for name in scenarios:
+            rec = await RUNNERS[name](client, users, requests, concurrency)
+            result["scenarios"][name] = {"elapsed_s": round(rec.elapsed, 3), "endpoints": rec.report()}
+    return result
+
+
+def compare(result: dict, baseline: dict, threshold: float) -> List[str]:
+    """Регрессии: ручки, у которых p99 вырос больше чем в threshold раз."""
+    regressions = []
+    for name, scenario in result["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name, {}).get("endpoints", {})
+        for endpoint, stats in scenario["endpoints"].items():
+            old = before.get(endpoint)
+            if old and old["p99_ms"] and stats["p99_ms"] > old["p99_ms"] * threshold:
+                regressions.append(
+                    f"{name}: {endpoint} p99 {old['p99_ms']} -> {stats['p99_ms']} ms"
+                )
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="через запятую: " + ", ".join(SCENARIOS))
+    parser.add_argument("--requests", type=int, default=1000, help="запросов на сценарий")
+    parser.add_argument("--concurrency", type=int, default=16, help="одновременных клиентов")
+    parser.add_argument("--traders", type=int, default=20, help="пользователей, ставящих заявки")
+    parser.add_argument("--output", help="записать результат в файл (JSON)")
+    parser.add_argument("--compare", help="прошлый результат (JSON) для проверки регрессий")
+    parser.add_argument("--threshold", type=float, default=1.5, help="допустимый рост p99, раз")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(RUNNERS)
+    if unknown:
+        parser.error(f"неизвестные сценарии: {', '.join(sorted(unknown))}")
+
+    result = asyncio.run(run(scenarios, args.requests, args.concurrency, args.traders))
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            regressions = compare(result, json.load(f), args.threshold)
+        for line in regressions:
+            print(line, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
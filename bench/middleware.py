@@ -0,0 +1,119 @@
+"""
+Сравнение пропускной способности стека middleware: BaseHTTPMiddleware
+(как было в app/main.py) против чистого ASGI из app/middleware.py.
+
+Запросы идут in-process через httpx.ASGITransport на ручки той же формы,
+что и /api/v1/order (POST с телом, GET, DELETE без тела), без БД —
+измеряется только накладной расход middleware.
+
+    python -m bench.middleware --requests 5000
+"""
+import argparse
+import asyncio
+import json
+import logging
+import time
+from uuid import uuid4
+
+import httpx
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+from starlette.middleware.base import BaseHTTPMiddleware
+
+from app.middleware import DeleteBodyValidatorMiddleware, RequestLoggingMiddleware
+from app.schemas import CreateOrderResponse, LimitOrderBody, Ok
+
+logger = logging.getLogger("bench")
+
+
+def _routes(app: FastAPI) -> None:
+    @app.post("/api/v1/order", response_model=CreateOrderResponse)
+    async def create_order(body: LimitOrderBody):
+        return CreateOrderResponse(order_id=uuid4())
+
+    @app.get("/api/v1/order/{order_id}", response_model=Ok)
+    async def get_order(order_id: str):
+        return Ok()
+
+    @app.delete("/api/v1/order/{order_id}", response_model=Ok)
+    async def cancel_order(order_id: str):
+        return Ok()
+
+
+def build_before() -> FastAPI:
+    app = FastAPI()
+
+    class DeleteBodyValidator(BaseHTTPMiddleware):
+        async def dispatch(self, request: Request, call_next):
+            if request.method == "DELETE":
+                body = await request.body()
+                if body not in (b"", b"{}"):
+                    return JSONResponse(
+                        status_code=422,
+                        content={"detail": "DELETE-запрос не должен содержать тело"}
+                    )
+            return await call_next(request)
+
+    app.add_middleware(DeleteBodyValidator)
+
+    @app.middleware("http")
+    async def log_requests(request, call_next):
+        logger.debug(f"Входящий запрос: {request.method} {request.url}")
+        response = await call_next(request)
+        logger.debug(f"Ответ: {response.status_code}")
+        return response
+
+    _routes(app)
+    return app
+
+
+def build_after() -> FastAPI:
+    app = FastAPI()
+    app.add_middleware(DeleteBodyValidatorMiddleware)
+    app.add_middleware(RequestLoggingMiddleware)
+    _routes(app)
+    return app
+
+
+async def _run(app: FastAPI, requests: int) -> dict:
+    order = {"direction": "BUY", "ticker": "BTCRUB", "qty": 1, "price": 500000}
+    calls = {
+        "POST /api/v1/order": lambda c: c.post("/api/v1/order", json=order),
+        "GET /api/v1/order/{id}": lambda c: c.get(f"/api/v1/order/{uuid4()}"),
+        "DELETE /api/v1/order/{id}": lambda c: c.delete(f"/api/v1/order/{uuid4()}"),
+    }
+    result = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for name, call in calls.items():
+            for _ in range(min(200, requests)):  # прогрев
+                await call(client)
+            start = time.perf_counter()
+            for _ in range(requests):
+                response = await call(client)
+                assert response.status_code == 200, response.text
+            elapsed = time.perf_counter() - start
+            result[name] = round(requests / elapsed, 1)
+    return result
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--requests", type=int, default=3000, help="запросов на ручку")
+    args = parser.parse_args()
+
+    # Логи не пишем ни в одном варианте: сравниваем только middleware
+    logging.basicConfig(level=logging.WARNING)
+
+    before = asyncio.run(_run(build_before(), args.requests))
+    after = asyncio.run(_run(build_after(), args.requests))
+    print(json.dumps({
+        "unit": "requests/s",
+        "before": before,
+        "after": after,
+        "speedup": {k: round(after[k] / before[k], 2) for k in before},
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
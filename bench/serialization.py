@@ -0,0 +1,166 @@
+"""
+Стоимость сериализации строки в ответах истории заявок и сделок: как было
+(ORM-объекты -> модели Pydantic -> повторная валидация по response_model)
+против быстрого пути (колонки -> dict -> orjson, app/responses.py).
+
+Запросы идут in-process через httpx.ASGITransport на ручки той же формы,
+что GET /api/v1/order и GET /api/v1/public/transactions/{ticker}; строки
+готовятся заранее в памяти, БД не участвует — измеряется только путь
+от строк выборки до байтов ответа.
+
+    python -m bench.serialization --rows 1000 --requests 50
+"""
+import argparse
+import asyncio
+import json
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta, timezone
+from typing import List, Union
+from uuid import uuid4
+
+import httpx
+from fastapi import FastAPI
+
+from app.api.orders import ORDER_COLUMNS, _order_json
+from app.models import Order, OrderSideEnum, OrderStatusEnum, Transaction
+from app.responses import ORJSONResponse
+from app.schemas import LimitOrder, LimitOrderBody, MarketOrder, MarketOrderBody
+from app.schemas import Transaction as TransactionSchema
+
+# Строка select(*ORDER_COLUMNS) / select(колонки Transaction): доступ по атрибутам, как у Row
+OrderRow = namedtuple("OrderRow", [c.key for c in ORDER_COLUMNS])
+TradeRow = namedtuple("TradeRow", ["ticker", "quantity", "price", "timestamp"])
+
+
+def _orders(n: int) -> List[OrderRow]:
+    user_id = uuid4()
+    start = datetime.now(timezone.utc)
+    return [
+        OrderRow(
+            id=uuid4(),
+            status=OrderStatusEnum.PARTIALLY_EXECUTED,
+            user_id=user_id,
+            created_at=start - timedelta(seconds=i),
+            side=OrderSideEnum.BUY if i % 2 else OrderSideEnum.SELL,
+            ticker="BTCRUB",
+            quantity=10,
+            # Каждая пятая — рыночная
+            price=None if i % 5 == 0 else 500000 + i,
+            filled_qty=3,
+        )
+        for i in range(n)
+    ]
+
+
+def _trades(n: int) -> List[TradeRow]:
+    start = datetime.now(timezone.utc)
+    return [
+        TradeRow(ticker="BTCRUB", quantity=1 + i % 7, price=500000 + i, timestamp=start - timedelta(seconds=i))
+        for i in range(n)
+    ]
+
+
+def build_before(orders: List[OrderRow], trades: List[TradeRow]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/orders", response_model=List[Union[LimitOrder, MarketOrder]])
+    async def list_orders():
+        # Как было: select(Order) -> ORM-объекты -> модели на каждую строку
+        result = []
+        for r in orders:
+            o = Order(**r._asdict())
+            if o.price is not None:
+                body = LimitOrderBody(direction=o.side, ticker=o.ticker, qty=int(o.quantity), price=int(o.price))
+                result.append(LimitOrder(
+                    id=o.id, status=o.status, user_id=o.user_id,
+                    timestamp=o.created_at, body=body, filled=int(o.filled_qty),
+                ))
+            else:
+                body = MarketOrderBody(direction=o.side, ticker=o.ticker, qty=int(o.quantity))
+                result.append(MarketOrder(
+                    id=o.id, status=o.status, user_id=o.user_id,
+                    timestamp=o.created_at, body=body,
+                ))
+        return result
+
+    @app.get("/transactions", response_model=List[TransactionSchema])
+    async def transactions():
+        result = []
+        for r in trades:
+            t = Transaction(ticker=r.ticker, quantity=r.quantity, price=r.price, timestamp=r.timestamp)
+            result.append(TransactionSchema(
+                ticker=t.ticker, amount=int(t.quantity), price=int(t.price), timestamp=t.timestamp,
+            ))
+        return result
+
+    return app
+
+
+def build_after(orders: List[OrderRow], trades: List[TradeRow]) -> FastAPI:
+    app = FastAPI()
+
+    @app.get("/orders", response_model=List[Union[LimitOrder, MarketOrder]])
+    async def list_orders():
+        return ORJSONResponse([_order_json(o) for o in orders])
+
+    @app.get("/transactions", response_model=List[TransactionSchema])
+    async def transactions():
+        return ORJSONResponse([
+            {"ticker": t.ticker, "amount": t.quantity, "price": t.price, "timestamp": t.timestamp}
+            for t in trades
+        ])
+
+    return app
+
+
+async def _run(app: FastAPI, rows: int, requests: int) -> dict:
+    result = {}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        for path in ("/orders", "/transactions"):
+            for _ in range(min(5, requests)):  # прогрев
+                await client.get(path)
+            start = time.perf_counter()
+            for _ in range(requests):
+                response = await client.get(path)
+                assert response.status_code == 200, response.text
+            elapsed = time.perf_counter() - start
+            result[path] = round(elapsed / (requests * rows) * 1e6, 3)
+    return result
+
+
+async def _same_payload(before: FastAPI, after: FastAPI) -> None:
+    """Быстрый путь должен отдавать тот же JSON, что и прежний."""
+    for path in ("/orders", "/transactions"):
+        bodies = []
+        for app in (before, after):
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+                bodies.append((await client.get(path)).json())
+        assert bodies[0] == bodies[1], f"{path}: ответы различаются"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--rows", type=int, default=1000, help="строк в ответе")
+    parser.add_argument("--requests", type=int, default=50, help="запросов на ручку")
+    args = parser.parse_args()
+
+    orders, trades = _orders(args.rows), _trades(args.rows)
+    before, after = build_before(orders, trades), build_after(orders, trades)
+    asyncio.run(_same_payload(before, after))
+
+    before_us = asyncio.run(_run(before, args.rows, args.requests))
+    after_us = asyncio.run(_run(after, args.rows, args.requests))
+    print(json.dumps({
+        "unit": "us/row",
+        "rows": args.rows,
+        "before": before_us,
+        "after": after_us,
+        "speedup": {k: round(before_us[k] / after_us[k], 2) for k in before_us},
+    }, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
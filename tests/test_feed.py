@@ -0,0 +1,25 @@
+import asyncio
+
+from app.matching.book import OrderBook
+from app.matching.feed import MarketFeed
+
+
+def test_close_wakes_subscribers_of_lost_ticker():
+    async def scenario():
+        feed = MarketFeed()
+        sub = feed.subscribe(OrderBook("AAA"))
+        other = feed.subscribe(OrderBook("BBB"))
+        assert (await sub.get(1)).type == "snapshot"
+
+        reader = asyncio.create_task(sub.get(10))
+        await asyncio.sleep(0)
+        feed.close("AAA")
+        assert await asyncio.wait_for(reader, 1) is None
+        assert sub.closed and not sub.active
+        assert other.active
+
+        # Новые события закрытому подписчику не доставляются
+        feed.reset(OrderBook("AAA"))
+        assert sub.queue.empty()
+
+    asyncio.run(scenario())
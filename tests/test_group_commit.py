@@ -0,0 +1,166 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
+
+import pytest
+from sqlalchemy.exc import DBAPIError
+
+from app.matching.sequencer import Sequencer, lock_conflict
+
+
+class PgError(Exception):
+    """Как ошибка asyncpg после перевода SQLAlchemy: код в sqlstate."""
+
+    def __init__(self, sqlstate: str):
+        super().__init__(sqlstate)
+        self.sqlstate = sqlstate
+
+
+class RowLocks:
+    """Построчные блокировки до конца транзакции с поиском взаимных ожиданий."""
+
+    def __init__(self):
+        self.holder: Dict[str, "Txn"] = {}
+        self.waiting: Dict["Txn", str] = {}
+
+    def _waits_for(self, txn: "Txn", other: "Txn") -> bool:
+        seen = set()
+        while txn not in seen:
+            seen.add(txn)
+            row = self.waiting.get(txn)
+            txn = self.holder.get(row) if row is not None else None
+            if txn is None:
+                return False
+            if txn is other:
+                return True
+        return False
+
+    async def lock(self, txn: "Txn", row: str) -> None:
+        while True:
+            owner = self.holder.get(row)
+            if owner is None or owner is txn:
+                self.holder[row] = txn
+                self.waiting.pop(txn, None)
+                return
+            if self._waits_for(owner, txn):
+                self.waiting.pop(txn, None)
+                raise DBAPIError("UPDATE balances", {}, PgError("40P01"))
+            self.waiting[txn] = row
+            await asyncio.sleep(0.001)
+
+    def release(self, txn: "Txn") -> None:
+        self.holder = {row: t for row, t in self.holder.items() if t is not txn}
+        self.waiting.pop(txn, None)
+        # Освободившуюся строку получает ждущая транзакция, как в Postgres
+        for waiter, row in list(self.waiting.items()):
+            self.holder.setdefault(row, waiter)
+
+
+class Txn:
+    def __init__(self, locks: RowLocks, tickers: List[str]):
+        self.locks = locks
+        self.tickers = tickers
+
+    async def lock(self, row: str) -> None:
+        await self.locks.lock(self, row)
+
+
+def _sequencer(locks: RowLocks, groups: List[List[str]]) -> Sequencer:
+    @asynccontextmanager
+    async def group(tickers):
+        txn = Txn(locks, tickers)
+        groups.append(tickers)
+        try:
+            yield txn
+        finally:
+            # Коммит или откат: блокировки отпускаются
+            locks.release(txn)
+
+    return Sequencer(group=group, window_ms=20)
+
+
+def _hold(row: str, result: Optional[str] = None):
+    async def command(txn: Txn) -> str:
+        await txn.lock(row)
+        # Остальные команды группы и чужая группа идут, пока строка заблокирована
+        await asyncio.sleep(0.005)
+        return result or row
+
+    return command
+
+
+def test_deadlock_between_tickers_sharing_users_is_retried():
+    async def scenario():
+        locks, groups = RowLocks(), []
+        seq = _sequencer(locks, groups)
+        # Группы двух тикеров блокируют балансы alice и bob в разном порядке
+        results = await asyncio.wait_for(asyncio.gather(
+            seq.run("AAA", _hold("alice")),
+            seq.run("AAA", _hold("bob")),
+            seq.run("BBB", _hold("bob")),
+            seq.run("BBB", _hold("alice")),
+        ), 5)
+        assert results == ["alice", "bob", "bob", "alice"]
+        # Две исходные группы и два повтора откаченной по одной команде
+        assert len(groups) == 4
+        assert not locks.holder
+        await seq.stop()
+
+    asyncio.run(scenario())
+
+
+def test_exclusive_command_is_retried_after_deadlock():
+    async def scenario():
+        locks, groups = RowLocks(), []
+        seq = _sequencer(locks, groups)
+
+        async def both(txn: Txn) -> str:
+            await txn.lock("alice")
+            # Дольше окна group commit: группа AAA успевает начаться
+            await asyncio.sleep(0.05)
+            await txn.lock("bob")
+            return "batch"
+
+        # Пакет замыкает цикл ожиданий последним — откатывают его
+        results = await asyncio.wait_for(asyncio.gather(
+            seq.run("AAA", _hold("bob")),
+            seq.run_exclusive(["BBB", "CCC"], both),
+            seq.run("AAA", _hold("alice")),
+        ), 5)
+        assert results == ["bob", "batch", "alice"]
+        assert groups.count(["BBB", "CCC"]) == 2
+        assert not locks.holder
+        await seq.stop()
+
+    asyncio.run(scenario())
+
+
+def test_other_errors_fail_the_whole_group():
+    async def scenario():
+        groups: List[List[str]] = []
+
+        @asynccontextmanager
+        async def group(tickers):
+            groups.append(tickers)
+            yield None
+
+        async def broken(txn):
+            raise DBAPIError("INSERT INTO orders", {}, PgError("23505"))
+
+        seq = Sequencer(group=group, window_ms=20)
+        first = asyncio.ensure_future(seq.run("AAA", broken))
+        second = asyncio.ensure_future(seq.run("AAA", _hold("alice")))
+        for task in (first, second):
+            with pytest.raises(DBAPIError):
+                await task
+        assert len(groups) == 1
+        await seq.stop()
+
+    asyncio.run(scenario())
+
+
+def test_lock_conflict_sqlstates():
+    assert lock_conflict(DBAPIError("", {}, PgError("40P01")))
+    assert lock_conflict(DBAPIError("", {}, PgError("40001")))
+    assert not lock_conflict(DBAPIError("", {}, PgError("23505")))
+    assert not lock_conflict(RuntimeError("boom"))
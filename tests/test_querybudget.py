@@ -0,0 +1,77 @@
+import asyncio
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event, text
+
+from app import querybudget
+from app.matching.sequencer import Sequencer
+
+
+@pytest.fixture
+def db():
+    engine = create_engine("sqlite://")
+    event.listen(engine, "before_cursor_execute", querybudget._count)
+    with engine.connect() as conn:
+        yield conn
+    engine.dispose()
+
+
+def test_group_commit_statements_are_attributed_to_requests(db, monkeypatch):
+    report = querybudget.QueryReport()
+    monkeypatch.setattr(querybudget, "query_report", report)
+
+    @asynccontextmanager
+    async def group(tickers):
+        yield db
+        # Запись группы: одна на все её команды
+        db.execute(text("SELECT 'flush'"))
+
+    async def hold(conn):
+        conn.execute(text("SELECT 'hold'"))
+
+    seq = Sequencer(group=group, window_ms=20)
+
+    async def endpoint(scope, receive, send):
+        db.execute(text("SELECT 'auth'"))
+        await seq.run("AAA", hold)
+
+    middleware = querybudget.QueryBudgetMiddleware(endpoint)
+
+    def request(path):
+        scope = {"type": "http", "method": "POST", "route": SimpleNamespace(path=path)}
+        return middleware(scope, None, None)
+
+    async def scenario():
+        # Обе команды попадают в одну группу
+        await asyncio.gather(request("/orders"), request("/orders/replace"))
+        await seq.stop()
+
+    asyncio.run(scenario())
+    routes = report.as_dict()
+    # auth в задаче запроса, hold — команда запроса, flush — общая запись группы
+    assert routes["POST /orders"]["queries"] == 3
+    assert routes["POST /orders/replace"]["queries"] == 3
+
+
+def test_statements_outside_requests_are_not_counted(db, monkeypatch):
+    report = querybudget.QueryReport()
+    monkeypatch.setattr(querybudget, "query_report", report)
+
+    @asynccontextmanager
+    async def group(tickers):
+        yield db
+        db.execute(text("SELECT 'flush'"))
+
+    async def hold(conn):
+        conn.execute(text("SELECT 'hold'"))
+
+    async def scenario():
+        seq = Sequencer(group=group)
+        # Фоновая задача (reaper, проверка владения) — не HTTP-запрос
+        await seq.run("AAA", hold)
+        await seq.stop()
+
+    asyncio.run(scenario())
+    assert report.as_dict() == {}
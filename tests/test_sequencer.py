@@ -0,0 +1,188 @@
+import asyncio
+from typing import Dict, List, Optional
+
+import pytest
+from sqlalchemy.exc import PendingRollbackError
+
+from app.matching.sequencer import Sequencer, ShardTaken, TickerNotOwned, advisory_key, shard_key
+
+
+class FakeServer:
+    """Postgres с точки зрения advisory lock'ов: ключ -> соединение-владелец."""
+
+    def __init__(self):
+        self.locks: Dict[int, "FakeConnection"] = {}
+        self.connections: List["FakeConnection"] = []
+        self.down = False
+
+
+class FakeConnection:
+    """
+    Как AsyncConnection SQLAlchemy: запрос начинает транзакцию, а после
+    invalidate() без rollback() любой запрос падает с PendingRollbackError.
+    """
+
+    def __init__(self, server: FakeServer):
+        self.server = server
+        self.in_transaction = False
+        self.invalidated = False
+        self.closed = False
+
+    def _begin(self) -> None:
+        if self.invalidated and self.in_transaction:
+            raise PendingRollbackError("Can't reconnect until invalid transaction is rolled back")
+        if self.server.down or self.closed:
+            self.in_transaction = True
+            raise OSError("connection is closed")
+        self.in_transaction = True
+
+    async def scalar(self, statement, params: Optional[dict] = None):
+        self._begin()
+        key = params["key"]
+        owner = self.server.locks.setdefault(key, self)
+        return owner is self
+
+    async def execute(self, statement, params: Optional[dict] = None):
+        self._begin()
+        return [(key,) for key, owner in self.server.locks.items() if owner is self]
+
+    async def commit(self) -> None:
+        self.in_transaction = False
+
+    async def rollback(self) -> None:
+        self.in_transaction = False
+
+    def _release(self) -> None:
+        # Postgres отпускает lock'и сессии вместе с соединением
+        self.server.locks = {k: c for k, c in self.server.locks.items() if c is not self}
+
+    async def invalidate(self) -> None:
+        self.invalidated = True
+        self._release()
+
+    async def close(self) -> None:
+        self.closed = True
+        self.in_transaction = False
+        self._release()
+
+
+class FakeEngine:
+    def __init__(self, server: FakeServer):
+        self.server = server
+
+    async def connect(self) -> FakeConnection:
+        if self.server.down:
+            raise OSError("connection refused")
+        conn = FakeConnection(self.server)
+        self.server.connections.append(conn)
+        return conn
+
+
+async def _noop(group) -> str:
+    return "done"
+
+
+def test_lost_connection_drops_tickers_and_reclaims_on_fresh_connection():
+    async def scenario():
+        server = FakeServer()
+        seq = Sequencer()
+        assert await seq.claim(FakeEngine(server), ["AAA", "BBB"]) == {"AAA", "BBB"}
+        assert await seq.run("AAA", _noop) == "done"
+
+        # Обрыв: lock'и отпущены, проверка владения не проходит
+        server.down = True
+        await server.connections[0].invalidate()
+        assert await seq.verify() == {"AAA", "BBB"}
+        assert not seq.owns("AAA")
+        with pytest.raises(TickerNotOwned):
+            await seq.run("AAA", _noop)
+
+        # Пока БД недоступна, захват не проходит и тикеры остаются потерянными
+        with pytest.raises(OSError):
+            await seq.claim(FakeEngine(server), sorted(seq.lost()))
+        assert seq.lost() == {"AAA", "BBB"}
+
+        # БД вернулась: захват на новом соединении, а не на испорченном старом
+        server.down = False
+        assert await seq.claim(FakeEngine(server), sorted(seq.lost())) == {"AAA", "BBB"}
+        assert server.connections[-1] is not server.connections[0]
+        assert set(server.locks) == {shard_key(0, 1), advisory_key("AAA"), advisory_key("BBB")}
+
+        # До восстановления стакана команды по тикеру не принимаются
+        with pytest.raises(TickerNotOwned):
+            await seq.run("AAA", _noop)
+        seq.restored(["AAA", "BBB"])
+        assert await seq.run("AAA", _noop) == "done"
+        assert await seq.verify() == set()
+        await seq.stop()
+
+    asyncio.run(scenario())
+
+
+def test_failed_claim_does_not_poison_later_claims():
+    async def scenario():
+        server = FakeServer()
+        seq = Sequencer()
+        await seq.claim(FakeEngine(server), [])
+
+        # Сбой на самом захвате: тикер не наш и ждёт захвата с восстановлением
+        server.down = True
+        with pytest.raises(TickerNotOwned):
+            await seq.run("CCC", _noop)
+        assert seq.lost() == {"CCC"}
+
+        server.down = False
+        assert await seq.claim(FakeEngine(server), ["CCC"]) == {"CCC"}
+        seq.restored(["CCC"])
+        assert await seq.run("CCC", _noop) == "done"
+        await seq.stop()
+
+    asyncio.run(scenario())
+
+
+def test_stopped_owner_fails_waiting_commands():
+    async def scenario():
+        server = FakeServer()
+        seq = Sequencer()
+        await seq.claim(FakeEngine(server), ["AAA", "BBB"])
+        started = asyncio.Event()
+
+        async def slow(group):
+            started.set()
+            await asyncio.sleep(10)
+
+        running = asyncio.create_task(seq.run("BBB", slow))
+        await started.wait()
+        queued = asyncio.create_task(seq.run("BBB", _noop))
+        exclusive = asyncio.create_task(seq.run_exclusive(["AAA", "BBB"], _noop))
+        await asyncio.sleep(0)
+
+        # Lock на BBB отпущен (например, его снял администратор)
+        server.locks.pop(advisory_key("BBB"))
+        assert await seq.verify() == {"BBB"}
+        for task in (running, queued, exclusive):
+            with pytest.raises(TickerNotOwned):
+                await task
+        assert await seq.run("AAA", _noop) == "done"
+        await seq.stop()
+
+    asyncio.run(scenario())
+
+
+def test_second_process_on_the_same_shard_refuses_to_start():
+    async def scenario():
+        server = FakeServer()
+        first, second, other = Sequencer(shard="0/2"), Sequencer(shard="0/2"), Sequencer(shard="1/2")
+        await first.claim(FakeEngine(server), [])
+        # Как второй воркер uvicorn --workers с той же долей
+        with pytest.raises(ShardTaken):
+            await second.claim(FakeEngine(server), [])
+        await other.claim(FakeEngine(server), [])
+
+        # Доля освободилась — её можно забрать
+        await first.stop()
+        await second.claim(FakeEngine(server), [])
+        await second.stop()
+        await other.stop()
+
+    asyncio.run(scenario())